@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+opt = None
+
+
+def get_options():
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Benchmarks for the smf_midi library')
+
+    # Optional keyword arguments
+    parser.add_argument('--tracks', required=False, type=int, action='append',
+                        help="Track counts for the merge benchmark (may be repeated)")
+    parser.add_argument('--events', required=False, type=int, default=2000,
+                        help="Note events per track in generated files")
+    parser.add_argument('--memory-limit', required=False, type=int, default=65536, dest='memory_limit',
+                        help="Total track buffer memory for the bounded memory merge")
+    parser.add_argument('--repeat', required=False, type=int, default=10,
+                        help="Runs of each command for the import time benchmark (the fastest is reported)")
+    parser.add_argument('--child', required=False, nargs=3, metavar=('FILE', 'MODE', 'MEMORY_LIMIT'),
+                        help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+
+
+def generate_file(file_name: str, track_count: int, events: int):
+    """
+    Writes a type 1 file with track_count tracks of short notes on rotating channels
+    """
+    from smf_midi import FileWriter, TrackEvent
+
+    with FileWriter(file_name, 1, 480) as writer:
+        writer.new_track()
+        writer.add_tempo(120)
+        writer.write_event(end_of_track())
+        writer.close_track()
+        for track_no in range(1, track_count):
+            channel = track_no % 16
+            writer.new_track()
+            writer.write_event(TrackEvent.new_track_name(f"Track {track_no}"))
+            note = 36 + track_no % 60
+            for idx in range(events // 2):
+                writer.write_bytes(b'\x00' + bytes((0x90 | channel, note, 80)))
+                writer.write_bytes(b'\x83\x60' + bytes((0x80 | channel, note, 0)))
+            writer.write_event(end_of_track())
+            writer.close_track()
+
+
+def end_of_track():
+    from smf_midi import TrackEvent, END_OF_TRACK_INDICATOR
+
+    event = TrackEvent()
+    event.set_delta_ticks(0)
+    event.event_bytes = bytearray(END_OF_TRACK_INDICATOR)
+    return event
+
+
+def measure_merge(file_name: str, mode: str, memory_limit: int):
+    """
+    Runs in a child process so peak memory is not affected by earlier runs
+    """
+    import resource
+    from smf_midi import FileReader
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    reader = FileReader(file_name)
+    kwargs = {}
+    if mode == 'bounded':
+        kwargs['memory_limit'] = memory_limit
+    events = 0
+    for _ in reader.get_events_from_tracks(**kwargs):
+        events += 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({'events': events, 'seconds': elapsed, 'peak_python_bytes': peak,
+                      'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      'buffer_bytes': reader.buffer_bytes}))
+
+
+def measure_events(file_name: str, mode: str):
+    """
+    Reads every event of every track with Track.get_events, with or without reuse.  Runs in a child process.
+    Event objects counts the TrackEvent instances yielded, the second pass measures memory with tracemalloc.
+    """
+    from smf_midi import FileReader
+
+    reader = FileReader(file_name)
+    kwargs = {'reuse': mode == 'reuse'}
+    events = 0
+    event_objects = 0
+    start = time.perf_counter()
+    for track in reader.tracks:
+        previous = None
+        for event in track.get_events(**kwargs):
+            events += 1
+            if event is not previous:
+                event_objects += 1
+            previous = event
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for track in reader.tracks:
+        for _ in track.get_events(**kwargs):
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({'events': events, 'seconds': elapsed, 'event_objects': event_objects,
+                      'peak_python_bytes': peak}))
+
+
+def benchmark_events():
+    track_counts = opt.tracks or [16, 64, 256]
+    print(f"{'tracks':>6} | {'mode':8} | {'events':>8} | {'ev/sec':>9} | {'event objs':>10} | {'py peak KB':>10}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for track_count in track_counts:
+            file_name = os.path.join(temp_dir, f"bench_{track_count}.midi")
+            generate_file(file_name, track_count, opt.events)
+            for mode, child_mode in (('default', 'events'), ('reuse', 'reuse')):
+                output = subprocess.run([sys.executable, __file__, '--child', file_name, child_mode, '0'],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                print(f"{track_count:6} | {mode:8} | {result['events']:8} "
+                      f"| {result['events'] / result['seconds']:9.0f} | {result['event_objects']:10} "
+                      f"| {result['peak_python_bytes'] // 1024:10}")
+
+
+def benchmark_merge():
+    track_counts = opt.tracks or [16, 64, 256]
+    print(f"{'tracks':>6} | {'mode':8} | {'events':>8} | {'ev/sec':>9} | {'py peak KB':>10} | {'rss KB':>8} "
+          f"| {'buffers KB':>10}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for track_count in track_counts:
+            file_name = os.path.join(temp_dir, f"bench_{track_count}.midi")
+            generate_file(file_name, track_count, opt.events)
+            for mode in ('default', 'bounded'):
+                output = subprocess.run([sys.executable, __file__, '--child', file_name, mode, str(opt.memory_limit)],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                print(f"{track_count:6} | {mode:8} | {result['events']:8} "
+                      f"| {result['events'] / result['seconds']:9.0f} | {result['peak_python_bytes'] // 1024:10} "
+                      f"| {result['max_rss_kb']:8} | {result['buffer_bytes'] // 1024:10}")
+
+
+def benchmark_import():
+    """
+    Start up time of a fresh interpreter for each command, the fastest of opt.repeat runs
+    """
+    tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'midi_tool.py')
+    commands = [
+        ("python", [sys.executable, '-c', 'pass']),
+        ("import smf_midi", [sys.executable, '-c', 'import smf_midi']),
+        ("FileReader", [sys.executable, '-c', 'from smf_midi import FileReader']),
+        ("everything", [sys.executable, '-c', 'import smf_midi; [getattr(smf_midi, n) for n in dir(smf_midi)]']),
+        ("midi_tool --help", [sys.executable, tool, '--help']),
+        ("midi_tool validate -h", [sys.executable, tool, 'validate', '--help']),
+    ]
+    print(f"{'command':22} | {'ms':>8}")
+    for name, command in commands:
+        best = None
+        for _ in range(opt.repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:22} | {best * 1000:8.1f}")
+
+
+def main():
+
+    get_options()
+    if opt.child:
+        file_name, mode, memory_limit = opt.child
+        if mode in ('default', 'bounded'):
+            measure_merge(file_name, mode, int(memory_limit))
+        else:
+            measure_events(file_name, 'reuse' if mode == 'reuse' else 'default')
+        return
+
+    print("Merge tracks (get_events_from_tracks)")
+    benchmark_merge()
+    print()
+    print("Read track events (Track.get_events)")
+    benchmark_events()
+    print()
+    print("Start up time")
+    benchmark_import()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import smf_midi
+import logging
+from smf_midi.combine import concatenate, layer
+
+
+opt = None
+logger = logging.getLogger("combine_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Concatenate MIDI files one after the other or layer them as '
+                                                 'extra tracks')
+
+    # Positional required arguments
+    parser.add_argument('mode', choices=['concat', 'layer'],
+                        help="'concat' plays the files in sequence, 'layer' plays them together")
+    parser.add_argument('file_out',
+                        help="Name of the output MIDI file")
+    parser.add_argument('files_in', nargs='+',
+                        help="Names of the input MIDI files, in order")
+
+    # Optional keyword arguments
+    parser.add_argument('--division', required=False, type=int,
+                        help="Time division of the output (default is the division of the first file)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    kwargs = {}
+    if opt.division:
+        kwargs['division'] = opt.division
+    if opt.mode == 'concat':
+        concatenate(opt.files_in, opt.file_out, **kwargs)
+    else:
+        layer(opt.files_in, opt.file_out, **kwargs)
+    logger.info(f"Wrote {len(opt.files_in)} files to '{opt.file_out}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import json
+import logging
+from smf_midi import util
+from smf_midi.stats import scan_corpus
+
+opt = None
+logger = logging.getLogger("corpus_stats")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Compute statistics across a corpus of MIDI files')
+
+    # Positional required arguments
+    parser.add_argument('paths', nargs='+',
+                        help="MIDI files and/or directories to scan")
+
+    # Optional keyword arguments
+    parser.add_argument('--output', required=False,
+                        help="JSON file to write the statistics to (default stdout)")
+    parser.add_argument('--workers', required=False, type=int,
+                        help="Number of worker processes (default is the number of CPUs)")
+    parser.add_argument('--batch-size', required=False, type=int, default=32, dest='batch_size',
+                        help="Number of files each worker scans per batch")
+    parser.add_argument('--resume', required=False,
+                        help="Checkpoint file used to save progress and resume an interrupted scan")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+
+    stats = scan_corpus(opt.paths, workers=opt.workers, batch_size=opt.batch_size, checkpoint=opt.resume)
+    logger.info(f"Scanned {stats.files} files ({len(stats.errors)} errors)")
+
+    if opt.output:
+        with open(opt.output, "w") as fh:
+            json.dump(stats.to_dict(), fh, indent=2)
+    else:
+        print(json.dumps(stats.to_dict(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
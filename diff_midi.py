@@ -0,0 +1,50 @@
+import argparse
+import logging
+import sys
+from smf_midi import util
+from smf_midi.diff import diff_files
+
+opt = None
+logger = logging.getLogger("diff_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Show the event differences between two MIDI files')
+
+    # Positional required arguments
+    parser.add_argument('file_a',
+                        help="Name of the original MIDI file")
+    parser.add_argument('file_b',
+                        help="Name of the changed MIDI file")
+
+    # Optional keyword arguments
+    parser.add_argument('--by', required=False, choices=['track', 'channel'], default='track',
+                        help="Align events within each track (default) or each channel")
+    parser.add_argument('--limit', required=False, type=int,
+                        help="Maximum number of changes to print")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+
+    changes = diff_files(opt.file_a, opt.file_b, opt.by)
+    for change in changes[:opt.limit]:
+        print(change)
+    if len(changes) > 0:
+        logger.info(f"{len(changes)} changes")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,16 @@
 import argparse
 from smf_midi import FileReader, util, TrackEvent, Timer
+from smf_midi.bargrid import TimeSignatureMap
 import logging
 
 opt = None
 
-time_signatures = {}
+time_signatures = TimeSignatureMap()
 tempo_changes = {}
 time_division = 0
 
 
-def get_options():
+def get_options(args=None):
     """
     Parses the command line options
     """
@@ -25,21 +26,41 @@ def get_options():
     # Optional keyword arguments
     parser.add_argument('--select', action='append', dest='select', required=False,
                         help="Selection <chan>:<start>:<end>")
+    parser.add_argument('--measures', required=False,
+                        help="Only events in measures <first>[:<last>] (one based, last included)")
     parser.add_argument('--skip-notes', action="store_true", dest='skip_notes', required=False,
                         help="Print only non-note data")
     parser.add_argument('--debug', action="store_true", dest='debug', required=False,
                         help="Additional features for debugging")
-    opt = parser.parse_args()
+    opt = parser.parse_args(args)
 
 
 def print_header_dump(midi_file: FileReader):
     print(f"|{'HEADER':=^31}|")
     print("| type | tracks | time division |")
     print(f"| {midi_file.type:^4} | {midi_file.track_count:^6} | {midi_file.time:^13} |")
+    if midi_file.is_time_code_timing:
+        print(f"SMPTE timing: {midi_file.frame_rate} frames/sec, {midi_file.ticks_per_frame} ticks/frame")
+
+
+def get_measure_range(midi_file: FileReader):
+    """
+    Returns the (start, end) ticks of the --measures option using the time signatures of track 0
+    """
+    if opt.measures is None:
+        return None
+    if midi_file.is_time_code_timing:
+        raise ValueError("Measures are not available with SMPTE time code timing")
+    first, _, last = opt.measures.partition(':')
+    timer = Timer(midi_file.time, {}, {})
+    for event in midi_file.tracks[0].get_events():
+        timer.update_event(event)
+    return timer.measure_range(int(first), int(last) if last else None)
 
 
 def print_track_dump(midi_file: FileReader):
     track_number = 0
+    measure_range = get_measure_range(midi_file)
     for track in midi_file.tracks:
         track_string = f"TRACK {track_number}"
         print(f"\n|{track_string:=^144}|")
@@ -53,7 +74,16 @@ def print_track_dump(midi_file: FileReader):
         timer = Timer(time_division, time_signatures, tempo_changes)
         for event in track.get_events():
             timer.update_event(event)
-            print_event_detail(event, timer.current_time, timer.absolute_ticks, timer.current_measure)
+            if measure_range is not None:
+                if timer.absolute_ticks >= measure_range[1]:
+                    break
+                if timer.absolute_ticks < measure_range[0]:
+                    continue
+            if timer.is_time_code_timing:
+                position = timer.current_time_code
+            else:
+                position = timer.current_measure
+            print_event_detail(event, timer.current_time, timer.absolute_ticks, position)
         track_number += 1
 
     return
@@ -70,11 +100,11 @@ def print_event_detail(event: TrackEvent, et: str, at_ticks: int, measure_bar: s
     return
 
 
-def main():
+def main(args=None):
 
     global time_division
 
-    get_options()
+    get_options(args)
 
     util.set_logging(debug=opt.debug)
     midi_file = FileReader()
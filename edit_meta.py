@@ -0,0 +1,90 @@
+import argparse
+import smf_midi
+import logging
+
+
+opt = None
+logger = logging.getLogger("edit_meta")
+
+TRACK_NAME = b'\xFF\x03'
+TEXT = b'\xFF\x01'
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Change the name or text of one track, copying all other tracks '
+                                                 'unchanged')
+
+    # Positional required arguments
+    parser.add_argument('file_in',
+                        help="Name of the input MIDI file")
+    parser.add_argument('file_out',
+                        help="Name of the output MIDI file")
+
+    # Optional keyword arguments
+    parser.add_argument('--track', required=False, type=int, default=0,
+                        help="Number of the track to edit (default 0)")
+    parser.add_argument('--name', required=False,
+                        help="New track name, replacing any existing name")
+    parser.add_argument('--text', required=False, action='append',
+                        help="Text event replacing all existing text events (may be repeated)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def edit_track(midi_writer: smf_midi.FileWriter, track: smf_midi.track.Track):
+    """
+    Re-encodes a track with the new name and text events at the start, dropping the events they replace
+    """
+    replaced = []
+    midi_writer.new_track()
+    if opt.name is not None:
+        midi_writer.write_event(smf_midi.TrackEvent.new_track_name(opt.name))
+        replaced.append(TRACK_NAME)
+    if opt.text is not None:
+        for text in opt.text:
+            midi_writer.write_event(smf_midi.TrackEvent.new_text(text))
+        replaced.append(TEXT)
+
+    # The delta time of a dropped event is carried over to the next event so nothing else moves
+    pending_ticks = 0
+    for event in track.get_events():
+        if any(event.event_bytes.startswith(prefix) for prefix in replaced):
+            logger.debug(f"Replacing {event.description}")
+            pending_ticks += event.delta_ticks
+            continue
+        if pending_ticks > 0:
+            midi_writer.write_event(event, event.delta_ticks + pending_ticks)
+            pending_ticks = 0
+        else:
+            midi_writer.write_event(event)
+    midi_writer.close_track()
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    midi_reader = smf_midi.FileReader(opt.file_in)
+    if not 0 <= opt.track < len(midi_reader.tracks):
+        raise ValueError(f"Track {opt.track} not found, '{opt.file_in}' has {len(midi_reader.tracks)} tracks")
+
+    # Only the edited track is decoded, every other chunk is copied byte for byte
+    with smf_midi.FileWriter(opt.file_out, midi_reader.type, midi_reader.time) as midi_writer:
+        for track_no, track in enumerate(midi_reader.tracks):
+            if track_no == opt.track:
+                edit_track(midi_writer, track)
+            else:
+                midi_writer.copy_track(track)
+    logger.info(f"Edited track {opt.track}, copied {len(midi_reader.tracks) - 1} tracks unchanged")
+
+
+if __name__ == '__main__':
+    main()
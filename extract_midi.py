@@ -0,0 +1,49 @@
+import argparse
+import smf_midi
+import logging
+from smf_midi.extract import extract_range
+
+
+opt = None
+logger = logging.getLogger("extract_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Extract a range of ticks or measures into a new MIDI file')
+
+    # Positional required arguments
+    parser.add_argument('file_in',
+                        help="Name of the input MIDI file")
+    parser.add_argument('file_out',
+                        help="Name of the output MIDI file")
+    parser.add_argument('start', type=int,
+                        help="First tick (or measure with --measures) to extract")
+    parser.add_argument('end', type=int, nargs='?',
+                        help="Tick to stop at (or last measure included with --measures), default end of file")
+
+    # Optional keyword arguments
+    parser.add_argument('--measures', action="store_true", required=False,
+                        help="Start and end are one based measure numbers")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    extract_range(opt.file_in, opt.file_out, opt.start, opt.end, measures=opt.measures)
+    unit = "measures" if opt.measures else "ticks"
+    logger.info(f"Extracted {unit} {opt.start} to {'end' if opt.end is None else opt.end} into '{opt.file_out}'")
+
+
+if __name__ == '__main__':
+    main()
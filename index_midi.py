@@ -0,0 +1,72 @@
+import argparse
+import json
+import logging
+from smf_midi import util
+from smf_midi.index import MetadataIndex
+
+opt = None
+logger = logging.getLogger("index_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Index MIDI file metadata in SQLite and query it')
+    parser.add_argument('--db', required=False, default='midi_index.sqlite',
+                        help="Index database file (default midi_index.sqlite)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help="Index new and changed files")
+    update.add_argument('paths', nargs='+',
+                        help="MIDI files and/or directories to index")
+    update.add_argument('--workers', required=False, type=int,
+                        help="Number of worker processes (default is the number of CPUs)")
+    update.add_argument('--prune', action="store_true", required=False,
+                        help="Remove files from the index that no longer exist")
+
+    find = commands.add_parser('find', help="List indexed files matching all criteria")
+    find.add_argument('--text', required=False,
+                      help="Text contained in a text meta event (track name, lyric, marker...)")
+    find.add_argument('--meta', required=False,
+                      help="Limit --text to a meta event type, e.g. 'copyright' or 'instrument'")
+    find.add_argument('--min-bpm', required=False, type=int, dest='min_bpm')
+    find.add_argument('--max-bpm', required=False, type=int, dest='max_bpm')
+    find.add_argument('--min-duration', required=False, type=float, dest='min_duration',
+                      help="Minimum duration in seconds")
+    find.add_argument('--max-duration', required=False, type=float, dest='max_duration',
+                      help="Maximum duration in seconds")
+    find.add_argument('--channel', required=False, type=int)
+    find.add_argument('--type', required=False, type=int)
+
+    show = commands.add_parser('show', help="Show the indexed metadata for a file")
+    show.add_argument('path')
+
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+
+    with MetadataIndex(opt.db) as index:
+        if opt.command == 'update':
+            count = index.update(opt.paths, workers=opt.workers, prune=opt.prune)
+            logger.info(f"Indexed {count} files")
+        elif opt.command == 'find':
+            for path in index.find(text=opt.text, meta=opt.meta, min_bpm=opt.min_bpm, max_bpm=opt.max_bpm,
+                                   min_duration=opt.min_duration, max_duration=opt.max_duration,
+                                   channel=opt.channel, type=opt.type):
+                print(path)
+        elif opt.command == 'show':
+            print(json.dumps(index.file_info(opt.path), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import importlib
+import os
+import sys
+
+opt = None
+
+# Subcommand -> (script module, description).  A script is only imported when its subcommand is run.
+COMMANDS = {
+    'dump': ('dump_midi_file', "Dump MIDI data to stdout"),
+    'type0': ('type_zero', "Convert Type 1 MIDI to Type 0"),
+    'type1': ('type_one', "Convert Type 0 MIDI to Type 1 with one track per channel"),
+    'split': ('split_type_two', "Split a Type 2 MIDI file into one file per pattern"),
+    'validate': ('validate_midi', "Check the structure of MIDI files"),
+    'stats': ('corpus_stats', "Compute statistics across a corpus of MIDI files"),
+    'index': ('index_midi', "Index MIDI file metadata in SQLite and query it"),
+    'play': ('play_midi', "Play MIDI events in real time to a sink"),
+    'quantize': ('quantize_midi', "Quantize the notes of a MIDI file to a beat grid"),
+    'diff': ('diff_midi', "Show the event differences between two MIDI files"),
+    'edit': ('edit_meta', "Change the name or text of one track"),
+    'extract': ('extract_midi', "Extract a range of ticks or measures into a new MIDI file"),
+    'combine': ('combine_midi', "Concatenate or layer MIDI files"),
+    'motif': ('motif_midi', "Index melodic interval n-grams and search for motifs"),
+}
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    commands = "\n".join(f"  {name:10} {description}" for name, (_, description) in COMMANDS.items())
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Run one of the smf_midi tools',
+                                     epilog=f"commands:\n{commands}\n\nUse '%(prog)s COMMAND --help' for the "
+                                            f"options of a command",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # Positional required arguments
+    parser.add_argument('command', choices=COMMANDS, metavar='COMMAND',
+                        help="Tool to run")
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help="Arguments for the tool")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+
+    module_name, _ = COMMANDS[opt.command]
+    # The tools live next to this script
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = importlib.import_module(module_name)
+    # Name the command in the tool's usage and error messages
+    sys.argv[0] = f"{os.path.basename(sys.argv[0])} {opt.command}"
+    module.main(opt.args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import logging
+from smf_midi import util
+from smf_midi.motif import MotifIndex, DEFAULT_GRAM_SIZE
+
+opt = None
+logger = logging.getLogger("motif_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Index melodic interval n-grams in SQLite and search for motifs')
+    parser.add_argument('--db', required=False, default='midi_motifs.sqlite',
+                        help="Index database file (default midi_motifs.sqlite)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help="Index new and changed files")
+    update.add_argument('paths', nargs='+',
+                        help="MIDI files and/or directories to index")
+    update.add_argument('--workers', required=False, type=int,
+                        help="Number of worker processes (default is the number of CPUs)")
+    update.add_argument('--prune', action="store_true", required=False,
+                        help="Remove files from the index that no longer exist")
+    update.add_argument('--size', required=False, type=int, default=DEFAULT_GRAM_SIZE,
+                        help=f"Intervals per n-gram when creating the index (default {DEFAULT_GRAM_SIZE})")
+
+    find = commands.add_parser('find', help="List the occurrences of a motif in any transposition")
+    motif = find.add_mutually_exclusive_group(required=True)
+    motif.add_argument('--pitches', nargs='+', type=int,
+                       help="Note numbers of the motif, e.g. 60 62 64 65")
+    motif.add_argument('--intervals', nargs='+', type=int,
+                       help="Semitones between successive notes of the motif, e.g. 2 2 1")
+    find.add_argument('--limit', required=False, type=int,
+                      help="Most matches to list")
+    find.add_argument('--json', action="store_true", required=False,
+                      help="List the matches as JSON")
+
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+
+    if opt.command == 'update':
+        with MotifIndex(opt.db, opt.size) as index:
+            count = index.update(opt.paths, workers=opt.workers, prune=opt.prune)
+            logger.info(f"Indexed {count} files")
+    elif opt.command == 'find':
+        with MotifIndex(opt.db) as index:
+            if opt.pitches:
+                matches = index.find(pitches=opt.pitches, limit=opt.limit)
+            else:
+                matches = index.find(intervals=opt.intervals, limit=opt.limit)
+        if opt.json:
+            print(json.dumps([match.to_dict() for match in matches], indent=2))
+        else:
+            for match in matches:
+                print(match)
+            logger.info(f"{len(matches)} matches")
+
+
+if __name__ == '__main__':
+    main()
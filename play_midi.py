@@ -0,0 +1,61 @@
+import argparse
+import logging
+import smf_midi
+from smf_midi.player import Player, FileSink, CallbackSink
+
+opt = None
+logger = logging.getLogger("play_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Play MIDI events in real time to a sink')
+
+    # Positional required arguments
+    parser.add_argument('filename',
+                        help="Name of the MIDI file to play")
+
+    # Optional keyword arguments
+    parser.add_argument('--output', required=False,
+                        help="Write events to this file instead of stdout")
+    parser.add_argument('--start', required=False, type=float, default=0.0,
+                        help="Start position in seconds")
+    parser.add_argument('--tempo-scale', required=False, type=float, default=1.0, dest='tempo_scale',
+                        help="Playback speed, e.g. 0.5 for half speed")
+    parser.add_argument('--lookahead', required=False, type=float, default=0.002,
+                        help="Seconds before an event to stop sleeping and start spinning")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def print_message(message: bytes, timestamp: float):
+    print(f"{timestamp:10.3f}  {message.hex(' ')}")
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    if opt.output:
+        sink = FileSink(opt.output)
+    else:
+        sink = CallbackSink(print_message)
+
+    midi_file = smf_midi.FileReader(opt.filename)
+    player = Player(midi_file, sink, tempo_scale=opt.tempo_scale, lookahead=opt.lookahead)
+    try:
+        jitter = player.play(opt.start)
+    finally:
+        sink.close()
+    logger.info(f"Jitter: {jitter}")
+
+
+if __name__ == '__main__':
+    main()
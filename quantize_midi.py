@@ -0,0 +1,50 @@
+import argparse
+import logging
+from smf_midi import util
+from smf_midi.quantize import quantize_file
+
+opt = None
+logger = logging.getLogger("quantize_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Quantize the notes of a MIDI file to a beat grid')
+
+    # Positional required arguments
+    parser.add_argument('file_in',
+                        help="Name of the input MIDI file")
+    parser.add_argument('file_out',
+                        help="Name of the output MIDI file")
+
+    # Optional keyword arguments
+    parser.add_argument('--grid', required=False, type=float, default=0.25,
+                        help="Grid size in beats (default 0.25)")
+    parser.add_argument('--swing', required=False, type=float, default=0.0,
+                        help="Fraction of the grid to delay every second grid point")
+    parser.add_argument('--strength', required=False, type=float, default=1.0,
+                        help="How far notes are moved towards the grid, 0 to 1 (default 1)")
+    parser.add_argument('--durations', action="store_true", required=False,
+                        help="Also quantize note lengths")
+    parser.add_argument('--track', required=False, type=int, action='append',
+                        help="Track number to quantize (may be repeated, default all tracks)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+    quantize_file(opt.file_in, opt.file_out, opt.grid, tracks=opt.track, swing=opt.swing,
+                  strength=opt.strength, durations=opt.durations)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,47 @@
-from . import util
-from .trackevent import TrackEvent, TimeSignature
-from .reader import FileReader
-from .writer import FileWriter
-from .midicodes import *
-from .timer import Timer
+"""
+Modules are imported when one of their names is first used (PEP 562), so importing the package is cheap and short
+lived scripts only load what they need.
+"""
+import importlib
+
+# Public name -> module it is imported from
+_EXPORTS = {
+    'TrackEvent': 'trackevent',
+    'TimeSignature': 'trackevent',
+    'FileReader': 'reader',
+    'FileWriter': 'writer',
+    'FileEditor': 'editor',
+    'Timer': 'timer',
+    'HEADER_INDICATOR': 'midicodes',
+    'TRACK_INDICATOR': 'midicodes',
+    'END_OF_TRACK_INDICATOR': 'midicodes',
+    'SMPTE_FRAME_RATES': 'midicodes',
+    'SMPTE_OFFSET_RATES': 'midicodes',
+    'CHANNEL_EVENTS': 'midicodes',
+    'META_EVENT_TYPES': 'midicodes',
+    'CONTROLLER_MESSAGE': 'midicodes',
+    'CONTROLLER_ON_OFF': 'midicodes',
+    'PROGRAMS': 'midicodes',
+}
+
+_SUBMODULES = ('archive', 'bargrid', 'buffer', 'combine', 'diff', 'editor', 'extract', 'index', 'midicodes', 'motif',
+               'player', 'polyphony', 'quantize', 'reader', 'split', 'stats', 'thin', 'timer', 'track', 'trackevent',
+               'util', 'validator', 'writer')
+
+__all__ = list(_EXPORTS) + ['util']
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    # Cache so __getattr__ is only called once per name
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS) + list(_SUBMODULES))
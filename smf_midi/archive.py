@@ -0,0 +1,185 @@
+import collections
+import logging
+import multiprocessing
+import tarfile
+import zipfile
+from .reader import FileReader
+from .stats import MIDI_EXTENSIONS
+
+logger = logging.getLogger("Archive")
+
+# File name endings recognised as archives when a path is given to a corpus tool
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(file_name: str):
+    """
+    True when file_name is a zip or tar (optionally gzip, bzip2 or xz compressed) archive
+    """
+    if not isinstance(file_name, str) or not file_name.lower().endswith(ARCHIVE_EXTENSIONS):
+        return False
+    return zipfile.is_zipfile(file_name) or tarfile.is_tarfile(file_name)
+
+
+class Archive:
+    """
+    A zip or tar archive of midi files, read without extracting it to disk.  One handle on the archive is opened
+    and reused for every member.  Members are decompressed as they are read, straight into the FileReader that
+    holds them in memory.  Iterating yields (member name, FileReader) in archive order in one pass, which for a
+    compressed tar file is the only order that does not decompress the archive again for every member.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.handle = None
+        self.is_zip = False
+        self._names = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        if self.handle is not None:
+            return
+        if zipfile.is_zipfile(self.file_name):
+            self.is_zip = True
+            self.handle = zipfile.ZipFile(self.file_name, "r")
+        else:
+            # Compression (gzip, bzip2 or xz) is detected from the data
+            self.handle = tarfile.open(self.file_name, "r:*")
+        logger.debug(f"Opened {'zip' if self.is_zip else 'tar'} archive '{self.file_name}'")
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def _members(self):
+        if self.handle is None:
+            raise RuntimeError("Archive not opened")
+        if self.is_zip:
+            return [info for info in self.handle.infolist() if not info.is_dir()]
+        return [info for info in self.handle.getmembers() if info.isfile()]
+
+    @staticmethod
+    def _member_name(info):
+        return info.filename if isinstance(info, zipfile.ZipInfo) else info.name
+
+    def names(self):
+        """
+        Returns the names of the midi members (by file extension) in archive order
+        """
+        if self._names is None:
+            self._names = [self._member_name(info) for info in self._members()
+                           if self._member_name(info).lower().endswith(MIDI_EXTENSIONS)]
+        return self._names
+
+    def member(self, name: str):
+        """
+        Returns a binary file object for a member, decompressed as it is read
+        """
+        if self.handle is None:
+            raise RuntimeError("Archive not opened")
+        if self.is_zip:
+            return self.handle.open(name, "r")
+        file_object = self.handle.extractfile(name)
+        if file_object is None:
+            raise ValueError(f"'{name}' in '{self.file_name}' is not a file")
+        return file_object
+
+    def read(self, name: str):
+        """
+        Returns the bytes of a member
+        """
+        with self.member(name) as fh:
+            return fh.read()
+
+    def reader(self, name: str):
+        """
+        Returns a FileReader for a member, labelled archive:member in its file name
+        """
+        midi_file = FileReader(self.read(name))
+        midi_file.file_name = f"{self.file_name}:{name}"
+        return midi_file
+
+    def items(self, skip=None):
+        """
+        Generator yielding (member name, bytes) for each midi member in archive order.  Members whose names are in
+        skip (a set) are passed over without being read.
+        """
+        if self.handle is None:
+            raise RuntimeError("Archive not opened")
+        if skip is None:
+            skip = set()
+        if self.is_zip:
+            for name in self.names():
+                if name not in skip:
+                    yield name, self.read(name)
+            return
+        # Walk the tar file in order, extracting by member name could seek back and decompress it all again
+        for info in self.handle:
+            if info.isfile() and info.name.lower().endswith(MIDI_EXTENSIONS) and info.name not in skip:
+                with self.handle.extractfile(info) as fh:
+                    yield info.name, fh.read()
+
+    def __iter__(self):
+        for name, data in self.items():
+            midi_file = FileReader(data)
+            midi_file.file_name = f"{self.file_name}:{name}"
+            yield name, midi_file
+
+
+def _map_member(args):
+    function, archive_name, name, data = args
+    try:
+        midi_file = FileReader(data)
+        midi_file.file_name = f"{archive_name}:{name}"
+        return name, function(name, midi_file), None
+    except Exception as e:
+        return name, None, f"{type(e).__name__}: {e}"
+
+
+def map_archive(file_name: str, function, **kwargs):
+    """
+    Generator applying function(member name, FileReader) to every midi member of an archive in a pool of worker
+    processes, yielding (member name, result, error) in archive order; error is None or the message of the
+    exception raised by function (or by reading the member).  The archive is read once, in order, by this process
+    and the member bytes are passed to the workers, so no worker opens or decompresses the archive.  Only a few
+    members per worker are read ahead of the results, so memory use does not grow with the archive.  function must
+    be a module level function so it can be sent to the workers.  Keywords:
+        workers=int - number of worker processes (default is the number of CPUs, 0 runs in this process)
+        read_ahead=int - members read ahead of the results per worker (default 4)
+        skip=set - member names not to read or process, e.g. the ones done before a resume
+    """
+    workers = None
+    read_ahead = 4
+    skip = None
+    for k, v in kwargs.items():
+        if k == 'workers':
+            workers = v
+        elif k == 'read_ahead':
+            read_ahead = max(1, int(v))
+        elif k == 'skip':
+            skip = set(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    with Archive(file_name) as archive:
+        tasks = ((function, file_name, name, data) for name, data in archive.items(skip))
+        if workers == 0:
+            for task in tasks:
+                yield _map_member(task)
+            return
+        with multiprocessing.Pool(workers) as pool:
+            limit = read_ahead * (workers or multiprocessing.cpu_count())
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.apply_async(_map_member, (task,)))
+                if len(pending) >= limit:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
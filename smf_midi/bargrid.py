@@ -0,0 +1,143 @@
+import bisect
+
+
+class TimeSignatureMap(dict):
+    """
+    Dictionary of TimeSignature objects indexed by absolute tick, as kept by Timer, that counts its changes in
+    version.  Timers sharing one map rebuild their BarGrid when the version changes, including when another timer
+    replaces the time signature at a tick already in the map.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+
+class BarGrid:
+    """
+    The bar lines of a track built from its time signatures.  Each time signature starts a segment of whole
+    measures and the segment start ticks, zero based first measure numbers and time signatures are kept in sorted
+    lists, so finding the measure of a tick or the tick of a measure is a bisect.  All arithmetic is integer; a
+    measure is division * 4 * numerator / denominator ticks, which need not be a whole number of ticks.
+
+    4/4 is assumed before the first time signature.  A time signature in the middle of a measure ends that
+    measure early, so the new time signature always starts on a bar line.
+    """
+
+    def __init__(self, division: int, time_signatures=None):
+        """
+        time_signatures is an optional dictionary of TimeSignature objects indexed by absolute tick, as kept by Timer
+        """
+        if division < 1 or division & 0x8000:
+            raise ValueError(f"Measures need a metrical time division, not 0x{division:04X}")
+        self.division = division
+        self.starts = [0]
+        self.first_measures = [0]
+        self.numerators = [4]
+        self.denominators = [4]
+        if time_signatures:
+            for ticks in sorted(time_signatures):
+                time_signature = time_signatures[ticks]
+                self.add(ticks, time_signature.numerator, time_signature.denominator)
+
+    def _measure_length(self, segment: int):
+        # Measure length in ticks is this value divided by the denominator
+        return self.division * 4 * self.numerators[segment]
+
+    def add(self, ticks: int, numerator: int, denominator: int):
+        """
+        Adds a time signature at ticks, which must not be before the last one added
+        """
+        if ticks < self.starts[-1]:
+            raise ValueError(f"Time signature at {ticks} is before the last one at {self.starts[-1]}")
+        if numerator < 1 or denominator < 1:
+            raise ValueError(f"Invalid time signature {numerator}/{denominator}")
+        if ticks == self.starts[-1]:
+            # Replaces the time signature at the same tick
+            self.numerators[-1] = numerator
+            self.denominators[-1] = denominator
+            return
+        # Measures (including a final partial one) in the segment this one ends
+        scaled = (ticks - self.starts[-1]) * self.denominators[-1]
+        measures = -(-scaled // self._measure_length(-1))
+        self.starts.append(ticks)
+        self.first_measures.append(self.first_measures[-1] + measures)
+        self.numerators.append(numerator)
+        self.denominators.append(denominator)
+
+    def time_signature(self, ticks: int):
+        """
+        Returns the (numerator, denominator) in effect at ticks
+        """
+        segment = bisect.bisect_right(self.starts, ticks) - 1
+        return self.numerators[segment], self.denominators[segment]
+
+    def position(self, ticks: int):
+        """
+        Returns the zero based (measure, beat, ticks into the beat) of an absolute tick, a beat being one
+        denominator note
+        """
+        segment = max(0, bisect.bisect_right(self.starts, ticks) - 1)
+        denominator = self.denominators[segment]
+        scaled = (ticks - self.starts[segment]) * denominator
+        measure, remainder = divmod(scaled, self._measure_length(segment))
+        beat = remainder // (self.division * 4)
+        # Round the bar line and beat up to whole ticks, as measure_start does
+        beat_start = -(-(scaled - remainder + beat * self.division * 4) // denominator)
+        return self.first_measures[segment] + measure, beat, ticks - self.starts[segment] - beat_start
+
+    def measure_string(self, ticks: int):
+        """
+        Returns the one based measure:beat.tick string of an absolute tick
+        """
+        measure, beat, beat_ticks = self.position(ticks)
+        return f"{measure + 1}:{beat + 1}.{beat_ticks:03}"
+
+    def measure_start(self, measure: int):
+        """
+        Returns the absolute tick of the bar line starting a one based measure
+        """
+        if measure < 1:
+            raise ValueError(f"Measures start at 1, not {measure}")
+        segment = bisect.bisect_right(self.first_measures, measure - 1) - 1
+        scaled = (measure - 1 - self.first_measures[segment]) * self._measure_length(segment)
+        return self.starts[segment] - (-scaled // self.denominators[segment])
+
+    def measure_range(self, first: int, last=None):
+        """
+        Returns (start, end) ticks of one based measures first to last (inclusive, default first), end being the
+        tick of the following bar line
+        """
+        if last is None:
+            last = first
+        if last < first:
+            raise ValueError(f"Last measure ({last}) is before the first ({first})")
+        return self.measure_start(first), self.measure_start(last + 1)
@@ -0,0 +1,60 @@
+import os
+
+
+class TrackBuffer:
+    """
+    Read only file-like object over a shared file descriptor.  Data is read ahead in fixed size blocks with
+    os.pread, so any number of tracks can be read in parallel from one descriptor without seeking and the memory
+    used is bounded by the buffer size (plus any single event larger than it).
+    """
+
+    def __init__(self, fd: int, buffer_size=4096):
+        if buffer_size < 1:
+            raise ValueError("Buffer size must be greater than 0")
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.position = 0
+        self.buffer = b''
+        self.buffer_offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return
+
+    def close(self):
+        # The descriptor is shared, only release the buffer
+        self.buffer = b''
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset: int, whence=0):
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        else:
+            raise ValueError("TrackBuffer only supports absolute and relative seeks")
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            raise ValueError("TrackBuffer reads must have a size")
+
+        start = self.position - self.buffer_offset
+        if start < 0 or start + size > len(self.buffer):
+            if size > self.buffer_size:
+                # Larger than the buffer, read it directly rather than growing the buffer
+                data = os.pread(self.fd, size, self.position)
+                self.position += len(data)
+                return data
+            self.buffer = os.pread(self.fd, self.buffer_size, self.position)
+            self.buffer_offset = self.position
+            start = 0
+
+        data = self.buffer[start:start + size]
+        self.position += len(data)
+        return data
@@ -0,0 +1,213 @@
+import logging
+from .reader import FileReader
+from .writer import FileWriter
+from .track import Track
+from .extract import scan_events
+from .midicodes import END_OF_TRACK_INDICATOR
+from . import util
+
+logger = logging.getLogger("Combine")
+
+# Tempo (120 bpm) and time signature (4/4) inserted where an appended file does not set its own at the start
+DEFAULT_TEMPO_EVENT = b'\xFF\x51\x03\x07\xA1\x20'
+DEFAULT_TIME_SIGNATURE_EVENT = b'\xFF\x58\x04\x04\x02\x18\x08'
+
+# Most tracks a midi file header can declare
+MAX_TRACKS = 0xFFFF
+
+
+class TrackSummary:
+    """
+    What is needed to append a track without decoding it: where its events start after the first delta time and
+    where the End of Track event starts, the first delta, the ticks of the last event and of the End of Track and
+    whether the track sets a tempo and time signature at tick 0.
+    """
+
+    def __init__(self, data, track: Track):
+        self.first_delta = 0
+        self.first_event_offset = track.start_events
+        self.end_offset = track.end_of_track_offset
+        self.last_ticks = 0
+        self.length = 0
+        self.has_tempo = False
+        self.has_time_signature = False
+        self.event_count = 0
+
+        ticks = 0
+        event_offset = track.start_events
+        for delta, status, data_start, event_end in scan_events(data, track.start_events, track.end_of_track_offset):
+            ticks += delta
+            if status == 0xFF and data[data_start] == 0x2F:
+                self.end_offset = event_offset
+                break
+            if self.event_count == 0:
+                self.first_delta = delta
+                self.first_event_offset = event_offset + len(util.int_to_var_len(delta))
+            if ticks == 0 and status == 0xFF:
+                self.has_tempo = self.has_tempo or data[data_start] == 0x51
+                self.has_time_signature = self.has_time_signature or data[data_start] == 0x58
+            self.event_count += 1
+            self.last_ticks = ticks
+            event_offset = event_end
+        self.length = ticks
+
+
+class Source:
+    """
+    An input file: its FileReader, a TrackSummary per track (scanned when first needed) and the factor converting
+    its ticks to output ticks.  Only the headers and summaries are kept, never the events.
+    """
+
+    def __init__(self, file_name: str):
+        self.midi_file = FileReader(file_name)
+        if self.midi_file.type == 2:
+            raise ValueError(f"'{self.midi_file.file_name}' is a type 2 file, its patterns cannot be combined")
+        if self.midi_file.is_time_code_timing:
+            raise ValueError(f"'{self.midi_file.file_name}' uses SMPTE time code timing")
+        self.division = self.midi_file.time
+        self.scale = 1.0
+        self._summaries = None
+
+    @property
+    def summaries(self):
+        if self._summaries is None:
+            with self.midi_file.mapped() as data:
+                self._summaries = [TrackSummary(data, track) for track in self.midi_file.tracks]
+        return self._summaries
+
+    def scaled(self, ticks: int):
+        return round(ticks * self.scale)
+
+    @property
+    def length(self):
+        return max((self.scaled(summary.length) for summary in self.summaries), default=0)
+
+
+def write_segment(midi_writer: FileWriter, source: Source, track_no: int, delta: int, conductor=False):
+    """
+    Appends the events of one track of source (without its End of Track) to the open track, delta ticks after the
+    last event written.  Inserts the default tempo and time signature first when conductor is set and the track
+    does not set them at tick 0.  Returns the output ticks of the last event written relative to the start of the
+    segment, or None if nothing was written.
+    """
+    summary = source.summaries[track_no]
+    track = source.midi_file.tracks[track_no]
+
+    defaults = []
+    if conductor and not summary.has_tempo:
+        defaults.append(DEFAULT_TEMPO_EVENT)
+    if conductor and not summary.has_time_signature:
+        defaults.append(DEFAULT_TIME_SIGNATURE_EVENT)
+    for event_bytes in defaults:
+        midi_writer.write_bytes(util.int_to_var_len(delta) + event_bytes, "default")
+        delta = 0
+    if summary.event_count == 0:
+        return 0 if defaults else None
+
+    if source.scale == 1.0:
+        # Only the first delta time changes, the rest of the events are copied as they are
+        with track.open() as fh:
+            midi_writer.write_bytes(util.int_to_var_len(delta + summary.first_delta), "first delta")
+            midi_writer.copy_range(fh, summary.first_event_offset, summary.end_offset - summary.first_event_offset,
+                                   f"track {track_no} of '{track.filename}'")
+            return summary.last_ticks
+
+    # A different time division means every delta time changes, so the events are re-encoded
+    with source.midi_file.mapped() as data:
+        ticks = 0
+        written = 0
+        events = scan_events(data, track.start_events, summary.end_offset)
+        for event_delta, status, data_start, event_end in events:
+            ticks += event_delta
+            scaled = source.scaled(ticks)
+            midi_writer.write_bytes(util.int_to_var_len(delta + scaled - written) + bytes((status,)) +
+                                    bytes(data[data_start:event_end]), "event")
+            delta = 0
+            written = scaled
+        return written
+
+
+def _load_sources(file_names, division):
+    sources = [Source(file_name) for file_name in file_names]
+    if len(sources) < 1:
+        raise ValueError("No input files")
+    if division is None:
+        division = sources[0].division
+    for source in sources:
+        source.scale = division / source.division
+    return sources, division
+
+
+def concatenate(file_names, file_out: str, **kwargs):
+    """
+    Writes the files one after the other into file_out.  Track n of the output is track n of each file in turn and
+    each file starts where the longest track of the previous one ended.  Each file gets its own tempo map: the
+    default tempo and time signature are inserted on track 0 where a file does not set them at its start.
+    Unless a time division has to be rescaled only the first delta time of each appended track is written, the
+    rest is copied as raw bytes.  Keywords:
+        division=int - time division of the output (default is the division of the first file)
+    """
+    division = None
+    for k, v in kwargs.items():
+        if k == 'division':
+            division = int(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    sources, division = _load_sources(file_names, division)
+    track_count = max(len(source.summaries) for source in sources)
+    midi_type = 0 if all(source.midi_file.type == 0 for source in sources) else 1
+
+    # Start of each file in output ticks
+    starts = []
+    total = 0
+    for source in sources:
+        starts.append(total)
+        total += source.length
+
+    with FileWriter(file_out, midi_type, division) as midi_writer:
+        for track_no in range(track_count):
+            midi_writer.new_track()
+            written = 0
+            for source, start in zip(sources, starts):
+                if track_no >= len(source.summaries):
+                    continue
+                last = write_segment(midi_writer, source, track_no, start - written, conductor=track_no == 0)
+                if last is not None:
+                    written = start + last
+            midi_writer.write_bytes(util.int_to_var_len(total - written) + END_OF_TRACK_INDICATOR, "end of track")
+            midi_writer.close_track()
+    logger.debug(f"Concatenated {len(sources)} files into {track_count} tracks, {total} ticks")
+
+
+def layer(file_names, file_out: str, **kwargs):
+    """
+    Writes every track of every file into a type 1 file_out so the files play at the same time.  Tracks are copied
+    as raw chunks; only files with a different time division are re-encoded.  The tempo maps of all files apply
+    to the result, as for any tempo events outside track 0.  Keywords:
+        division=int - time division of the output (default is the division of the first file)
+    """
+    division = None
+    for k, v in kwargs.items():
+        if k == 'division':
+            division = int(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    sources, division = _load_sources(file_names, division)
+    track_count = sum(len(source.midi_file.tracks) for source in sources)
+    if track_count > MAX_TRACKS:
+        raise ValueError(f"{track_count} tracks is more than a midi file can hold ({MAX_TRACKS})")
+
+    with FileWriter(file_out, 1, division) as midi_writer:
+        for source in sources:
+            for track_no, track in enumerate(source.midi_file.tracks):
+                if source.scale == 1.0:
+                    midi_writer.copy_track(track)
+                    continue
+                midi_writer.new_track()
+                last = write_segment(midi_writer, source, track_no, 0) or 0
+                length = source.scaled(source.summaries[track_no].length)
+                midi_writer.write_bytes(util.int_to_var_len(length - last) + END_OF_TRACK_INDICATOR, "end of track")
+                midi_writer.close_track()
+    logger.debug(f"Layered {len(sources)} files into {track_count} tracks")
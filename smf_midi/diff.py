@@ -0,0 +1,254 @@
+import bisect
+import hashlib
+import io
+import logging
+from .reader import FileReader
+from .timer import Timer, DEFAULT_TEMPO
+from .bargrid import TimeSignatureMap
+from .trackevent import TrackEvent
+from .midicodes import END_OF_TRACK_INDICATOR
+
+logger = logging.getLogger("Diff")
+
+# Group used for non-channel events when aligning by channel
+CONDUCTOR_GROUP = "meta"
+
+
+class Change:
+    """
+    One difference between two files: kind is 'inserted', 'deleted' or 'modified', group is the track number or
+    channel the events were aligned in and old/new are the event bytes (None when not applicable).
+    """
+
+    def __init__(self, kind: str, group, ticks: int, old=None, new=None):
+        self.kind = kind
+        self.group = group
+        self.ticks = ticks
+        self.old = old
+        self.new = new
+        self.measure = ""
+        self.seconds = 0.0
+
+    @staticmethod
+    def describe(event_bytes):
+        if event_bytes is None:
+            return ""
+        # Decode the event through TrackEvent by prefixing a zero delta time
+        event = TrackEvent(io.BytesIO(b'\x00' + bytes(event_bytes)))
+        return event.description
+
+    def __str__(self):
+        position = f"{self.group} tick={self.ticks} measure={self.measure} time={self.seconds:.3f}s"
+        if self.kind == 'inserted':
+            return f"+ {position} {self.describe(self.new)}"
+        elif self.kind == 'deleted':
+            return f"- {position} {self.describe(self.old)}"
+        return f"~ {position} {self.describe(self.old)} -> {self.describe(self.new)}"
+
+
+class EventMap:
+    """
+    The events of a file grouped by track or channel as (absolute ticks, event bytes) lists in time order, a
+    digest of each group, and the tempo and time signature maps needed to report positions.
+    """
+
+    def __init__(self, file_name: str, by='track'):
+        if by not in ('track', 'channel'):
+            raise ValueError(f"Events must be aligned by 'track' or 'channel', not '{by}'")
+        self.midi_file = FileReader(file_name)
+        self.groups = {}
+        self.digests = {}
+        self.timer = Timer(self.midi_file.time, TimeSignatureMap(), {0: DEFAULT_TEMPO})
+        self._tempo_ticks = None
+        self._tempo_microseconds = None
+        if by == 'track':
+            self._load_tracks()
+        else:
+            self._load_channels()
+        for group, events in self.groups.items():
+            digest = hashlib.blake2b(digest_size=16)
+            for ticks, event_bytes in events:
+                digest.update(ticks.to_bytes(8, 'big') + event_bytes)
+            self.digests[group] = digest
+
+    def _load_tracks(self):
+        for track_no, track in enumerate(self.midi_file.tracks):
+            group = f"track {track_no}"
+            self.groups[group] = []
+            ticks = 0
+            for event in track.get_events():
+                ticks += event.delta_ticks
+                self._update_maps(event, ticks, track_no)
+                self._add(group, ticks, event)
+
+    def _load_channels(self):
+        # Each track is read on its own, merging the tracks would drop identical events at the same tick
+        for track_no, track in enumerate(self.midi_file.tracks):
+            ticks = 0
+            for event in track.get_events():
+                ticks += event.delta_ticks
+                if event.event_bytes == END_OF_TRACK_INDICATOR:
+                    continue
+                self._update_maps(event, ticks, track_no)
+                if event.is_channel_event:
+                    group = f"channel {event.channel}"
+                else:
+                    group = CONDUCTOR_GROUP
+                self._add(group, ticks, event)
+        # Stable sort, so events at the same tick stay in track order
+        for events in self.groups.values():
+            events.sort(key=lambda item: item[0])
+
+    def _add(self, group, ticks: int, event: TrackEvent):
+        self.groups.setdefault(group, []).append((ticks, bytes(event.event_bytes)))
+
+    def digest(self, group):
+        if group not in self.digests:
+            return b''
+        return self.digests[group].digest()
+
+    def _update_maps(self, event: TrackEvent, ticks: int, track_no: int):
+        # Type 2 patterns are independent, only the first pattern's maps are used for positions
+        if self.midi_file.type == 2 and track_no != 0:
+            return
+        if event.time_signature:
+            self.timer.time_signatures[ticks] = event.time_signature
+        elif event.tempo:
+            self.timer.tempos[ticks] = event.tempo
+            self._tempo_ticks = None
+
+    def seconds(self, ticks: int):
+        """
+        Returns the seconds at an absolute tick position, found by binary search in a table of the microseconds at
+        each tempo change (built once) rather than walking the tempo map for every position
+        """
+        timer = self.timer
+        if timer.is_time_code_timing:
+            return timer.ticks_to_seconds(ticks)
+        if self._tempo_ticks is None:
+            self._tempo_ticks = sorted(timer.tempos)
+            self._tempo_microseconds = []
+            microseconds = 0
+            for idx, start in enumerate(self._tempo_ticks):
+                self._tempo_microseconds.append(microseconds)
+                if idx + 1 < len(self._tempo_ticks):
+                    microseconds += (timer.tempos[start] * (self._tempo_ticks[idx + 1] - start)) // timer.division
+        # The last tempo change before the position, as Timer.ticks_to_microseconds rounds each tempo span
+        idx = bisect.bisect_left(self._tempo_ticks, ticks) - 1
+        microseconds = timer.offset_microseconds
+        if idx >= 0:
+            start = self._tempo_ticks[idx]
+            microseconds += self._tempo_microseconds[idx] + (timer.tempos[start] * (ticks - start)) // timer.division
+        return microseconds / 1000000
+
+    def measure(self, ticks: int):
+        """
+        Returns the one based measure:beat.tick string for an absolute tick position
+        """
+        if self.timer.is_time_code_timing:
+            return ""
+        return self.timer.bar_grid.measure_string(ticks)
+
+
+def event_identity(event_bytes: bytes):
+    """
+    The part of an event that says what it is (not its value), used to report two events at the same tick as one
+    modification: the status plus the note/controller number for channel events and the type for meta events.
+    """
+    status = event_bytes[0]
+    if status == 0xFF:
+        return event_bytes[:2]
+    if 0x80 <= status < 0xF0:
+        if status & 0xF0 in (0x80, 0x90):
+            # Note on/off of the same note is the same note
+            return bytes((0x90 | (status & 0x0F), event_bytes[1]))
+        if status & 0xF0 in (0xA0, 0xB0):
+            return event_bytes[:2]
+        return event_bytes[:1]
+    return event_bytes[:1]
+
+
+def diff_group(group, events_a: list, events_b: list):
+    """
+    Compares two lists of (ticks, event bytes) in time order with a sorted merge and returns a list of Changes
+    """
+    changes = []
+    idx_a = 0
+    idx_b = 0
+    while idx_a < len(events_a) or idx_b < len(events_b):
+        # Find the next tick in either list and collect all events at that tick from each list
+        if idx_b >= len(events_b) or (idx_a < len(events_a) and events_a[idx_a][0] <= events_b[idx_b][0]):
+            ticks = events_a[idx_a][0]
+        else:
+            ticks = events_b[idx_b][0]
+        at_a = []
+        while idx_a < len(events_a) and events_a[idx_a][0] == ticks:
+            at_a.append(events_a[idx_a][1])
+            idx_a += 1
+        at_b = []
+        while idx_b < len(events_b) and events_b[idx_b][0] == ticks:
+            at_b.append(events_b[idx_b][1])
+            idx_b += 1
+        if at_a == at_b:
+            continue
+
+        # Remove events found in both (as a multiset), what remains was deleted, inserted or modified
+        remaining_b = {}
+        for event_bytes in at_b:
+            remaining_b[event_bytes] = remaining_b.get(event_bytes, 0) + 1
+        deleted = []
+        for event_bytes in at_a:
+            if remaining_b.get(event_bytes, 0) > 0:
+                remaining_b[event_bytes] -= 1
+            else:
+                deleted.append(event_bytes)
+        inserted = []
+        for event_bytes in at_b:
+            if remaining_b.get(event_bytes, 0) > 0:
+                remaining_b[event_bytes] -= 1
+                inserted.append(event_bytes)
+
+        inserted_by_identity = {}
+        for event_bytes in inserted:
+            inserted_by_identity.setdefault(event_identity(event_bytes), []).append(event_bytes)
+        for event_bytes in deleted:
+            candidates = inserted_by_identity.get(event_identity(event_bytes))
+            if candidates:
+                changes.append(Change('modified', group, ticks, event_bytes, candidates.pop(0)))
+            else:
+                changes.append(Change('deleted', group, ticks, old=event_bytes))
+        for candidates in inserted_by_identity.values():
+            for event_bytes in candidates:
+                changes.append(Change('inserted', group, ticks, new=event_bytes))
+    return changes
+
+
+def diff_files(file_a: str, file_b: str, by='track'):
+    """
+    Returns the list of Changes needed to turn file_a into file_b, aligning events by absolute tick within each
+    track (by='track') or channel (by='channel').  Positions are reported with the tempo and time signature maps
+    of the file the event comes from.
+    """
+    map_a = EventMap(file_a, by)
+    map_b = EventMap(file_b, by)
+    if map_a.midi_file.time != map_b.midi_file.time:
+        logger.warning(f"Time divisions differ ({map_a.midi_file.time} and {map_b.midi_file.time}), "
+                       f"ticks are compared as is")
+
+    changes = []
+    groups = list(map_a.groups) + [g for g in map_b.groups if g not in map_a.groups]
+    for group in groups:
+        events_a = map_a.groups.get(group, [])
+        events_b = map_b.groups.get(group, [])
+        # Identical groups are skipped by comparing the digests of (ticks, event bytes)
+        if map_a.digest(group) == map_b.digest(group):
+            continue
+        changes.extend(diff_group(group, events_a, events_b))
+
+    for change in changes:
+        event_map = map_a if change.kind == 'deleted' else map_b
+        change.measure = event_map.measure(change.ticks)
+        change.seconds = event_map.seconds(change.ticks)
+
+    logger.debug(f"{len(changes)} changes between '{file_a}' and '{file_b}'")
+    return changes
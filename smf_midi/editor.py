@@ -0,0 +1,192 @@
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from .trackevent import TrackEvent
+from . import util
+
+
+logger = logging.getLogger("FileEditor")
+
+
+class FileEditor:
+    """
+    Applies same-size edits directly to the bytes of an existing midi file.  Events are located by the event_offset
+    saved when they were read (e.g. from FileReader.get_events_from_tracks or Track.get_events) and the replacement
+    bytes must be the same length as the original event, so delta times and track lengths never change.
+
+    Edits are batched and only written when flush is called (or the context manager exits without an exception).
+    By default the flush is atomic: the file is copied to a temporary file in the same directory, patched through
+    mmap and renamed over the original.  With atomic=False the original file is patched in place through mmap, so
+    only the affected bytes are written.
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        self.filename = filename
+        self.atomic = True
+        for k, v in kwargs.items():
+            if k == 'atomic':
+                self.atomic = bool(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        self.file_handle = None
+        self.map = None
+        self.patches = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            logger.warning(f"Discarding {len(self.patches)} pending patches")
+            self.patches = {}
+        self.close()
+        return
+
+    def open(self):
+        # The file is only mapped for reading here; patches are written when flushed
+        self.file_handle = open(self.filename, "rb")
+        self.map = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
+
+    def patch(self, offset: int, data, desc=""):
+        """
+        Queue data to be written at the file offset.  A later patch at the same offset replaces an earlier one.
+        """
+        if self.map is None:
+            raise RuntimeError("File not opened")
+        if offset < 0 or offset + len(data) > len(self.map):
+            raise ValueError(f"Patch at 0x{offset:X} ({len(data)} bytes) is outside the file")
+        logger.debug(f"Patch {desc} at 0x{offset:X}: {util.hex_dump(data)}")
+        self.patches[offset] = bytes(data)
+
+    def update_event(self, event: TrackEvent):
+        """
+        Queue the current event_bytes of an event that was read from this file to overwrite the original event.
+        The event must still be the same number of bytes as the original in the file.  Only the event bytes are
+        written: the delta time in the file is left as it is, since events merged from several tracks carry a
+        delta from the previous event of any track rather than the one stored.
+        """
+        if event.running_status:
+            raise ValueError(f"Event at 0x{event.event_offset:X} has no status byte in the file (running status)"
+                             f"--it cannot be patched in place")
+        self.map.seek(event.event_offset)
+        original = TrackEvent(self.map)
+        if len(original.event_bytes) != len(event.event_bytes):
+            raise ValueError(f"Event at 0x{event.event_offset:X} changed size--it cannot be patched in place")
+        if original.event_bytes[0] != event.event_bytes[0] and original.type != event.type:
+            raise ValueError(f"Event at 0x{event.event_offset:X} changed type from '{original.type}' to "
+                             f"'{event.type}'")
+        if original.event_bytes[0] != event.event_bytes[0] and self._next_uses_status(original):
+            raise ValueError(f"Event after 0x{event.event_offset:X} uses its status byte (running status)--the "
+                             f"status cannot be changed in place")
+        offset = event.event_offset + len(original.time_bytes)
+        if original.event_bytes == event.event_bytes:
+            # Unchanged (or changed back), so nothing to write
+            self.patches.pop(offset, None)
+            return
+        self.patch(offset, event.event_bytes, "event")
+
+    def _next_uses_status(self, original: TrackEvent) -> bool:
+        """
+        True when the event following original in the file (the map is positioned at it) leaves out its status
+        byte and so repeats the status of original
+        """
+        status = original.next_running_status
+        start = self.map.tell()
+        if status is None or start >= len(self.map) or self.map[start:start + 4] == b"MTrk":
+            return False
+        try:
+            following = TrackEvent(self.map, None, status)
+        except (ValueError, IndexError):
+            return False
+        return following.running_status
+
+    def set_channel(self, event: TrackEvent, channel: int):
+        event.set_channel(channel)
+        self.update_event(event)
+
+    def set_velocity(self, event: TrackEvent, velocity: int):
+        if event.type not in (event.CHANNEL_NOTE, event.CHANNEL_POLY_PRESSURE):
+            raise TypeError("Event type is not a note event")
+        event.event_bytes[2] = max(0, min(127, int(velocity)))
+        self.update_event(event)
+
+    def scale_velocity(self, event: TrackEvent, factor: float):
+        # A note on with zero velocity is a note off and must stay that way
+        if event.event_bytes[2] == 0:
+            return
+        self.set_velocity(event, max(1, round(event.event_bytes[2] * factor)))
+
+    def transpose(self, event: TrackEvent, semitones: int):
+        if event.type not in (event.CHANNEL_NOTE, event.CHANNEL_POLY_PRESSURE):
+            raise TypeError("Event type is not a note event")
+        note = event.event_bytes[1] + semitones
+        if note < 0 or note > 127:
+            raise ValueError(f"Transposed note {note} is out of range at 0x{event.event_offset:X}")
+        event.event_bytes[1] = note
+        self.update_event(event)
+
+    def set_tempo(self, event: TrackEvent, tempo: int):
+        """
+        Change a tempo event to a new tempo in microseconds per quarter note
+        """
+        if not event.tempo:
+            raise TypeError("Event is not a tempo event")
+        if tempo < 1 or tempo > 0xFFFFFF:
+            raise ValueError(f"Tempo {tempo} cannot be represented in 3 bytes")
+        event.event_data = tempo.to_bytes(3, 'big')
+        event.event_bytes = bytearray(b'\xFF\x51\x03' + event.event_data)
+        self.update_event(event)
+
+    def flush(self):
+        if len(self.patches) < 1:
+            return
+        logger.debug(f"Flushing {len(self.patches)} patches to '{self.filename}' (atomic={self.atomic})")
+
+        if not self.atomic:
+            with open(self.filename, "r+b") as fh:
+                self._apply_patches(fh)
+            self.patches = {}
+            return
+
+        # Copy to a temp file in the same directory (so the rename stays on one file system), patch, then
+        # replace the original in a single rename
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_name = tempfile.mkstemp(prefix=".midi_edit_", dir=directory)
+        os.close(fd)
+        try:
+            shutil.copyfile(self.filename, temp_name)
+            shutil.copymode(self.filename, temp_name)
+            with open(temp_name, "r+b") as fh:
+                self._apply_patches(fh)
+            os.replace(temp_name, self.filename)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        self.patches = {}
+
+        # The original inode was replaced so re-map the new file
+        self.close()
+        self.open()
+
+    def _apply_patches(self, fh):
+        write_map = mmap.mmap(fh.fileno(), 0)
+        try:
+            for offset, data in sorted(self.patches.items()):
+                write_map[offset:offset + len(data)] = data
+            write_map.flush()
+        finally:
+            write_map.close()
+        os.fsync(fh.fileno())
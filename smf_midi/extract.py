@@ -0,0 +1,219 @@
+import logging
+from .reader import FileReader
+from .writer import FileWriter
+from .track import Track
+from .bargrid import BarGrid
+from .validator import CHANNEL_DATA_LENGTHS, _read_var_len
+from .midicodes import END_OF_TRACK_INDICATOR
+from . import util
+
+logger = logging.getLogger("Extract")
+
+# Meta events still in effect at the cut: copyright, track/instrument name, channel prefix, port, tempo, time
+# and key signature.  The latest of each before the start is written at the start of the excerpt.
+PREVAILING_META = (0x02, 0x03, 0x04, 0x20, 0x21, 0x51, 0x58, 0x59)
+
+
+def scan_events(data, start: int, end: int):
+    """
+    Generator yielding (delta ticks, status, data start, event end) for the events of a track chunk held in data
+    (bytes or mmap) from start (first event) to end, without decoding them.  Running status is resolved, so the
+    event bytes are always bytes((status,)) + data[data start:event end].
+    """
+    idx = start
+    running_status = None
+    while idx < end:
+        event_offset = idx
+        delta, idx = _read_var_len(data, idx, end)
+        if delta is None or idx >= end:
+            raise RuntimeError(f"Malformed delta time at offset 0x{event_offset:X}")
+        status = data[idx]
+        if status < 0x80:
+            if running_status is None:
+                raise RuntimeError(f"Data byte 0x{status:02X} without running status at offset 0x{idx:X}")
+            status = running_status
+        else:
+            idx += 1
+        data_start = idx
+        if status == 0xFF:
+            running_status = None
+            length, idx = _read_var_len(data, idx + 1, end)
+        elif status == 0xF0 or status == 0xF7:
+            running_status = None
+            length, idx = _read_var_len(data, idx, end)
+        elif status > 0xF0:
+            raise RuntimeError(f"System message 0x{status:02X} at offset 0x{idx - 1:X}")
+        else:
+            running_status = status
+            length = CHANNEL_DATA_LENGTHS[status >> 4]
+        if length is None or idx + length > end:
+            raise RuntimeError(f"Malformed or truncated event at offset 0x{event_offset:X}")
+        idx += length
+        yield delta, status, data_start, idx
+
+
+def time_signatures(data, track: Track):
+    """
+    Generator yielding (ticks, numerator, denominator) for each time signature in a track, in time order
+    """
+    ticks = 0
+    for delta, status, data_start, event_end in scan_events(data, track.start_events, track.end_of_track_offset):
+        ticks += delta
+        if status == 0xFF and data[data_start] == 0x58:
+            numerator, dd = data[event_end - 4:event_end - 2]
+            yield ticks, numerator, 2 ** dd
+
+
+def measure_to_ticks(signatures, division: int, measure: int):
+    """
+    Returns the tick at which a one based measure starts.  signatures is an iterable of (ticks, numerator,
+    denominator) in time order and is only read up to the measure, 4/4 is assumed before the first one.
+    """
+    bar_grid = BarGrid(division)
+    for ticks, numerator, denominator in signatures:
+        if bar_grid.measure_start(measure) < ticks:
+            break
+        bar_grid.add(ticks, numerator, denominator)
+    return bar_grid.measure_start(measure)
+
+
+class TrackState:
+    """
+    The state of a track at a tick: prevailing meta events, the latest value of each controller, program, pitch
+    bend and channel pressure (in the order they were last set, so e.g. bank select stays before a program change)
+    and the notes sounding.
+    """
+
+    def __init__(self):
+        self.meta = {}
+        self.channel = {}
+        self.notes = {}
+
+    def update(self, status: int, event_bytes: bytes):
+        if status == 0xFF:
+            if event_bytes[1] in PREVAILING_META:
+                self.meta[event_bytes[1]] = event_bytes
+            return
+        command = status & 0xF0
+        if command in (0x80, 0x90):
+            key = (status & 0x0F, event_bytes[1])
+            if command == 0x90 and event_bytes[2] > 0:
+                self.notes.setdefault(key, []).append(event_bytes)
+            elif self.notes.get(key):
+                self.notes[key].pop(0)
+                if not self.notes[key]:
+                    del self.notes[key]
+        elif command in (0xB0, 0xC0, 0xD0, 0xE0):
+            if command == 0xB0:
+                key = event_bytes[:2]
+            else:
+                key = event_bytes[:1]
+            # Re-insert so the order is the order the values were last set
+            self.channel.pop(key, None)
+            self.channel[key] = event_bytes
+
+    def events(self):
+        """
+        Returns the event bytes recreating this state at a single tick
+        """
+        events = list(self.meta.values()) + list(self.channel.values())
+        for note_ons in self.notes.values():
+            events.extend(note_ons)
+        return events
+
+
+def extract_track(data, track: Track, start: int, end=None):
+    """
+    Returns the (ticks relative to start, event bytes) of a track for ticks start <= tick < end (end None is the
+    end of the track).  Events before start are only scanned for the TrackState written at tick 0, notes still
+    sounding at end get a note off at end and reading stops at end.
+    """
+    state = TrackState()
+    excerpt = []
+    ticks = 0
+    last_tick = 0
+    for delta, status, data_start, event_end in scan_events(data, track.start_events, track.end_of_track_offset):
+        ticks += delta
+        if end is not None and ticks >= end:
+            break
+        event_bytes = bytes((status,)) + bytes(data[data_start:event_end])
+        if event_bytes == END_OF_TRACK_INDICATOR:
+            last_tick = ticks
+            break
+        if ticks < start:
+            if status != 0xF0 and status != 0xF7:
+                state.update(status, event_bytes)
+            continue
+        if ticks == start:
+            # Notes ending exactly at the cut are not restarted
+            is_note_off = status & 0xF0 == 0x80 or (status & 0xF0 == 0x90 and event_bytes[2] == 0)
+            if is_note_off and state.notes.get((status & 0x0F, event_bytes[1])):
+                state.update(status, event_bytes)
+                continue
+        excerpt.append((ticks - start, event_bytes))
+
+    # Follow the notes through the excerpt so the ones still sounding can be closed
+    sounding = TrackState()
+    prefix = [(0, event_bytes) for event_bytes in state.events()]
+    for ticks, event_bytes in prefix + excerpt:
+        if event_bytes[0] & 0xF0 in (0x80, 0x90):
+            sounding.update(event_bytes[0], event_bytes)
+    if end is None:
+        stop = max(last_tick - start, excerpt[-1][0] if excerpt else 0)
+    else:
+        stop = end - start
+    closing = []
+    for (channel, note), note_ons in sounding.notes.items():
+        closing.extend([(stop, bytes((0x80 | channel, note, 0)))] * len(note_ons))
+
+    return prefix + excerpt + closing + [(stop, END_OF_TRACK_INDICATOR)]
+
+
+def _measure_range(data, midi_file: FileReader, source, start: int, end):
+    # Ticks of one based measures start to end (inclusive) from the time signatures of the source track
+    # Collected once, both measures are looked up from the start of the list
+    signatures = list(time_signatures(data, source))
+    start_ticks = measure_to_ticks(signatures, midi_file.time, start)
+    end_ticks = None
+    if end is not None:
+        end_ticks = measure_to_ticks(signatures, midi_file.time, end + 1)
+    return start_ticks, end_ticks
+
+
+def extract_range(file_in: str, file_out: str, start: int, end=None, **kwargs):
+    """
+    Writes the events of file_in from start up to (not including) end to file_out, keeping the tracks and
+    recreating the tempo, time signature, programs, controllers and sustained notes in effect at start.  Keywords:
+        measures=bool - start and end are one based measure numbers and end is included (default False, ticks)
+    """
+    measures = False
+    for k, v in kwargs.items():
+        if k == 'measures':
+            measures = bool(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    midi_file = FileReader(file_in)
+    if measures and midi_file.is_time_code_timing:
+        raise ValueError("Cannot extract measures with SMPTE time code timing")
+
+    with midi_file.mapped() as data:
+        # Measures are counted with the time signatures of the conductor track, once for all tracks, except for
+        # type 2 where each pattern has its own
+        start_ticks, end_ticks = start, end
+        if measures and midi_file.type != 2:
+            start_ticks, end_ticks = _measure_range(data, midi_file, midi_file.tracks[0], start, end)
+        with FileWriter(file_out, midi_file.type, midi_file.time) as midi_writer:
+            for track in midi_file.tracks:
+                if measures and midi_file.type == 2:
+                    start_ticks, end_ticks = _measure_range(data, midi_file, track, start, end)
+                if end_ticks is not None and end_ticks <= start_ticks:
+                    raise ValueError(f"End ({end}) must be after start ({start})")
+
+                midi_writer.new_track()
+                ticks = 0
+                for event_ticks, event_bytes in extract_track(data, track, start_ticks, end_ticks):
+                    midi_writer.write_bytes(util.int_to_var_len(event_ticks - ticks) + event_bytes, "event")
+                    ticks = event_ticks
+                midi_writer.close_track()
+            logger.debug(f"Extracted ticks {start_ticks} to {end_ticks} from {len(midi_file.tracks)} tracks")
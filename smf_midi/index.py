@@ -0,0 +1,326 @@
+import logging
+import multiprocessing
+import os
+import sqlite3
+from .reader import FileReader
+from .stats import find_midi_files
+from .bargrid import TimeSignatureMap
+from .timer import tracks_seconds
+from . import midicodes
+from . import util
+
+logger = logging.getLogger("MetadataIndex")
+
+# Tempo of files without a tempo event (120 bpm, the midi default) when searching by bpm
+DEFAULT_BPM = 120
+
+# Meta events whose data is text and worth indexing
+TEXT_META_IDS = (0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    type INTEGER,
+    track_count INTEGER,
+    division INTEGER,
+    duration REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    track INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    meta_id INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tempos (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    track INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    tempo INTEGER NOT NULL,
+    bpm INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS time_signatures (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    track INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    numerator INTEGER NOT NULL,
+    denominator INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    channel INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    notes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS meta_file ON meta(file_id);
+CREATE INDEX IF NOT EXISTS meta_text ON meta(meta_id, text);
+CREATE INDEX IF NOT EXISTS tempos_file ON tempos(file_id);
+CREATE INDEX IF NOT EXISTS tempos_bpm ON tempos(bpm);
+CREATE INDEX IF NOT EXISTS time_signatures_file ON time_signatures(file_id);
+CREATE INDEX IF NOT EXISTS channels_file ON channels(file_id);
+CREATE INDEX IF NOT EXISTS channels_channel ON channels(channel);
+CREATE INDEX IF NOT EXISTS files_duration ON files(duration);
+"""
+
+
+def extract_metadata(file_name: str):
+    """
+    Reads a midi file and returns a dictionary of the values stored in the index.  Errors are returned in the
+    dictionary rather than raised so that the file is still recorded (and not retried until it changes).
+    """
+    stat = os.stat(file_name)
+    info = {'path': file_name, 'mtime': stat.st_mtime, 'size': stat.st_size, 'type': None, 'track_count': None,
+            'division': None, 'duration': None, 'error': None,
+            'meta': [], 'tempos': [], 'time_signatures': [], 'channels': {}}
+    try:
+        midi_file = FileReader(file_name)
+        info['type'] = midi_file.type
+        info['track_count'] = midi_file.track_count
+        info['division'] = midi_file.time
+        time_signatures = TimeSignatureMap()
+        tempos = {}
+        for track_no, track in enumerate(midi_file.tracks):
+            if midi_file.type == 2:
+                track.set_timer(midi_file.time, {}, {})
+            else:
+                track.set_timer(midi_file.time, time_signatures, tempos)
+            for event in track.get_events():
+                ticks = track.timer.absolute_ticks
+                if event.is_channel_event:
+                    counts = info['channels'].setdefault(event.channel, [0, 0])
+                    counts[0] += 1
+                    if event.event_bytes[0] & 0xF0 == 0x90 and event.event_bytes[2] > 0:
+                        counts[1] += 1
+                elif event.type == event.META:
+                    meta_id = event.event_bytes[1]
+                    if meta_id in TEXT_META_IDS:
+                        text = bytes(event.event_data).decode('utf-8', errors='replace')
+                        info['meta'].append((track_no, ticks, meta_id, text))
+                    elif event.tempo:
+                        info['tempos'].append((track_no, ticks, event.tempo, util.microseconds_to_bpm(event.tempo)))
+                    elif event.time_signature:
+                        time_signature = event.time_signature
+                        info['time_signatures'].append((track_no, ticks, time_signature.numerator,
+                                                        time_signature.denominator))
+        info['duration'] = tracks_seconds(midi_file)
+    except Exception as e:
+        logger.debug(f"Failed to index '{file_name}': {e}")
+        info['error'] = f"{type(e).__name__}: {e}"
+    return info
+
+
+class FileIndex:
+    """
+    Base of the SQLite indexes of midi files.  The schema must have a files table with id, path, mtime and size
+    columns that the other tables reference with ON DELETE CASCADE, and is_current compares mtime and size with
+    the file on disk.  Subclasses give the extract function and its tasks (_extract_tasks) and store what it
+    returns (add).
+    """
+
+    def __init__(self, db_name: str, schema: str):
+        self.db_name = db_name
+        self.connection = sqlite3.connect(db_name)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(schema)
+        # Named for the subclass so each index logs under its own name
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def is_current(self, file_name: str):
+        """
+        True if the file is indexed with the same modification time and size as on disk
+        """
+        stat = os.stat(file_name)
+        row = self.connection.execute("SELECT mtime, size FROM files WHERE path = ?", (file_name,)).fetchone()
+        return row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size
+
+    def _extract_tasks(self, file_names):
+        """
+        Returns (function, tasks): a module level function (so worker processes can use it) and the argument to
+        call it with for each file, returning the dictionary passed to add
+        """
+        raise NotImplementedError
+
+    def add(self, info: dict):
+        raise NotImplementedError
+
+    def update(self, paths, **kwargs):
+        """
+        Index all midi files found in paths, skipping files that are already current.  Files are parsed by a
+        pool of workers when workers is not 1.  With prune=True, indexed files that no longer exist are removed.
+        Returns the number of files (re)indexed.
+        """
+        workers = None
+        prune = False
+        for k, v in kwargs.items():
+            if k == 'workers':
+                workers = v
+            elif k == 'prune':
+                prune = bool(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+
+        file_names = [f for f in find_midi_files(paths) if not self.is_current(f)]
+        self.logger.info(f"Indexing {len(file_names)} new or changed files")
+
+        extract, tasks = self._extract_tasks(file_names)
+        if workers == 1:
+            for task in tasks:
+                self.add(extract(task))
+        elif len(tasks) > 0:
+            with multiprocessing.Pool(workers) as pool:
+                for info in pool.imap_unordered(extract, tasks, chunksize=16):
+                    self.add(info)
+        self.connection.commit()
+
+        if prune:
+            self.prune()
+
+        return len(file_names)
+
+    def prune(self):
+        removed = 0
+        for file_id, path in self.connection.execute("SELECT id, path FROM files").fetchall():
+            if not os.path.exists(path):
+                self.connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                removed += 1
+        self.connection.commit()
+        self.logger.info(f"Removed {removed} missing files from the index")
+        return removed
+
+
+class MetadataIndex(FileIndex):
+    """
+    SQLite index of midi file header fields, text meta events, tempo maps, time signatures, channel usage and
+    duration.  Indexing is incremental: files whose modification time and size are unchanged are skipped.
+    """
+
+    def __init__(self, db_name: str):
+        super().__init__(db_name, SCHEMA)
+
+    def _extract_tasks(self, file_names):
+        return extract_metadata, file_names
+
+    def add(self, info: dict):
+        """
+        Add (or replace) the metadata dictionary returned by extract_metadata
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM files WHERE path = ?", (info['path'],))
+        cursor.execute("INSERT INTO files (path, mtime, size, type, track_count, division, duration, error) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (info['path'], info['mtime'], info['size'], info['type'], info['track_count'],
+                        info['division'], info['duration'], info['error']))
+        file_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO meta VALUES (?, ?, ?, ?, ?)",
+                           [(file_id,) + row for row in info['meta']])
+        cursor.executemany("INSERT INTO tempos VALUES (?, ?, ?, ?, ?)",
+                           [(file_id,) + row for row in info['tempos']])
+        cursor.executemany("INSERT INTO time_signatures VALUES (?, ?, ?, ?, ?)",
+                           [(file_id,) + row for row in info['time_signatures']])
+        cursor.executemany("INSERT INTO channels VALUES (?, ?, ?, ?)",
+                           [(file_id, channel, counts[0], counts[1]) for channel, counts in info['channels'].items()])
+
+    def find(self, **kwargs):
+        """
+        Returns a sorted list of file paths matching all of the criteria:
+            text=str          - text meta event contains this text (case insensitive)
+            meta=str or int   - limit the text match to one meta event type (e.g. 'Copyright' or 0x02)
+            min_bpm/max_bpm   - file has a tempo within the range (a single tempo event must be within both bounds;
+                                files without a tempo event play at DEFAULT_BPM and match if it is in the range)
+            min_duration/max_duration - duration in seconds
+            channel=int       - file uses this channel
+            type=int          - midi file type
+        """
+        where = ["f.error IS NULL"]
+        params = []
+        meta_id = None
+        text = None
+        min_bpm = None
+        max_bpm = None
+        for k, v in kwargs.items():
+            if v is None:
+                continue
+            if k == 'text':
+                text = v
+            elif k == 'meta':
+                if type(v) is str:
+                    names = {name.lower(): key for key, name in midicodes.META_EVENT_TYPES.items()}
+                    matches = [key for name, key in names.items() if v.lower() in name]
+                    if len(matches) != 1:
+                        raise ValueError(f"Meta type '{v}' is not a unique meta event name")
+                    v = matches[0]
+                meta_id = int(v)
+            elif k == 'min_bpm':
+                min_bpm = v
+            elif k == 'max_bpm':
+                max_bpm = v
+            elif k == 'min_duration':
+                where.append("f.duration >= ?")
+                params.append(v)
+            elif k == 'max_duration':
+                where.append("f.duration <= ?")
+                params.append(v)
+            elif k == 'channel':
+                where.append("EXISTS (SELECT 1 FROM channels c WHERE c.file_id = f.id AND c.channel = ?)")
+                params.append(v)
+            elif k == 'type':
+                where.append("f.type = ?")
+                params.append(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+
+        if min_bpm is not None or max_bpm is not None:
+            # Both bounds apply to the same tempo event, not one event each
+            low = min_bpm if min_bpm is not None else 0
+            high = max_bpm if max_bpm is not None else 0x7FFFFFFF
+            clause = "EXISTS (SELECT 1 FROM tempos t WHERE t.file_id = f.id AND t.bpm >= ? AND t.bpm <= ?)"
+            params.extend((low, high))
+            if low <= DEFAULT_BPM <= high:
+                clause = f"({clause} OR NOT EXISTS (SELECT 1 FROM tempos t WHERE t.file_id = f.id))"
+            where.append(clause)
+
+        if text is not None or meta_id is not None:
+            clause = "EXISTS (SELECT 1 FROM meta m WHERE m.file_id = f.id"
+            if meta_id is not None:
+                clause += " AND m.meta_id = ?"
+                params.append(meta_id)
+            if text is not None:
+                clause += " AND m.text LIKE ?"
+                params.append(f"%{text}%")
+            where.append(clause + ")")
+
+        sql = f"SELECT f.path FROM files f WHERE {' AND '.join(where)} ORDER BY f.path"
+        return [row[0] for row in self.connection.execute(sql, params)]
+
+    def file_info(self, file_name: str):
+        """
+        Returns the indexed values for a file as a dictionary (None if not indexed)
+        """
+        self.connection.row_factory = sqlite3.Row
+        try:
+            row = self.connection.execute("SELECT * FROM files WHERE path = ?", (file_name,)).fetchone()
+            if row is None:
+                return None
+            info = dict(row)
+            for table in ('meta', 'tempos', 'time_signatures', 'channels'):
+                info[table] = [dict(r) for r in self.connection.execute(
+                    f"SELECT * FROM {table} WHERE file_id = ?", (row['id'],))]
+        finally:
+            self.connection.row_factory = None
+        return info
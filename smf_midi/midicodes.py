@@ -6,6 +6,16 @@ HEADER_INDICATOR = b'MThd'
 TRACK_INDICATOR = b'MTrk'
 END_OF_TRACK_INDICATOR = b'\xFF\x2F\x00'
 
+# SMPTE frame rates as (numerator, denominator) frames per second indexed by the (negated) frame rate stored in
+# the header time division.  29 is 29.97 drop-frame, i.e. 30000/1001 frames per second.
+SMPTE_FRAME_RATES = {24: (24, 1),
+                     25: (25, 1),
+                     29: (30000, 1001),
+                     30: (30, 1)}
+
+# Frame rate codes from bits 5-6 of the hour byte in the SMPTE Offset meta event
+SMPTE_OFFSET_RATES = {0: 24, 1: 25, 2: 29, 3: 30}
+
 CHANNEL_EVENTS = {0x80: "Note off",
                   0x90: "Note on",
                   0xA0: "Polyphonic Key Pressure",
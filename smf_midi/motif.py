@@ -0,0 +1,231 @@
+import logging
+import os
+import numpy as np
+from .polyphony import NoteSpans
+from .index import FileIndex
+
+logger = logging.getLogger("MotifIndex")
+
+# Intervals per n-gram.  Each interval is one byte of the n-gram key, so at most 7 fit in an SQLite integer.
+DEFAULT_GRAM_SIZE = 4
+MAX_GRAM_SIZE = 7
+
+# Largest interval between two note numbers
+MAX_INTERVAL = 127
+
+# Byte of an n-gram key after the end of a melody, so motifs shorter than an n-gram also match at the end
+PADDING = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    notes INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS melodies (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    track INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    ticks BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS grams (
+    gram INTEGER NOT NULL,
+    melody_id INTEGER NOT NULL REFERENCES melodies(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (gram, melody_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS melodies_file ON melodies(file_id);
+CREATE INDEX IF NOT EXISTS grams_melody ON grams(melody_id);
+"""
+
+
+def melodies(spans: NoteSpans):
+    """
+    Returns a list of (track, channel, start ticks, pitches) arrays, one melody per track and channel taken from
+    the highest note starting at each tick (the top line of any chords)
+    """
+    result = []
+    for track in np.unique(spans.tracks):
+        in_track = spans.select(spans.tracks == track)
+        for channel in np.unique(in_track.channels):
+            voice = in_track.select(in_track.channels == channel)
+            # Sort by start then highest pitch first, and keep the first note at each start
+            order = np.lexsort((-voice.pitches.astype(np.int16), voice.starts))
+            starts = voice.starts[order]
+            pitches = voice.pitches[order].astype(np.int16)
+            first = np.concatenate(([True], starts[1:] != starts[:-1]))
+            result.append((int(track), int(channel), starts[first], pitches[first]))
+    return result
+
+
+def gram_keys(intervals, size: int):
+    """
+    Returns the n-gram key at each position of a sequence of intervals: size bytes, most significant first, each
+    the interval + 128 (PADDING past the end).  Every position gets a key, so the keys near the end are padded.
+    """
+    intervals = np.asarray(intervals, dtype=np.int64)
+    digits = np.concatenate((intervals + 128, np.full(size - 1, PADDING, dtype=np.int64)))
+    keys = np.zeros(len(intervals), dtype=np.int64)
+    for offset in range(size):
+        keys = (keys << 8) | digits[offset:offset + len(intervals)]
+    return keys
+
+
+def prefix_range(intervals, size: int):
+    """
+    Returns the (low, high) range of the n-gram keys starting with a sequence of fewer than size intervals
+    """
+    prefix = 0
+    for interval in intervals:
+        prefix = (prefix << 8) | (int(interval) + 128)
+    shift = 8 * (size - len(intervals))
+    return prefix << shift, (prefix + 1) << shift
+
+
+def extract_melodies(file_name: str, size=DEFAULT_GRAM_SIZE):
+    """
+    Reads a midi file and returns a dictionary of what is stored in the index for it: the melodies as (track,
+    channel, start ticks, n-gram keys).  Errors are returned in the dictionary so the file is still recorded.
+    """
+    stat = os.stat(file_name)
+    info = {'path': file_name, 'mtime': stat.st_mtime, 'size': stat.st_size, 'notes': None, 'error': None,
+            'melodies': []}
+    try:
+        spans = NoteSpans.from_file(file_name)
+        info['notes'] = len(spans)
+        for track, channel, starts, pitches in melodies(spans):
+            if len(pitches) < 2:
+                continue
+            intervals = np.diff(pitches)
+            info['melodies'].append((track, channel, starts.astype('<i8').tobytes(), gram_keys(intervals, size)))
+    except Exception as e:
+        logger.debug(f"Failed to index '{file_name}': {e}")
+        info['error'] = f"{type(e).__name__}: {e}"
+    return info
+
+
+def _extract_worker(args):
+    return extract_melodies(*args)
+
+
+class Match:
+    """
+    A motif found in the index: the file, track and channel of the melody, the tick its first note starts and its
+    position (note number) in the melody
+    """
+
+    def __init__(self, path: str, track: int, channel: int, ticks: int, position: int):
+        self.path = path
+        self.track = track
+        self.channel = channel
+        self.ticks = ticks
+        self.position = position
+
+    def __str__(self):
+        return f"{self.path} track={self.track} channel={self.channel} tick={self.ticks} note={self.position}"
+
+    def to_dict(self):
+        return {'path': self.path, 'track': self.track, 'channel': self.channel, 'ticks': self.ticks,
+                'position': self.position}
+
+
+class MotifIndex(FileIndex):
+    """
+    SQLite inverted index of melodic interval n-grams.  Each track and channel of a file gives one melody (the top
+    note at each tick) and every note of it is indexed under the n-gram of the intervals that follow it, so a
+    motif is found wherever it occurs in any key.  The n-gram table is clustered by n-gram, so a query reads only
+    the rows of the n-grams in the motif.  Indexing is incremental: files whose modification time and size are
+    unchanged are skipped.
+    """
+
+    def __init__(self, db_name: str, size=DEFAULT_GRAM_SIZE):
+        if size < 1 or size > MAX_GRAM_SIZE:
+            raise ValueError(f"N-gram size must be from 1 to {MAX_GRAM_SIZE}")
+        super().__init__(db_name, SCHEMA)
+        row = self.connection.execute("SELECT value FROM settings WHERE name = 'gram_size'").fetchone()
+        if row is None:
+            self.connection.execute("INSERT INTO settings VALUES ('gram_size', ?)", (size,))
+            self.connection.commit()
+            self.size = size
+        else:
+            # The keys already stored decide the size
+            self.size = row[0]
+
+    def _extract_tasks(self, file_names):
+        return _extract_worker, [(file_name, self.size) for file_name in file_names]
+
+    def add(self, info: dict):
+        """
+        Add (or replace) the dictionary returned by extract_melodies
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM files WHERE path = ?", (info['path'],))
+        cursor.execute("INSERT INTO files (path, mtime, size, notes, error) VALUES (?, ?, ?, ?, ?)",
+                       (info['path'], info['mtime'], info['size'], info['notes'], info['error']))
+        file_id = cursor.lastrowid
+        for track, channel, ticks, keys in info['melodies']:
+            cursor.execute("INSERT INTO melodies (file_id, track, channel, ticks) VALUES (?, ?, ?, ?)",
+                           (file_id, track, channel, ticks))
+            melody_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO grams VALUES (?, ?, ?)",
+                               zip(keys.tolist(), [melody_id] * len(keys), range(len(keys))))
+
+    def find(self, **kwargs):
+        """
+        Returns the Matches of a motif, in file, track, channel and tick order.  The motif is given as one of:
+            pitches=list   - note numbers, matched in any transposition
+            intervals=list - semitones between successive notes
+        and limit=int is the most matches returned (default all).  A motif of more intervals than the n-gram size
+        is looked up as overlapping n-grams at their offsets, a shorter one as a range of n-gram keys.
+        """
+        intervals = None
+        limit = None
+        for k, v in kwargs.items():
+            if k == 'pitches':
+                intervals = np.diff(np.asarray(v, dtype=np.int64)).tolist()
+            elif k == 'intervals':
+                intervals = [int(interval) for interval in v]
+            elif k == 'limit':
+                limit = None if v is None else int(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        if not intervals:
+            raise ValueError("A motif needs at least two pitches or one interval")
+        if any(abs(interval) > MAX_INTERVAL for interval in intervals):
+            raise ValueError(f"Intervals must be within {MAX_INTERVAL} semitones")
+
+        if len(intervals) < self.size:
+            low, high = prefix_range(intervals, self.size)
+            joins = ""
+            where = "g0.gram >= ? AND g0.gram < ?"
+            params = [low, high]
+        else:
+            # N-grams at offsets 0, size, 2 * size... and one ending with the motif cover every interval
+            keys = gram_keys(intervals, self.size)[:len(intervals) - self.size + 1]
+            offsets = list(range(0, len(keys), self.size))
+            if offsets[-1] != len(keys) - 1:
+                offsets.append(len(keys) - 1)
+            joins = "".join(f" JOIN grams g{n} ON g{n}.gram = ? AND g{n}.melody_id = g0.melody_id "
+                            f"AND g{n}.position = g0.position + {offset}"
+                            for n, offset in enumerate(offsets[1:], 1))
+            where = "g0.gram = ?"
+            params = [int(keys[offset]) for offset in offsets[1:]] + [int(keys[0])]
+
+        sql = (f"SELECT f.path, m.track, m.channel, m.ticks, g0.position FROM grams g0{joins} "
+               f"JOIN melodies m ON m.id = g0.melody_id JOIN files f ON f.id = m.file_id "
+               f"WHERE {where} ORDER BY f.path, m.track, m.channel, g0.position")
+        if limit is not None:
+            sql += f" LIMIT {limit}"
+        matches = []
+        for path, track, channel, ticks, position in self.connection.execute(sql, params):
+            start = int.from_bytes(ticks[position * 8:position * 8 + 8], 'little', signed=True)
+            matches.append(Match(path, track, channel, start, position))
+        return matches
@@ -0,0 +1,266 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from .reader import FileReader
+from .timer import Timer, DEFAULT_TEMPO
+from . import util
+
+logger = logging.getLogger("Player")
+
+
+class CallbackSink:
+    """
+    Sink calling a function with (message bytes, scheduled time in seconds) for each event
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def send(self, message: bytes, timestamp: float):
+        self.callback(message, timestamp)
+
+    def close(self):
+        pass
+
+
+class LoopbackSink:
+    """
+    Sink saving (scheduled time, dispatch time, message) tuples in memory, for testing
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message: bytes, timestamp: float):
+        self.messages.append((timestamp, time.monotonic(), message))
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """
+    Sink writing one line per event to a file: scheduled seconds and the message in hex
+    """
+
+    def __init__(self, file_name: str):
+        self.file_handle = open(file_name, "w")
+
+    def send(self, message: bytes, timestamp: float):
+        self.file_handle.write(f"{timestamp:.6f} {message.hex(' ')}\n")
+
+    def close(self):
+        self.file_handle.close()
+
+
+class JitterStats:
+    """
+    Difference between the scheduled and actual dispatch time of every event, in seconds
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_squared = 0.0
+        self.max = 0.0
+        self.late = 0
+
+    def add(self, error: float, late_threshold: float):
+        self.count += 1
+        self.total += error
+        self.total_squared += error * error
+        self.max = max(self.max, abs(error))
+        if error > late_threshold:
+            self.late += 1
+
+    @property
+    def mean(self):
+        if self.count < 1:
+            return 0.0
+        return self.total / self.count
+
+    @property
+    def stddev(self):
+        if self.count < 1:
+            return 0.0
+        return math.sqrt(max(0.0, self.total_squared / self.count - self.mean ** 2))
+
+    def __str__(self):
+        return f"events={self.count} mean={self.mean * 1000:.3f}ms stddev={self.stddev * 1000:.3f}ms " \
+               f"max={self.max * 1000:.3f}ms late={self.late}"
+
+
+class Player:
+    """
+    Dispatches the events of a midi file to a sink at their wall clock times.  The merged event stream is read
+    once (load) into a schedule of event times in seconds from the tempo map, so starting, seeking and changing
+    the tempo scale never re-read the file.
+
+    Timing is relative to a single monotonic clock anchor rather than accumulated sleeps, so errors never drift.
+    The player sleeps until lookahead seconds before an event is due and then spins until it is due.
+    """
+
+    def __init__(self, midi_file: FileReader, sink, **kwargs):
+        self.midi_file = midi_file
+        self.sink = sink
+        self.lookahead = 0.002
+        self.late_threshold = 0.001
+        self.tempo_scale = 1.0
+        self.include_meta = False
+        for k, v in kwargs.items():
+            if k == 'lookahead':
+                self.lookahead = float(v)
+            elif k == 'late_threshold':
+                self.late_threshold = float(v)
+            elif k == 'tempo_scale':
+                self.tempo_scale = float(v)
+            elif k == 'include_meta':
+                self.include_meta = bool(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        if self.tempo_scale <= 0:
+            raise ValueError("Tempo scale must be greater than 0")
+
+        self.times = []
+        self.messages = []
+        self.jitter = JitterStats()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._anchor_clock = 0.0
+        self._anchor_position = 0.0
+        self._playing = False
+
+        self.load()
+
+    def load(self):
+        """
+        Builds the schedule (event times in seconds and message bytes) from the merged event stream
+        """
+        self.times = []
+        self.messages = []
+        timer = Timer(self.midi_file.time, {}, {0: DEFAULT_TEMPO})
+        for event in self.midi_file.get_events_from_tracks():
+            timer.update_event(event)
+            if event.type == event.META and not self.include_meta:
+                continue
+            self.times.append(timer.absolute_seconds)
+            self.messages.append(bytes(event.event_bytes))
+        logger.debug(f"Loaded {len(self.messages)} events, duration {util.format_seconds_string(self.duration)}")
+
+    @property
+    def duration(self):
+        if len(self.times) < 1:
+            return 0.0
+        return self.times[-1]
+
+    @property
+    def position(self):
+        """
+        The current song position in seconds (unscaled)
+        """
+        with self._lock:
+            if not self._playing:
+                return self._anchor_position
+            return self._anchor_position + (time.monotonic() - self._anchor_clock) * self.tempo_scale
+
+    def _anchor(self, position: float):
+        # Must be called with the lock held
+        self._anchor_clock = time.monotonic()
+        self._anchor_position = position
+
+    def set_tempo_scale(self, tempo_scale: float):
+        """
+        Change playback speed (2.0 is twice as fast) keeping the current position
+        """
+        if tempo_scale <= 0:
+            raise ValueError("Tempo scale must be greater than 0")
+        position = self.position
+        with self._lock:
+            self._anchor(position)
+            self.tempo_scale = tempo_scale
+        self._wakeup.set()
+
+    def seek(self, position: float):
+        """
+        Move playback to a position in seconds
+        """
+        with self._lock:
+            self._anchor(max(0.0, position))
+        self._wakeup.set()
+
+    def start(self, position=None):
+        """
+        Start playback in a background thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("Player is already running")
+        self._thread = threading.Thread(target=self.play, args=(position,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def play(self, position=None):
+        """
+        Dispatch events from position (seconds, default is the current position) until the end or stop is called
+        """
+        self._stopped.clear()
+        with self._lock:
+            if position is None:
+                position = self._anchor_position
+            self._anchor(position)
+            self._playing = True
+
+        index = bisect.bisect_left(self.times, position)
+        anchor = None
+        try:
+            while index < len(self.times) and not self._stopped.is_set():
+
+                with self._lock:
+                    # A seek or tempo change moves the anchor, so find the next event again
+                    if anchor != (self._anchor_clock, self._anchor_position):
+                        anchor = (self._anchor_clock, self._anchor_position)
+                        index = bisect.bisect_left(self.times, self._anchor_position)
+                        if index >= len(self.times):
+                            break
+                    scale = self.tempo_scale
+
+                due = anchor[0] + (self.times[index] - anchor[1]) / scale
+                wait = due - time.monotonic()
+                if wait > self.lookahead:
+                    # Stop, seek and tempo changes wake the player up early
+                    self._wakeup.wait(wait - self.lookahead)
+                    self._wakeup.clear()
+                    continue
+
+                # Spin for the last part of the wait for a precise dispatch time
+                while time.monotonic() < due:
+                    pass
+
+                # Dispatch every event due at this time
+                event_time = self.times[index]
+                while index < len(self.times) and self.times[index] == event_time:
+                    self.jitter.add(time.monotonic() - due, self.late_threshold)
+                    self.sink.send(self.messages[index], event_time)
+                    index += 1
+        finally:
+            with self._lock:
+                position = self._anchor_position + (time.monotonic() - self._anchor_clock) * self.tempo_scale
+                self._anchor(min(position, self.duration))
+                self._playing = False
+
+        logger.debug(f"Playback finished: jitter {self.jitter}")
+        return self.jitter
@@ -0,0 +1,245 @@
+import logging
+import numpy as np
+from .reader import FileReader
+from .extract import scan_events
+
+logger = logging.getLogger("Polyphony")
+
+# Boundaries processed at a time when building pitch envelopes, each needs a row of counts per pitch used
+ENVELOPE_BLOCK = 65536
+
+# Pitch of a silent voice in an envelope
+SILENT = -1
+
+
+class NoteSpans:
+    """
+    The notes of a file as parallel NumPy arrays: start and end ticks, pitch, velocity, channel and track.  Note
+    ons are paired with the earliest open note off of the same channel and pitch in the same track; notes still
+    sounding at the end of a track end at its End of Track.  Type 2 patterns each have their own timeline, so
+    select a track before analysing them.
+    """
+
+    def __init__(self, starts, ends, pitches, velocities, channels, tracks):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.pitches = np.asarray(pitches, dtype=np.int8)
+        self.velocities = np.asarray(velocities, dtype=np.int8)
+        self.channels = np.asarray(channels, dtype=np.int8)
+        self.tracks = np.asarray(tracks, dtype=np.int16)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_file(cls, midi_file, **kwargs):
+        """
+        Reads the note spans of a FileReader (or anything FileReader accepts) by scanning the raw track bytes, so
+        no TrackEvent is made.  Keywords:
+            include=list - track numbers to read (default all)
+        """
+        include = None
+        for k, v in kwargs.items():
+            if k == 'include':
+                if type(v) is not list:
+                    raise ValueError("Include must be list")
+                include = v
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        if not isinstance(midi_file, FileReader):
+            midi_file = FileReader(midi_file)
+
+        columns = ([], [], [], [], [], [])
+        with midi_file.mapped() as data:
+            for track_no, track in enumerate(midi_file.tracks):
+                if include is not None and track_no not in include:
+                    continue
+                _read_spans(data, track, track_no, columns)
+        spans = cls(*columns)
+        logger.debug(f"Read {len(spans)} notes from '{midi_file.file_name}'")
+        return spans
+
+    def select(self, mask):
+        """
+        Returns the spans where a boolean mask (e.g. spans.channels == 1) is True
+        """
+        return NoteSpans(self.starts[mask], self.ends[mask], self.pitches[mask], self.velocities[mask],
+                         self.channels[mask], self.tracks[mask])
+
+    def groups(self, by='channel'):
+        """
+        Returns a dictionary of NoteSpans by channel (by='channel') or track (by='track')
+        """
+        if by not in ('channel', 'track'):
+            raise ValueError(f"Notes must be grouped by 'channel' or 'track', not '{by}'")
+        keys = self.channels if by == 'channel' else self.tracks
+        return {int(key): self.select(keys == key) for key in np.unique(keys)}
+
+
+def _read_spans(data, track, track_no: int, columns):
+    # Appends (start, end, pitch, velocity, channel, track) of the notes of a track to the column lists
+    starts, ends, pitches, velocities, channels, tracks = columns
+    sounding = {}
+    ticks = 0
+    for delta, status, data_start, event_end in scan_events(data, track.start_events, track.end_of_track_offset):
+        ticks += delta
+        command = status & 0xF0
+        if command != 0x80 and command != 0x90:
+            continue
+        key = (status & 0x0F, data[data_start])
+        velocity = data[data_start + 1]
+        if command == 0x90 and velocity > 0:
+            sounding.setdefault(key, []).append((ticks, velocity))
+        elif sounding.get(key):
+            start, on_velocity = sounding[key].pop(0)
+            starts.append(start)
+            ends.append(ticks)
+            pitches.append(key[1])
+            velocities.append(on_velocity)
+            channels.append(key[0])
+            tracks.append(track_no)
+    # Notes never released end with the track
+    for (channel, pitch), note_ons in sounding.items():
+        for start, velocity in note_ons:
+            starts.append(start)
+            ends.append(ticks)
+            pitches.append(pitch)
+            velocities.append(velocity)
+            channels.append(channel)
+            tracks.append(track_no)
+
+
+def _boundaries(starts, ends):
+    # Sorted unique ticks where a note starts or ends (sorting and masking is faster than np.unique)
+    ticks = np.sort(np.concatenate((starts, ends)))
+    return ticks[np.concatenate(([True], ticks[1:] != ticks[:-1]))]
+
+
+def active_counts(starts, ends):
+    """
+    Returns (ticks, counts): the number of notes sounding as a step function, counts[i] holding from ticks[i] up to
+    ticks[i + 1].  The count at each tick is the number of starts up to it less the number of ends, found by binary
+    search in the sorted starts and ends.  A note ending where another starts does not overlap it and only ticks
+    where the count changes are returned.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    ticks = _boundaries(starts, ends)
+    counts = (np.searchsorted(np.sort(starts), ticks, side='right') -
+              np.searchsorted(np.sort(ends), ticks, side='right')).astype(np.int32)
+    changed = np.concatenate(([True], counts[1:] != counts[:-1]))
+    return ticks[changed], counts[changed]
+
+
+def pitch_envelope(starts, ends, pitches):
+    """
+    Returns (ticks, low, high): the lowest and highest pitch sounding as step functions (SILENT where nothing
+    sounds).  Notes sounding per pitch are counted with a cumulative sum over the boundaries, ENVELOPE_BLOCK
+    boundaries at a time so memory stays bounded for millions of notes, and only the pitches used are counted.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    pitches = np.asarray(pitches, dtype=np.int64)
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype=np.int8)
+        return np.zeros(0, dtype=np.int64), empty, empty
+    boundaries = _boundaries(starts, ends)
+    # Only the range of pitches used needs a column
+    lowest = int(pitches.min())
+    width = int(pitches.max()) - lowest + 1
+    # Flat (boundary, pitch) cell of each start and end, sorted so the cells of a block are a slice
+    start_cells = np.sort(np.searchsorted(boundaries, starts) * width + (pitches - lowest))
+    end_cells = np.sort(np.searchsorted(boundaries, ends) * width + (pitches - lowest))
+
+    low = np.empty(len(boundaries), dtype=np.int8)
+    high = np.empty(len(boundaries), dtype=np.int8)
+    carry = np.zeros(width, dtype=np.int64)
+    for first in range(0, len(boundaries), ENVELOPE_BLOCK):
+        last = min(first + ENVELOPE_BLOCK, len(boundaries))
+        size = (last - first) * width
+        cells = []
+        for sorted_cells in (start_cells, end_cells):
+            lo, hi = np.searchsorted(sorted_cells, (first * width, last * width))
+            cells.append(np.bincount(sorted_cells[lo:hi] - first * width, minlength=size))
+        counts = (cells[0] - cells[1]).reshape(last - first, width)
+        counts = np.cumsum(counts, axis=0, out=counts)
+        counts += carry
+        carry = counts[-1].copy()
+        active = counts > 0
+        sounding = active.any(axis=1)
+        low[first:last] = np.where(sounding, lowest + np.argmax(active, axis=1), SILENT)
+        high[first:last] = np.where(sounding, lowest + width - 1 - np.argmax(active[:, ::-1], axis=1), SILENT)
+
+    changed = np.concatenate(([True], (low[1:] != low[:-1]) | (high[1:] != high[:-1])))
+    return boundaries[changed], low[changed], high[changed]
+
+
+def _step_values(ticks, values, at, default):
+    # Values of a step function at the ticks in at
+    idx = np.searchsorted(ticks, at, side='right') - 1
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], default)
+
+
+def _intervals(ticks, flags):
+    # (start, end) rows of the runs of True in a step function of flags
+    if len(ticks) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], flags, [False])).astype(np.int8)))
+    bounds = np.append(ticks, ticks[-1])
+    return np.column_stack((bounds[edges[0::2]], bounds[edges[1::2]]))
+
+
+def overlaps(starts, ends):
+    """
+    Returns the (start, end) rows of the intervals where more than one note sounds, e.g. in a voice that should be
+    monophonic
+    """
+    ticks, counts = active_counts(starts, ends)
+    return _intervals(ticks, counts > 1)
+
+
+def crossings(upper: NoteSpans, lower: NoteSpans):
+    """
+    Returns the (start, end) rows of the intervals where the lower voice sounds above the upper one, i.e. the
+    highest pitch of lower is above the lowest pitch of upper while both sound
+    """
+    ticks_upper, low_upper, _ = pitch_envelope(upper.starts, upper.ends, upper.pitches)
+    ticks_lower, _, high_lower = pitch_envelope(lower.starts, lower.ends, lower.pitches)
+    if len(ticks_upper) == 0 or len(ticks_lower) == 0:
+        # A silent voice crosses nothing
+        return np.zeros((0, 2), dtype=np.int64)
+    ticks = np.union1d(ticks_upper, ticks_lower)
+    low = _step_values(ticks_upper, low_upper, ticks, SILENT)
+    high = _step_values(ticks_lower, high_lower, ticks, SILENT)
+    return _intervals(ticks, (low != SILENT) & (high != SILENT) & (high > low))
+
+
+def voice_order(voices: dict):
+    """
+    Returns the keys of a dictionary of NoteSpans from the highest voice to the lowest, by mean pitch
+    """
+    means = {key: float(np.mean(spans.pitches)) for key, spans in voices.items() if len(spans) > 0}
+    return sorted(means, key=means.get, reverse=True)
+
+
+def analyse(spans: NoteSpans, by='channel'):
+    """
+    Returns a dictionary of compact arrays for the voices (channels or tracks) of spans:
+        'polyphony'  - (ticks, counts) of all notes sounding
+        'voices'     - voice -> {'counts': (ticks, counts), 'envelope': (ticks, low, high), 'overlaps': rows}
+        'order'      - voices from highest to lowest by mean pitch
+        'crossings'  - (upper, lower) -> (start, end) rows, for each pair of adjacent voices in that order
+    """
+    voices = spans.groups(by)
+    result = {'polyphony': active_counts(spans.starts, spans.ends), 'voices': {}, 'order': voice_order(voices),
+              'crossings': {}}
+    for key, voice in voices.items():
+        result['voices'][key] = {'counts': active_counts(voice.starts, voice.ends),
+                                 'envelope': pitch_envelope(voice.starts, voice.ends, voice.pitches),
+                                 'overlaps': overlaps(voice.starts, voice.ends)}
+    order = result['order']
+    for upper, lower in zip(order, order[1:]):
+        result['crossings'][(upper, lower)] = crossings(voices[upper], voices[lower])
+    return result
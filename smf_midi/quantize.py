@@ -0,0 +1,173 @@
+import logging
+import numpy as np
+from .reader import FileReader
+from .writer import FileWriter
+from .track import Track
+
+logger = logging.getLogger("Quantize")
+
+# Sort priority of events at the same tick after quantizing: note offs first so a repeated note is not cut off,
+# then meta and other events, then note ons.  End of track is always last.
+PRIORITY_NOTE_OFF = 0
+PRIORITY_OTHER = 1
+PRIORITY_NOTE_ON = 2
+PRIORITY_END_OF_TRACK = 3
+
+
+def time_signature_map(midi_file: FileReader, track: Track):
+    """
+    Returns (start ticks, beat ticks) arrays of the time signature segments that apply to track.  The time
+    signatures come from the track itself for type 2 files and from track 0 otherwise.  A beat is one
+    denominator note and 4/4 is assumed before the first time signature.
+    """
+    if midi_file.type == 2:
+        source = track
+    else:
+        source = midi_file.tracks[0]
+    starts = [0]
+    beats = [midi_file.time]
+    ticks = 0
+    for event in source.get_events():
+        ticks += event.delta_ticks
+        time_signature = event.time_signature
+        if time_signature is not None:
+            if starts[-1] == ticks:
+                starts.pop()
+                beats.pop()
+            starts.append(ticks)
+            beats.append(midi_file.time * 4 / time_signature.denominator)
+    return np.array(starts, dtype=np.int64), np.array(beats, dtype=np.float64)
+
+
+def snap_to_grid(ticks, starts, grid_ticks, swing=0.0, strength=1.0):
+    """
+    Moves each tick towards the nearest grid point.  starts and grid_ticks are the start tick and grid size of
+    each time signature segment; the grid restarts at every segment.  Odd grid points are delayed by swing
+    (a fraction of the grid size) and strength is the fraction of the distance moved (1.0 snaps exactly).
+    """
+    segment = np.searchsorted(starts, ticks, side='right') - 1
+    origin = starts[segment]
+    grid = grid_ticks[segment]
+    steps = np.rint((ticks - origin) / grid)
+    target = origin + steps * grid + (steps % 2 == 1) * swing * grid
+    return np.rint(ticks + strength * (target - ticks)).astype(np.int64)
+
+
+def quantize_track(midi_file: FileReader, track: Track, grid: float, **kwargs):
+    """
+    Quantizes the note events of a track to a grid (in beats) and returns the list of re-sorted events with
+    recalculated delta times.  Keywords:
+        swing=float     - fraction of the grid to delay every second grid point (default 0)
+        strength=float  - 0 to 1, how far notes move towards the grid (default 1)
+        durations=bool  - also snap note lengths to the grid (default False keeps the original lengths)
+    """
+    swing = 0.0
+    strength = 1.0
+    durations = False
+    for k, v in kwargs.items():
+        if k == 'swing':
+            swing = float(v)
+        elif k == 'strength':
+            strength = float(v)
+        elif k == 'durations':
+            durations = bool(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+    if midi_file.is_time_code_timing:
+        raise ValueError("Cannot quantize to beats with SMPTE time code timing")
+    if grid <= 0:
+        raise ValueError("Grid must be greater than 0")
+
+    # Read the track into parallel lists: events, absolute ticks and sort priority
+    events = []
+    ticks = []
+    priority = []
+    note_ons = []
+    note_offs = []
+    open_notes = {}
+    absolute = 0
+    for idx, event in enumerate(track.get_events()):
+        absolute += event.delta_ticks
+        events.append(event)
+        ticks.append(absolute)
+        if event.type == event.CHANNEL_NOTE:
+            key = (event.channel, event.event_bytes[1])
+            if event.event_bytes[0] & 0xF0 == 0x90 and event.event_bytes[2] > 0:
+                priority.append(PRIORITY_NOTE_ON)
+                open_notes.setdefault(key, []).append(idx)
+            else:
+                priority.append(PRIORITY_NOTE_OFF)
+                # Pair with the earliest open note on of the same channel and note
+                if open_notes.get(key):
+                    note_ons.append(open_notes[key].pop(0))
+                    note_offs.append(idx)
+        elif event.identity == b'\xFF\x2F\x00':
+            priority.append(PRIORITY_END_OF_TRACK)
+        else:
+            priority.append(PRIORITY_OTHER)
+
+    if len(events) < 1:
+        return events
+
+    ticks = np.array(ticks, dtype=np.int64)
+    priority = np.array(priority, dtype=np.int8)
+    starts, beat_ticks = time_signature_map(midi_file, track)
+    grid_ticks = beat_ticks * grid
+
+    # Snap every note on, unpaired note offs and all other events keep their tick
+    new_ticks = ticks.copy()
+    on_idx = np.flatnonzero(priority == PRIORITY_NOTE_ON)
+    new_ticks[on_idx] = snap_to_grid(ticks[on_idx], starts, grid_ticks, swing, strength)
+
+    # Move the paired note offs to keep the original length, or snap the length to the grid
+    note_ons = np.array(note_ons, dtype=np.int64)
+    note_offs = np.array(note_offs, dtype=np.int64)
+    if len(note_ons) > 0:
+        lengths = ticks[note_offs] - ticks[note_ons]
+        if durations:
+            segment = np.searchsorted(starts, ticks[note_ons], side='right') - 1
+            size = grid_ticks[segment]
+            snapped = np.maximum(size, np.rint(lengths / size) * size)
+            lengths = np.rint(lengths + strength * (snapped - lengths)).astype(np.int64)
+        new_ticks[note_offs] = new_ticks[note_ons] + lengths
+    new_ticks = np.maximum(new_ticks, 0)
+
+    # End of track stays after everything else
+    eot_idx = np.flatnonzero(priority == PRIORITY_END_OF_TRACK)
+    new_ticks[eot_idx] = new_ticks.max()
+
+    # Re-sort by tick then priority (stable, so the original order is kept for equal events)
+    order = np.lexsort((priority, new_ticks))
+    sorted_ticks = new_ticks[order]
+    deltas = np.diff(sorted_ticks, prepend=0)
+
+    moved = int(np.count_nonzero(new_ticks != ticks))
+    logger.debug(f"Quantized track: {moved} of {len(events)} events moved")
+
+    return [events[idx].copy(int(delta)) for idx, delta in zip(order, deltas)]
+
+
+def quantize_file(file_in: str, file_out: str, grid: float, **kwargs):
+    """
+    Writes a copy of file_in to file_out with the note events quantized (see quantize_track for keywords).
+    Use tracks=[...] to quantize only some of the tracks (default all).
+    """
+    tracks = None
+    quantize_kwargs = {}
+    for k, v in kwargs.items():
+        if k == 'tracks':
+            tracks = v
+        else:
+            quantize_kwargs[k] = v
+
+    midi_file = FileReader(file_in)
+    with FileWriter(file_out, midi_file.type, midi_file.time) as midi_writer:
+        for track_no, track in enumerate(midi_file.tracks):
+            midi_writer.new_track()
+            if tracks is None or track_no in tracks:
+                events = quantize_track(midi_file, track, grid, **quantize_kwargs)
+            else:
+                events = track.get_events()
+            for event in events:
+                midi_writer.write_event(event)
+            midi_writer.close_track()
@@ -1,12 +1,22 @@
+import hashlib
+import io
 import logging
+import mmap
+import os
+import contextlib
 import struct
 from . import util
+from .buffer import TrackBuffer
 from .track import Track
+from .bargrid import TimeSignatureMap
 from .trackevent import TrackEvent
 from .midicodes import HEADER_INDICATOR, END_OF_TRACK_INDICATOR
 
 logger = logging.getLogger("FileReader")
 
+# Smallest read-ahead buffer used per track when merging with a memory limit
+MIN_BUFFER_SIZE = 256
+
 
 class FileReader:
 
@@ -19,16 +29,30 @@ class FileReader:
         self.extra_bytes = bytearray()
         self.start_of_tracks = 0
         self.file_name = ""
+        self.data = None
         self.tracks = []
+        self.buffer_bytes = 0
+        self._conductor = None
 
         if file_name is not None:
             self.read_file(file_name)
 
-    def read_file(self, file_name: str):
-
-        self.file_name = file_name
+    def read_file(self, file_name):
+        """
+        Reads the file header and the track chunk headers.  file_name is normally a path, which is read as events are
+        needed.  It may also be the bytes of a file or a binary file object (e.g. an archive member, decompressed as
+        it is read), which is read once and held in memory.
+        """
+        if isinstance(file_name, (bytes, bytearray, memoryview)):
+            self.data = bytes(file_name)
+            self.file_name = "<bytes>"
+        elif hasattr(file_name, 'read'):
+            self.data = file_name.read()
+            self.file_name = str(getattr(file_name, 'name', "<stream>"))
+        else:
+            self.file_name = file_name
         offset = 0
-        with open(self.file_name, "rb") as file_handle:
+        with self.open() as file_handle:
 
             logger.debug("Reading file header...")
 
@@ -85,23 +109,110 @@ class FileReader:
 
         return
 
+    def reload(self):
+        """
+        Reads the file again after it changed on disk, keeping the Track objects of the chunks that did not change.
+        Every chunk is digested when its header is read, so the old tracks are matched to the new chunks by length
+        and digest; the decoded events of a loaded track (Track.load_events) are kept even if the chunk moved.  The
+        conductor maps are rebuilt only if track 0 changed.  Returns the numbers of the tracks that are new or
+        changed.
+        """
+        if self.data is not None:
+            raise RuntimeError("Only files read from a path can be reloaded")
+        old_tracks = self.tracks
+        old_conductor_track = old_tracks[0] if old_tracks else None
+        # Old tracks by (chunk length, digest)
+        previous = {}
+        for track in old_tracks:
+            previous.setdefault((track.chunk_length, track.digest), []).append(track)
+
+        self.extra_bytes = bytearray()
+        self.tracks = []
+        self.read_file(self.file_name)
+
+        changed = []
+        for track_no, track in enumerate(self.tracks):
+            matches = previous.get((track.chunk_length, track.digest))
+            if matches:
+                kept = matches.pop(0)
+                kept.move(track.chunk_offset)
+                self.tracks[track_no] = kept
+                continue
+            changed.append(track_no)
+
+        if not self.tracks or self.tracks[0] is not old_conductor_track:
+            self._conductor = None
+        logger.debug(f"Reloaded '{self.file_name}': {len(changed)} of {len(self.tracks)} tracks changed")
+        return changed
+
+    @property
+    def conductor(self):
+        """
+        The (time signatures, tempos) dictionaries of the file indexed by absolute tick, as used by Timer, from the
+        events of track 0 (the first pattern of a type 2 file).  Built once and kept until a reload changes track 0.
+        """
+        if self._conductor is None:
+            time_signatures = TimeSignatureMap()
+            tempos = {}
+            if self.tracks:
+                ticks = 0
+                for event in self.tracks[0].load_events():
+                    ticks += event.delta_ticks
+                    if event.time_signature:
+                        time_signatures[ticks] = event.time_signature
+                    elif event.tempo:
+                        tempos[ticks] = event.tempo
+            self._conductor = (time_signatures, tempos)
+        return self._conductor
+
+    def open(self):
+        """
+        Returns a new binary file object positioned at the start of the file, over the bytes held for an in memory
+        source
+        """
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.file_name, "rb")
+
+    @contextlib.contextmanager
+    def mapped(self):
+        """
+        Context manager giving the whole file as a read-only buffer: the bytes held or a memory map of the file
+        """
+        if self.data is not None:
+            yield memoryview(self.data)
+            return
+        with open(self.file_name, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
     def _load_tracks(self):
         current_offset = self.start_of_tracks
         for track_idx in range(self.track_count):
             logger.debug(f"Reading track {track_idx}")
             midi_track = Track()
-            midi_track.read_track(self.file_name, current_offset)
+            midi_track.read_track(self.file_name, current_offset, self.data)
             current_offset = midi_track.end_of_track_offset
             self.tracks.append(midi_track)
+        if not self.tracks:
+            return
+        # Digest every chunk while it is at hand, so reload can tell which tracks changed
+        with self.mapped() as data:
+            with memoryview(data) as view:
+                for track in self.tracks:
+                    track.digest = hashlib.blake2b(view[track.chunk_offset:track.chunk_offset + track.chunk_length],
+                                                   digest_size=16).digest()
 
     def get_events_from_tracks(self, **kwargs):
         """
         Generator to read events from multiple tracks, yielding them as though they were in a single track;
-        correcting time delta and eliminating duplicate events.
+        correcting time delta and eliminating duplicate events.  Tracks whose events are kept (Track.load_events)
+        are not decoded again, and the conductor maps are used once they are built.
         """
         squash_channel = 0
         include = list(range(len(self.tracks)))
         omit_events = [END_OF_TRACK_INDICATOR]
+        buffer_size = None
+        memory_limit = None
         for k, v in kwargs.items():
             if k == 'include':
                 if type(v) is not list:
@@ -111,28 +222,77 @@ class FileReader:
                 omit_events.extend(v)
             elif k == 'squash':
                 squash_channel = int(v)
+            elif k == 'buffer_size':
+                buffer_size = int(v)
+            elif k == 'memory_limit':
+                memory_limit = int(v)
             else:
                 raise ValueError(f"Keyword '{k}' invalid")
 
-        current_time = 0
-        current_delta = 0
-        time_signatures = {}
+        time_signatures = TimeSignatureMap()
         tempos = {}
+        if self._conductor is not None and self.type != 2:
+            # The conductor maps are already built, so every timer has the whole map from the start
+            time_signatures.update(self._conductor[0])
+            tempos.update(self._conductor[1])
+
+        # Type 2 tracks are independent patterns and cannot be merged into a single timeline
+        if self.type == 2 and len(include) > 1:
+            raise RuntimeError("Type 2 tracks are independent patterns--include a single track or use get_patterns")
+
+        # In bounded memory mode all tracks are read through fixed size buffers over one shared file descriptor.
+        # A memory limit is divided evenly between the included tracks.
+        shared_fd = None
+        if memory_limit is not None:
+            buffer_size = max(MIN_BUFFER_SIZE, memory_limit // max(1, len(include)))
+        if buffer_size is not None and self.data is not None:
+            # The whole file is already in memory so there is nothing to bound
+            buffer_size = None
+        if buffer_size is not None:
+            shared_fd = os.open(self.file_name, os.O_RDONLY)
+            self.buffer_bytes = buffer_size * len(include)
+            logger.debug(f"Merging {len(include)} tracks with {buffer_size} byte buffers "
+                         f"({self.buffer_bytes} bytes total)")
+
+        try:
+            # Initialize all track event generators
+            track_db = {}
+            for track_no, track in enumerate(self.tracks):
+                if track_no not in include:
+                    logger.info(f"Skipping track '{track_no}'--not in included tracks")
+                    continue
+                track.set_timer(self.time, time_signatures, tempos)
+                event_kwargs = {'omit': omit_events, 'squash': squash_channel}
+                if shared_fd is not None:
+                    event_kwargs['buffer'] = TrackBuffer(shared_fd, buffer_size)
+                track_info = {'generator': track.get_events(**event_kwargs)}
+                try:
+                    track_info['next_event'] = next(track_info['generator'])
+                except StopIteration:
+                    continue
+                track_db[track] = track_info
+
+            yield from self._merge_tracks(track_db)
+        finally:
+            if shared_fd is not None:
+                os.close(shared_fd)
 
-        # Initialize all track event generators
-        track_db = {}
-        track_no = 0
-        for track in self.tracks:
-            if track_no not in include:
-                logger.info(f"Skipping track '{track_no}'--not in included tracks")
-            track.set_timer(self.time, time_signatures, tempos)
-            track_info = {'generator': track.get_events(omit=omit_events, squash=squash_channel)}
-            try:
-                track_info['next_event'] = next(track_info['generator'])
-            except StopIteration:
-                continue
-            track_db[track] = track_info
-            track_no += 1
+        # Create an end-of-track event
+        eot = TrackEvent()
+        eot.set_delta_ticks(0)
+        eot.event_bytes = END_OF_TRACK_INDICATOR
+        yield eot
+
+        return
+
+    @staticmethod
+    def _merge_tracks(track_db: dict):
+        """
+        Yields the events of the track generators in track_db in time order, correcting the time deltas
+        and dropping duplicate events at the same time.
+        """
+        current_time = 0
+        current_delta = 0
 
         while len(track_db) > 0:
 
@@ -156,10 +316,10 @@ class FileReader:
                     if failsafe < 0:
                         raise RuntimeError("FAILSAFE: Infinite loop detected")
 
-                    if event.event_bytes not in current_events:
+                    if event.identity not in current_events:
                         event.set_delta_ticks(current_delta)
                         yield event
-                        current_events.append(event.event_bytes)
+                        current_events.append(event.identity)
 
                     # Once we yield an event at this delta, we must zero it out again for future
                     # events at the current_time
@@ -186,11 +346,26 @@ class FileReader:
                 current_delta = next_time - current_time
                 current_time = next_time
 
-        # Create an end-of-track event
-        eot = TrackEvent()
-        eot.set_delta_ticks(0)
-        eot.event_bytes = END_OF_TRACK_INDICATOR
-        yield eot
+    def get_patterns(self, **kwargs):
+        """
+        Generator for type 2 files, yielding each track as an independent pattern (song).  Each pattern gets its
+        own timer with separate tempo and time signature state so nothing carries over between patterns.  Only the
+        track header is held; events are read when the pattern's get_events generator is iterated.
+        """
+        include = list(range(len(self.tracks)))
+        for k, v in kwargs.items():
+            if k == 'include':
+                if type(v) is not list:
+                    raise ValueError("Include must be list")
+                include = v
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+
+        for track_no, track in enumerate(self.tracks):
+            if track_no not in include:
+                continue
+            track.set_timer(self.time, {}, {})
+            yield track
 
         return
 
@@ -215,3 +390,18 @@ class FileReader:
         if self.time & 0x8000:
             return True
         return False
+
+    @property
+    def frame_rate(self):
+        """
+        SMPTE frames per second (29 is 29.97 drop-frame) or None for metrical timing
+        """
+        if not self.is_time_code_timing:
+            return None
+        return 256 - (self.time >> 8)
+
+    @property
+    def ticks_per_frame(self):
+        if not self.is_time_code_timing:
+            return None
+        return self.time & 0xFF
@@ -0,0 +1,94 @@
+import logging
+import tempfile
+from .reader import FileReader
+from .writer import FileWriter, DEFAULT_SPILL_SIZE
+from .trackevent import TrackEvent
+from .midicodes import END_OF_TRACK_INDICATOR
+from . import util
+
+logger = logging.getLogger("Split")
+
+
+class SpillBuffer:
+    """
+    Collects the encoded events of one output track, recalculating the delta times from absolute ticks.  The
+    data is kept in memory until it reaches max_size and is then moved to a temporary file.
+    """
+
+    def __init__(self, max_size=DEFAULT_SPILL_SIZE):
+        self.file_handle = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.last_ticks = 0
+        self.event_count = 0
+
+    def write_event(self, event: TrackEvent, absolute_ticks: int):
+        if event.payload is not None:
+            self.file_handle.write(util.int_to_var_len(absolute_ticks - self.last_ticks) + event.header_bytes)
+            event.payload.copy_to(self.file_handle)
+        else:
+            self.file_handle.write(util.int_to_var_len(absolute_ticks - self.last_ticks) + event.event_bytes)
+        self.last_ticks = absolute_ticks
+        self.event_count += 1
+
+    def end_track(self, absolute_ticks: int):
+        # All tracks end at the same time as the source track
+        self.file_handle.write(util.int_to_var_len(absolute_ticks - self.last_ticks) + END_OF_TRACK_INDICATOR)
+        self.last_ticks = absolute_ticks
+
+    def copy_to(self, midi_writer: FileWriter, desc=""):
+        self.file_handle.seek(0)
+        midi_writer.copy_bytes(self.file_handle, desc)
+
+    def close(self):
+        self.file_handle.close()
+
+
+def split_channels(file_in: str, file_out: str, **kwargs):
+    """
+    Converts a type 0 file to a type 1 file with a conductor track (tempo, time signature and other non-channel
+    events) followed by one track per channel used, in a single pass over the source events.  Returns the
+    list of channels in output track order (after the conductor track).
+        spill_size=int  - bytes buffered in memory per track before spilling to a temporary file
+    """
+    spill_size = DEFAULT_SPILL_SIZE
+    for k, v in kwargs.items():
+        if k == 'spill_size':
+            spill_size = int(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    midi_reader = FileReader(file_in)
+    if midi_reader.type != 0:
+        raise RuntimeError(f"Midi file '{file_in}' is type {midi_reader.type}, not a type 0 file")
+
+    conductor = SpillBuffer(spill_size)
+    channels = {}
+    absolute_ticks = 0
+    try:
+        for event in midi_reader.tracks[0].get_events():
+            absolute_ticks += event.delta_ticks
+            if event.identity == END_OF_TRACK_INDICATOR:
+                continue
+            if event.is_channel_event:
+                if event.channel not in channels:
+                    channels[event.channel] = SpillBuffer(spill_size)
+                channels[event.channel].write_event(event, absolute_ticks)
+            else:
+                conductor.write_event(event, absolute_ticks)
+
+        with FileWriter(file_out, 1, midi_reader.time) as midi_writer:
+            midi_writer.new_track()
+            conductor.end_track(absolute_ticks)
+            conductor.copy_to(midi_writer, "conductor track")
+            midi_writer.close_track()
+            for channel in sorted(channels):
+                logger.debug(f"Channel {channel}: {channels[channel].event_count} events")
+                midi_writer.new_track()
+                channels[channel].end_track(absolute_ticks)
+                channels[channel].copy_to(midi_writer, f"channel {channel} track")
+                midi_writer.close_track()
+    finally:
+        conductor.close()
+        for buffer in channels.values():
+            buffer.close()
+
+    return sorted(channels)
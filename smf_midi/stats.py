@@ -0,0 +1,269 @@
+import json
+import logging
+import multiprocessing
+import os
+from .reader import FileReader
+from .bargrid import TimeSignatureMap
+from .timer import tracks_seconds
+from .trackevent import TrackEvent
+from . import util
+
+logger = logging.getLogger("CorpusStats")
+
+MIDI_EXTENSIONS = ('.mid', '.midi', '.smf', '.kar')
+
+# Width of the buckets used for the duration histogram
+DURATION_BUCKET_SECONDS = 30
+
+
+class CorpusStats:
+    """
+    Mergeable statistics for a set of midi files.  Each worker builds a CorpusStats for its own files and the
+    results are combined with merge, so the order the files are scanned in does not matter.  Histograms are
+    dictionaries (or lists indexed by value) so they can be written to and loaded from JSON.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.errors = []
+        self.events = 0
+        self.notes = 0
+        self.file_types = {}
+        self.track_counts = {}
+        self.event_types = {}
+        self.pitches = [0] * 128
+        self.velocities = [0] * 128
+        self.tempos = {}
+        self.min_bpm = None
+        self.max_bpm = None
+        self.durations = {}
+        self.total_seconds = 0
+        self.min_seconds = None
+        self.max_seconds = None
+
+    @staticmethod
+    def _count(histogram: dict, key, count=1):
+        histogram[key] = histogram.get(key, 0) + count
+
+    @staticmethod
+    def _min(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return min(a, b)
+
+    @staticmethod
+    def _max(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return max(a, b)
+
+    def add_event(self, event: TrackEvent):
+        self.events += 1
+        self._count(self.event_types, event.type)
+        if event.type == event.CHANNEL_NOTE:
+            # Note on with velocity 0 is a note off
+            if event.event_bytes[0] & 0xF0 == 0x90 and event.event_bytes[2] > 0:
+                self.notes += 1
+                self.pitches[event.event_bytes[1]] += 1
+                self.velocities[event.event_bytes[2]] += 1
+        elif event.tempo:
+            bpm = util.microseconds_to_bpm(event.tempo)
+            self._count(self.tempos, str(bpm))
+            self.min_bpm = self._min(self.min_bpm, bpm)
+            self.max_bpm = self._max(self.max_bpm, bpm)
+
+    def add_file(self, midi_file: FileReader, seconds: float):
+        self.files += 1
+        self._count(self.file_types, str(midi_file.type))
+        self._count(self.track_counts, str(midi_file.track_count))
+        bucket = int(seconds // DURATION_BUCKET_SECONDS) * DURATION_BUCKET_SECONDS
+        self._count(self.durations, str(bucket))
+        self.total_seconds += seconds
+        self.min_seconds = self._min(self.min_seconds, seconds)
+        self.max_seconds = self._max(self.max_seconds, seconds)
+
+    def add_error(self, file_name: str, error: str):
+        self.errors.append({'file': file_name, 'error': error})
+
+    def merge(self, other):
+        """
+        Combine another CorpusStats into this one (the reduce step)
+        """
+        self.files += other.files
+        self.errors.extend(other.errors)
+        self.events += other.events
+        self.notes += other.notes
+        for attr in ('file_types', 'track_counts', 'event_types', 'tempos', 'durations'):
+            histogram = getattr(self, attr)
+            for k, v in getattr(other, attr).items():
+                self._count(histogram, k, v)
+        self.pitches = [a + b for a, b in zip(self.pitches, other.pitches)]
+        self.velocities = [a + b for a, b in zip(self.velocities, other.velocities)]
+        self.min_bpm = self._min(self.min_bpm, other.min_bpm)
+        self.max_bpm = self._max(self.max_bpm, other.max_bpm)
+        self.total_seconds += other.total_seconds
+        self.min_seconds = self._min(self.min_seconds, other.min_seconds)
+        self.max_seconds = self._max(self.max_seconds, other.max_seconds)
+        return self
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        stats = cls()
+        for k, v in data.items():
+            if not hasattr(stats, k):
+                raise ValueError(f"Unknown statistic '{k}'")
+            setattr(stats, k, v)
+        return stats
+
+
+def find_midi_files(paths):
+    """
+    Returns a sorted list of midi files from a list of file and directory names (directories are walked)
+    """
+    file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    if name.lower().endswith(MIDI_EXTENSIONS):
+                        file_names.append(os.path.join(root, name))
+        else:
+            file_names.append(path)
+    return sorted(file_names)
+
+
+def scan_file(file_name, stats: CorpusStats = None):
+    """
+    Adds the statistics for one file (a file name or an already read FileReader) to stats (a new CorpusStats if
+    not provided).  Errors are recorded in the stats rather than raised so one bad file does not stop a corpus scan.
+    """
+    if stats is None:
+        stats = CorpusStats()
+    partial = CorpusStats()
+    if isinstance(file_name, FileReader):
+        midi_file = file_name
+        file_name = midi_file.file_name
+    else:
+        midi_file = None
+    try:
+        if midi_file is None:
+            midi_file = FileReader(file_name)
+        time_signatures = TimeSignatureMap()
+        tempos = {}
+        for track in midi_file.tracks:
+            # Type 2 patterns are independent so each gets its own tempo map, otherwise track 0 sets the tempo
+            if midi_file.type == 2:
+                track.set_timer(midi_file.time, {}, {})
+            else:
+                track.set_timer(midi_file.time, time_signatures, tempos)
+            for event in track.get_events():
+                partial.add_event(event)
+        partial.add_file(midi_file, tracks_seconds(midi_file))
+    except Exception as e:
+        logger.debug(f"Failed to scan '{file_name}': {e}")
+        stats.add_error(file_name, f"{type(e).__name__}: {e}")
+        return stats
+    return stats.merge(partial)
+
+
+def scan_files(file_names):
+    """
+    Worker function: scans a batch of files and returns the batch along with its partial statistics
+    """
+    stats = CorpusStats()
+    for file_name in file_names:
+        scan_file(file_name, stats)
+    return file_names, stats
+
+
+def _scan_member(name: str, midi_file: FileReader):
+    # Worker function for archive members, see scan_corpus
+    return scan_file(midi_file)
+
+
+def scan_corpus(paths, **kwargs):
+    """
+    Scans all midi files found in paths with a pool of worker processes.  Each worker returns partial statistics
+    for a batch of files which are merged as they complete.  Zip and tar archives in paths are read in place, one
+    pass each, with their members handed to the workers.  If a checkpoint file name is provided, progress is
+    saved to it periodically and an existing checkpoint is resumed (files already scanned are skipped).
+    """
+    workers = None
+    batch_size = 32
+    checkpoint = None
+    checkpoint_every = 10
+    for k, v in kwargs.items():
+        if k == 'workers':
+            workers = v
+        elif k == 'batch_size':
+            batch_size = int(v)
+        elif k == 'checkpoint':
+            checkpoint = v
+        elif k == 'checkpoint_every':
+            checkpoint_every = int(v)
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    stats = CorpusStats()
+    done = set()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint, "r") as fh:
+            saved = json.load(fh)
+        stats = CorpusStats.from_dict(saved['stats'])
+        done = set(saved['done'])
+        logger.info(f"Resuming from checkpoint '{checkpoint}' with {len(done)} files already scanned")
+
+    from .archive import is_archive, map_archive
+    archives = [path for path in paths if is_archive(path)]
+    paths = [path for path in paths if path not in archives]
+    file_names = [f for f in find_midi_files(paths) if f not in done]
+    batches = [file_names[i:i + batch_size] for i in range(0, len(file_names), batch_size)]
+    logger.info(f"Scanning {len(file_names)} files in {len(batches)} batches")
+
+    with multiprocessing.Pool(workers) as pool:
+        completed = 0
+        for batch, partial in pool.imap_unordered(scan_files, batches):
+            stats.merge(partial)
+            done.update(batch)
+            completed += 1
+            if checkpoint is not None and completed % checkpoint_every == 0:
+                save_checkpoint(checkpoint, stats, done)
+            logger.debug(f"Completed batch {completed}/{len(batches)}")
+
+    for archive_name in archives:
+        logger.info(f"Scanning archive '{archive_name}'")
+        # Members already in the checkpoint are not read at all
+        prefix = f"{archive_name}:"
+        skip = {member_name[len(prefix):] for member_name in done if member_name.startswith(prefix)}
+        scanned = 0
+        for name, partial, error in map_archive(archive_name, _scan_member, workers=workers, skip=skip):
+            member_name = prefix + name
+            if error is not None:
+                stats.add_error(member_name, error)
+            else:
+                stats.merge(partial)
+            done.add(member_name)
+            scanned += 1
+            # Saved as often as for files, every checkpoint_every batches worth of members
+            if checkpoint is not None and scanned % (checkpoint_every * batch_size) == 0:
+                save_checkpoint(checkpoint, stats, done)
+
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, stats, done)
+
+    return stats
+
+
+def save_checkpoint(file_name: str, stats: CorpusStats, done: set):
+    # Write to a temporary name first so an interruption never leaves a partial checkpoint
+    temp_name = file_name + ".tmp"
+    with open(temp_name, "w") as fh:
+        json.dump({'stats': stats.to_dict(), 'done': sorted(done)}, fh)
+    os.replace(temp_name, file_name)
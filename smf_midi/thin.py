@@ -0,0 +1,216 @@
+import collections
+import logging
+from .trackevent import TrackEvent
+
+logger = logging.getLogger("Thin")
+
+# Continuous controllers whose curves are thinned: modulation, breath, foot, portamento time, volume, balance, pan,
+# expression, effect controls, general purpose 1-4, sound controllers and effect depths.  Switches, bank select,
+# data entry, (N)RPN and channel mode messages are always kept.
+CURVE_CONTROLLERS = frozenset((0x01, 0x02, 0x04, 0x05, 0x07, 0x08, 0x0A, 0x0B, 0x0C, 0x0D, 0x10, 0x11, 0x12, 0x13) +
+                              tuple(range(0x46, 0x50)) + tuple(range(0x5B, 0x60)))
+
+# Pitch bend and channel pressure curve keys, controllers use their number
+PITCH_BEND = 'pitch'
+CHANNEL_PRESSURE = 'pressure'
+
+# Pitch bend values are 14 bit, so the tolerance (in 7 bit steps) is scaled up for them
+PITCH_BEND_SCALE = 128
+
+# Curve points held per channel before they are thinned without waiting for a note
+DEFAULT_WINDOW = 512
+
+
+def simplify(ticks, values, tolerance: float):
+    """
+    Ramer-Douglas-Peucker simplification of a curve of points in time order.  Returns the sorted indexes of the
+    points to keep: the first and last always, and enough in between that no dropped point is further than
+    tolerance (measured in value, not distance) from the straight line between the points kept either side of it.
+    """
+    count = len(ticks)
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    # Iterative so long curves do not reach the recursion limit
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        span = ticks[last] - ticks[first]
+        rise = values[last] - values[first]
+        worst = 0.0
+        worst_idx = None
+        for idx in range(first + 1, last):
+            if span == 0:
+                expected = values[first]
+            else:
+                expected = values[first] + rise * (ticks[idx] - ticks[first]) / span
+            error = abs(values[idx] - expected)
+            if error > worst:
+                worst = error
+                worst_idx = idx
+        if worst_idx is not None and worst > tolerance:
+            keep[worst_idx] = True
+            stack.append((first, worst_idx))
+            stack.append((worst_idx, last))
+    return [idx for idx in range(count) if keep[idx]]
+
+
+class CurveThinner:
+    """
+    Removes controller, pitch bend and channel pressure events that a straight line between the events kept
+    either side of them reproduces within a tolerance, separately for each channel and controller.  Events are
+    streamed: curve events wait in a queue until their channel plays or releases a note (or a window fills), then
+    each curve is simplified with simplify, so the value in effect at every note boundary is kept.  When the queue
+    grows past max_queue events the channel of the oldest waiting point is thinned, so a channel that never plays
+    a note cannot hold back the rest of the output.  The delta times of dropped events go to the next event
+    written.  Keywords:
+        tolerance=float - largest error allowed, in 7 bit controller steps (default 2, 0 only drops points on lines)
+        window=int      - curve points held per channel before thinning without a note (default 512)
+        max_queue=int   - events held in total before the oldest waiting channel is thinned (default 4 * window)
+        pitch_bend=bool - thin pitch bend (default True)
+        pressure=bool   - thin channel pressure (default True)
+    """
+
+    def __init__(self, **kwargs):
+        self.tolerance = 2.0
+        self.window = DEFAULT_WINDOW
+        self.pitch_bend = True
+        self.pressure = True
+        self.max_queue = None
+        for k, v in kwargs.items():
+            if k == 'tolerance':
+                self.tolerance = float(v)
+            elif k == 'window':
+                self.window = max(3, int(v))
+            elif k == 'max_queue':
+                self.max_queue = max(1, int(v))
+            elif k == 'pitch_bend':
+                self.pitch_bend = bool(v)
+            elif k == 'pressure':
+                self.pressure = bool(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        if self.tolerance < 0:
+            raise ValueError("Tolerance must not be negative")
+        if self.max_queue is None:
+            self.max_queue = 4 * self.window
+
+        self.events_in = 0
+        self.events_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def events_removed(self):
+        return self.events_in - self.events_out
+
+    @property
+    def bytes_removed(self):
+        return self.bytes_in - self.bytes_out
+
+    def _curve_key(self, event: TrackEvent):
+        # The (channel, controller) curve an event belongs to, or None if it is never dropped
+        if event.type == event.CHANNEL_CONTROLLER and event.event_bytes[1] in CURVE_CONTROLLERS:
+            return event.channel, event.event_bytes[1]
+        if self.pitch_bend and event.type == event.CHANNEL_PITCH:
+            return event.channel, PITCH_BEND
+        if self.pressure and event.type == event.CHANNEL_PRESSURE:
+            return event.channel, CHANNEL_PRESSURE
+        return None
+
+    @staticmethod
+    def _value(event: TrackEvent):
+        if event.type == event.CHANNEL_PITCH:
+            return event.event_bytes[1] | (event.event_bytes[2] << 7)
+        return event.event_bytes[-1]
+
+    def thin(self, events):
+        """
+        Generator yielding the events (from get_events or get_events_from_tracks) that are kept, with their delta
+        times corrected.  The events yielded are the ones read, so events reused in place cannot be thinned.
+        """
+        # Queue of [absolute ticks, event, keep] in input order, keep is None until the event's curve is thinned
+        queue = collections.deque()
+        # Channel -> curve key -> list of queue entries waiting to be thinned
+        curves = {}
+        # Channel -> count of points waiting
+        waiting = {}
+        # Controllers with their 14 bit (LSB) partner in use are left alone, thinning half a value would break it
+        paired = set()
+        ticks = 0
+        written = 0
+
+        for event in events:
+            self.events_in += 1
+            self.bytes_in += event.size
+            ticks += event.delta_ticks
+
+            key = self._curve_key(event)
+            if event.type == event.CHANNEL_CONTROLLER and 0x20 <= event.event_bytes[1] < 0x40:
+                msb_key = (event.channel, event.event_bytes[1] - 0x20)
+                if msb_key not in paired:
+                    paired.add(msb_key)
+                    # The MSB points already waiting are kept too
+                    for entry in curves.get(event.channel, {}).pop(msb_key, []):
+                        entry[2] = True
+                        waiting[event.channel] -= 1
+            if key in paired:
+                key = None
+            entry = [ticks, event, None if key is not None else True]
+            queue.append(entry)
+
+            if key is not None:
+                curves.setdefault(key[0], {}).setdefault(key, []).append(entry)
+                waiting[key[0]] = waiting.get(key[0], 0) + 1
+                if waiting[key[0]] >= self.window:
+                    self._flush(curves, waiting, key[0])
+            elif event.type == event.CHANNEL_NOTE:
+                # Keep the curve values in effect when the note starts or ends
+                self._flush(curves, waiting, event.channel)
+
+            # Write what has been decided, in input order
+            while queue:
+                if queue[0][2] is None:
+                    if len(queue) <= self.max_queue:
+                        break
+                    # The oldest point has waited too long for its channel, thin that channel now
+                    self._flush(curves, waiting, queue[0][1].channel)
+                written = yield from self._write(queue.popleft(), written)
+
+        for channel in list(curves):
+            self._flush(curves, waiting, channel)
+        while queue:
+            written = yield from self._write(queue.popleft(), written)
+
+        logger.debug(f"Thinned {self.events_removed} of {self.events_in} events ({self.bytes_removed} bytes)")
+
+    def _flush(self, curves: dict, waiting: dict, channel: int):
+        # Thin every curve of the channel, deciding which of its queued points are kept
+        for key, entries in curves.pop(channel, {}).items():
+            ticks = [entry[0] for entry in entries]
+            values = [self._value(entry[1]) for entry in entries]
+            tolerance = self.tolerance * PITCH_BEND_SCALE if key[1] == PITCH_BEND else self.tolerance
+            for entry in entries:
+                entry[2] = False
+            for idx in simplify(ticks, values, tolerance):
+                entries[idx][2] = True
+        waiting.pop(channel, None)
+
+    def _write(self, entry, written: int):
+        ticks, event, keep = entry
+        if not keep:
+            return written
+        event.set_delta_ticks(ticks - written)
+        self.events_out += 1
+        self.bytes_out += event.size
+        yield event
+        return ticks
+
+
+def thin_events(events, **kwargs):
+    """
+    Generator yielding events with the controller, pitch bend and channel pressure curves thinned (see CurveThinner
+    for keywords)
+    """
+    yield from CurveThinner(**kwargs).thin(events)
@@ -1,4 +1,9 @@
-from .trackevent import TrackEvent
+from .trackevent import TrackEvent, SmpteOffset
+from .midicodes import SMPTE_FRAME_RATES
+from .bargrid import BarGrid, TimeSignatureMap
+
+# Tempo assumed before the first tempo event (120 bpm)
+DEFAULT_TEMPO = 500000
 
 
 class Timer:
@@ -9,6 +14,14 @@ class Timer:
     containing integer values from the tempo events.  These dictionaries can be pre-loaded by reading track 0 from
     a type 1 or 2 midi file or updated in process for type 0 or reading all tracks in parallel.  Each event MUST
     use the update_ticks OR update_event method to keep the timing correct.
+
+    Measure positions come from a BarGrid of the time signatures, rebuilt when the time signatures change.  Share a
+    TimeSignatureMap between timers so a change is found from its version; a plain dictionary is compared item by
+    item instead.
+
+    When the division is a SMPTE time code (bit 15 set) the high byte is the negative frame rate and the low byte
+    the ticks per frame.  Ticks then convert to seconds by a constant factor, so tempo events are ignored for timing
+    and measures are not tracked.
     """
 
     def __init__(self, division: int, time_signatures: dict, tempos: dict):
@@ -20,25 +33,97 @@ class Timer:
         self.division = division
         self.time_signatures = time_signatures
         self.tempos = tempos
+        self.smpte_offset = None
+        self._bar_grid = None
+        self._bar_grid_key = None
+
+        # For SMPTE timing save the frame rate as an exact ratio so seconds are calculated with integer math
+        self.frame_rate = None
+        self.ticks_per_frame = None
+        if division & 0x8000:
+            self.frame_rate = 256 - (division >> 8)
+            if self.frame_rate not in SMPTE_FRAME_RATES:
+                raise ValueError(f"Invalid SMPTE frame rate {self.frame_rate} in time division 0x{division:04X}")
+            self.ticks_per_frame = division & 0xFF
+            if self.ticks_per_frame < 1:
+                raise ValueError(f"Invalid SMPTE ticks per frame in time division 0x{division:04X}")
+
+    @property
+    def is_time_code_timing(self):
+        return self.frame_rate is not None
+
+    @property
+    def offset_microseconds(self):
+        if self.smpte_offset is None:
+            return 0
+        return self.smpte_offset.microseconds
+
+    @property
+    def bar_grid(self):
+        """
+        The BarGrid of the current time signatures (None with time code timing)
+        """
+        if self.is_time_code_timing:
+            return None
+        # The dictionary may be shared and changed by other timers
+        version = getattr(self.time_signatures, 'version', None)
+        if version is None:
+            # The items hold the TimeSignature objects, so a replaced one cannot compare equal
+            version = tuple(self.time_signatures.items())
+        key = (id(self.time_signatures), version)
+        if self._bar_grid is None or self._bar_grid_key != key:
+            self._bar_grid = BarGrid(self.division, self.time_signatures)
+            self._bar_grid_key = key
+        return self._bar_grid
 
     @property
     def current_measure(self):
         # Represent as integers and covert from zero based to one based for measure and beat
         return f"{int(self.measures)+1}:{int(self.measure_beats) + 1}.{int(self.measure_ticks):03}"
 
+    def measure_range(self, first: int, last=None):
+        """
+        Returns the (start, end) absolute ticks of one based measures first to last (inclusive)
+        """
+        if self.is_time_code_timing:
+            raise ValueError("Measures are not tracked with SMPTE time code timing")
+        return self.bar_grid.measure_range(first, last)
+
     @property
     def current_time(self):
         minutes = int(self.absolute_seconds // 60)
         seconds = self.absolute_seconds % 60
         hours = int(minutes // 60)
-        minutes = int(minutes // 60)
+        minutes = int(minutes % 60)
         return f"{hours}:{minutes:02}:{seconds:05.2f}"
 
+    @property
+    def current_time_code(self):
+        """
+        The current position as SMPTE hours:minutes:seconds:frames (time code timing only)
+        """
+        if not self.is_time_code_timing:
+            return ""
+        # Frames are counted at the nominal (rounded) frame rate as time code does
+        nominal_rate = 30 if self.frame_rate == 29 else self.frame_rate
+        frames = self.absolute_ticks // self.ticks_per_frame
+        if self.smpte_offset is not None:
+            offset = self.smpte_offset
+            frames += (offset.hours * 3600 + offset.minutes * 60 + offset.seconds) * nominal_rate + offset.frames
+        seconds, frames = divmod(frames, nominal_rate)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours:02}:{minutes:02}:{seconds:02}:{frames:02}"
+
     @property
     def ticks_per_beat(self):
-        if len(self.time_signatures) < 1:
+        """
+        Whole ticks in a beat (one denominator note, as in the BarGrid) of the current time signature
+        """
+        if len(self.time_signatures) < 1 or self.is_time_code_timing:
             return 0
-        return (self.division * 4) / self.time_signature.numerator
+        _, denominator = self.bar_grid.time_signature(self.absolute_ticks)
+        return (self.division * 4) // denominator
 
     @property
     def time_signature(self):
@@ -72,30 +157,52 @@ class Timer:
 
     def set_time_signature(self, time_signature, ticks=None):
         if ticks is None:
-            ticks = self.measure_ticks
+            ticks = self.absolute_ticks
         self.time_signatures[ticks] = time_signature
+        self._bar_grid = None
+        self._update_measure()
 
-    def update_ticks(self, delta_ticks: int):
-
-        self.measure_ticks += delta_ticks
-        self.absolute_ticks += delta_ticks
+    def _update_measure(self):
+        if not self.is_time_code_timing:
+            self.measures, self.measure_beats, self.measure_ticks = self.bar_grid.position(self.absolute_ticks)
 
-        time_signature = self.time_signature
-        if time_signature is not None:
+    def set_smpte_offset(self, smpte_offset: SmpteOffset):
+        previous_microseconds = self.offset_microseconds
+        self.smpte_offset = smpte_offset
+        self.absolute_seconds += (self.offset_microseconds - previous_microseconds) / 1000000
 
-            ticks_per_beat = (self.division * 4) / time_signature.numerator
+    def ticks_to_microseconds(self, ticks: int):
+        """
+        Converts an absolute tick position to whole microseconds (including any SMPTE offset).  Time code timing is
+        a single multiply and divide; metrical timing walks the tempo map up to the tick position.
+        """
+        if self.is_time_code_timing:
+            numerator, denominator = SMPTE_FRAME_RATES[self.frame_rate]
+            return self.offset_microseconds + (ticks * 1000000 * denominator) // (numerator * self.ticks_per_frame)
+
+        microseconds = self.offset_microseconds
+        tempo_ticks = sorted(k for k in self.tempos if k < ticks)
+        for idx, start in enumerate(tempo_ticks):
+            if idx + 1 < len(tempo_ticks):
+                end = tempo_ticks[idx + 1]
+            else:
+                end = ticks
+            microseconds += (self.tempos[start] * (end - start)) // self.division
+        return microseconds
+
+    def ticks_to_seconds(self, ticks: int):
+        return self.ticks_to_microseconds(ticks) / 1000000
 
-            # Calculate the number of beats to add
-            self.measure_beats += (self.measure_ticks // ticks_per_beat)
+    def update_ticks(self, delta_ticks: int):
 
-            # Set the ticks to the new remainder
-            self.measure_ticks = self.measure_ticks % ticks_per_beat
+        self.absolute_ticks += delta_ticks
 
-            # Calculate the number of measures to add
-            self.measures += (self.measure_beats // time_signature.denominator)
+        if self.is_time_code_timing:
+            # Time code is a constant factor of the ticks, no tempo or measure tracking
+            self.absolute_seconds = self.ticks_to_seconds(self.absolute_ticks)
+            return
 
-            # Remove beats added to the measure
-            self.measure_beats = (self.measure_beats % time_signature.denominator)
+        self._update_measure()
 
         tempo = self.tempo
         if tempo > 0:
@@ -108,6 +215,25 @@ class Timer:
         self.update_ticks(event.delta_ticks)
 
         if event.time_signature:
-            self.time_signatures[self.absolute_ticks] = event.time_signature
+            self.set_time_signature(event.time_signature)
         elif event.tempo:
             self.tempos[self.absolute_ticks] = event.tempo
+        elif event.smpte_offset:
+            self.set_smpte_offset(event.smpte_offset)
+
+
+def tracks_seconds(midi_file) -> float:
+    """
+    Length in seconds of the longest track of a FileReader whose tracks have all been read through timers set with
+    Track.set_timer.  The end tick of each track is converted over its complete tempo map (shared by the tracks of
+    type 0 and 1 files, one per pattern in type 2), with DEFAULT_TEMPO until the first tempo event.
+    """
+    seconds = 0
+    for track in midi_file.tracks:
+        if track.timer is None:
+            continue
+        tempos = {0: DEFAULT_TEMPO}
+        tempos.update(track.timer.tempos)
+        timer = Timer(track.timer.division, {}, tempos)
+        seconds = max(seconds, timer.ticks_to_seconds(track.timer.absolute_ticks))
+    return seconds
@@ -1,32 +1,58 @@
+import contextlib
+import hashlib
+import io
 import logging
 import struct
-from .trackevent import TrackEvent
+from .trackevent import TrackEvent, Payload
 from .midicodes import TRACK_INDICATOR
 from .timer import Timer
 
 
 logger = logging.getLogger("Track")
 
+# Block size used when hashing a track chunk
+DIGEST_BLOCK_SIZE = 1024 * 1024
+
+# Size of the buffer events are refilled from with get_events(reuse=True)
+REFILL_BUFFER_SIZE = 64 * 1024
+
 
 class Track:
 
     def __init__(self):
         self.filename = ""
+        self.data = None
         self._start_offset = 0
         self.start_events = self._start_offset
         self.header_bytes = bytearray()
         self.track_event_length = 0
         self.timer = None
+        # Digest of the chunk, set by FileReader when the chunk header is read, and the events kept by load_events
+        self.digest = None
+        self.events = None
 
     @property
     def end_of_track_offset(self):
         return self.start_events + self.track_event_length
 
-    def read_track(self, filename: str, start_offset: int):
+    @property
+    def chunk_offset(self):
+        return self._start_offset
+
+    @property
+    def chunk_length(self):
+        # Chunk header (indicator and length) plus the events
+        return 8 + self.track_event_length
 
+    def read_track(self, filename: str, start_offset: int, data=None):
+        """
+        Reads the track chunk header at start_offset of the file, or of data (the bytes of the whole file) when the
+        file is held in memory, in which case filename is only a label
+        """
         self.filename = filename
+        self.data = data
         self._start_offset = start_offset
-        with open(self.filename, "rb") as fh:
+        with self.open() as fh:
             # Initialize
             fh.seek(self._start_offset)
 
@@ -47,14 +73,32 @@ class Track:
 
         return
 
+    def open(self):
+        """
+        Returns a new binary file object over the file (or the bytes held) this track is in
+        """
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.filename, "rb")
+
     def get_events(self, **kwargs):
         """
         Generator to iterate through each track event. Each event is read from the source file and yielded, so
-        any changes will not persist if generator is started from the beginning again.
+        any changes will not persist if generator is started from the beginning again.  A TrackBuffer can be
+        provided with the buffer keyword to read through a shared file descriptor instead of opening the file.
+
+        With reuse=True the track is read through one fixed size buffer (REFILL_BUFFER_SIZE) and the same TrackEvent
+        is refilled in place and yielded for every event, so nothing is allocated per event.  The event is only valid
+        until the next one is read; use event.clone() to keep it.
+
+        Once load_events has kept the events of the track (and reuse is not set) clones of them are yielded instead
+        of reading the file again.
         """
         squash_channel = 0
         omit = []
         include = []
+        track_buffer = None
+        reuse = False
         for k, v in kwargs.items():
             if k == 'omit':
                 omit = v
@@ -62,19 +106,35 @@ class Track:
                 include = v
             elif k == 'squash':
                 squash_channel = int(v)
+            elif k == 'buffer':
+                track_buffer = v
+            elif k == 'reuse':
+                reuse = bool(v)
             else:
                 raise ValueError(f"Keyword '{k}' invalid")
 
-        with open(self.filename, "rb") as fh:
+        # Read from a provided TrackBuffer (shared descriptor) or open the file for this track
+        cached = self.events is not None and not reuse
+        if cached:
+            track_buffer = contextlib.nullcontext()
+        elif track_buffer is None:
+            track_buffer = self.open()
 
-            # Move the file pointer to the start of the events
-            fh.seek(self.start_events)
+        with track_buffer as fh:
 
-            # Loop through each event
-            while fh.tell() < self.end_of_track_offset:
+            if cached:
+                # Events kept by load_events are shared, so callers get copies they can change
+                events = (event.clone() for event in self.events)
+            else:
+                # Move the file pointer to the start of the events
+                fh.seek(self.start_events)
+                if reuse:
+                    events = self._refill_events(fh)
+                else:
+                    events = self._read_events(fh)
 
-                # Create a TrackEvent from the data
-                event = TrackEvent(fh)
+            # Loop through each event
+            for event in events:
                 yield_event = True
 
                 # If we have a timer provided, update it
@@ -92,15 +152,15 @@ class Track:
 
                 if yield_event:
                     for omit_bytes in omit:
-                        if event.event_bytes.startswith(omit_bytes):
-                            logger.debug(f"Skipping (omit) event {event.event_bytes}")
+                        if event.startswith(omit_bytes):
+                            logger.debug(f"Skipping (omit) event {event.header_bytes}")
                             yield_event = False
                             break
 
                 if include and yield_event:
                     for include_bytes in include:
-                        if not event.event_bytes.startswith(include_bytes):
-                            logger.debug(f"Skipping (include) event {event.event_bytes}")
+                        if not event.startswith(include_bytes):
+                            logger.debug(f"Skipping (include) event {event.header_bytes}")
                             yield_event = False
                             break
 
@@ -109,5 +169,98 @@ class Track:
 
         return
 
+    def _read_events(self, fh):
+        running_status = None
+        while fh.tell() < self.end_of_track_offset:
+            # Create a TrackEvent from the data, large sysex and meta data is left in the file until used (there is
+            # no file to leave it in when the track is held in memory)
+            event = TrackEvent(fh, self.filename if self.data is None else None, running_status)
+            running_status = event.next_running_status
+            yield event
+
+    def _refill_events(self, fh):
+        # The events are refilled from a fixed size buffer that slides over the track, so memory use does not grow
+        # with the track.  An event running past the end of the buffer is moved to the front and the buffer topped
+        # up; only an event larger than the whole buffer grows it.
+        buffer = bytearray(min(REFILL_BUFFER_SIZE, max(1, self.track_event_length)))
+        base_offset = self.start_events
+        start = 0
+        end = 0
+        remaining = self.track_event_length
+        event = TrackEvent()
+        running_status = None
+        while start < end or remaining > 0:
+            with memoryview(buffer) as view:
+                try:
+                    offset = event.refill(view[:end], start, base_offset, running_status)
+                except IndexError:
+                    offset = None
+            if offset is not None and offset <= end:
+                start = offset
+                running_status = event.next_running_status
+                yield event
+                continue
+
+            if remaining == 0:
+                raise RuntimeError(f"Event at offset 0x{base_offset + start:X} runs past the end of the track")
+            held = end - start
+            if held == len(buffer):
+                buffer = buffer + bytearray(len(buffer))
+            buffer[:held] = buffer[start:end]
+            base_offset += start
+            start = 0
+            end = held
+            block = fh.read(min(len(buffer) - end, remaining))
+            if len(block) == 0:
+                raise RuntimeError(f"Track at offset 0x{self._start_offset:X} is truncated")
+            buffer[end:end + len(block)] = block
+            end += len(block)
+            remaining -= len(block)
+
+    def chunk_digest(self):
+        """
+        Returns a digest of the whole track chunk, header included, read in blocks
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with self.open() as fh:
+            fh.seek(self._start_offset)
+            remaining = self.chunk_length
+            while remaining > 0:
+                block = fh.read(min(remaining, DIGEST_BLOCK_SIZE))
+                if len(block) == 0:
+                    raise RuntimeError(f"Track chunk at offset 0x{self._start_offset:X} is truncated")
+                digest.update(block)
+                remaining -= len(block)
+        return digest.digest()
+
+    def load_events(self):
+        """
+        Returns the list of all the events of the track, decoded on the first call and kept, so FileReader.reload can
+        keep them if the chunk does not change and get_events does not decode them again.  The events are shared, so
+        clone() one before changing it.
+        """
+        if self.events is None:
+            if self.digest is None:
+                self.digest = self.chunk_digest()
+            with self.open() as fh:
+                fh.seek(self.start_events)
+                self.events = list(self._read_events(fh))
+        return self.events
+
+    def move(self, start_offset: int):
+        """
+        Moves the track to a new chunk offset, e.g. when a reload finds the same chunk after a track before it
+        changed size.  The offsets of loaded events, and of their data left in the file, move with it.
+        """
+        shift = start_offset - self._start_offset
+        if shift == 0:
+            return
+        self._start_offset = start_offset
+        self.start_events += shift
+        for event in self.events or []:
+            event.event_offset += shift
+            if event.payload is not None:
+                event.payload = Payload(event.payload.file_name, event.payload.offset + shift, len(event.payload))
+
     def set_timer(self, division: int, timesignatures: dict, tempos: dict):
         self.timer = Timer(division, timesignatures, tempos)
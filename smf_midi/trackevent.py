@@ -1,6 +1,9 @@
 from . import util
 from . import midicodes
 
+# Sysex and meta event data of at least this many bytes is left in the source file until it is used
+LAZY_PAYLOAD_SIZE = 64 * 1024
+
 
 class TimeSignature:
 
@@ -35,6 +38,82 @@ class TimeSignature:
         return b'\xff\x58\x04' + self.data[-4:]
 
 
+class SmpteOffset:
+
+    def __init__(self, data: bytearray):
+        if len(data) < 5:
+            raise ValueError("Invalid SmpteOffset data '{}'".format(util.hex_dump(data)))
+        hr, self.minutes, self.seconds, self.frames, self.fractional_frames = data[-5:]
+        self.frame_rate = midicodes.SMPTE_OFFSET_RATES[(hr >> 5) & 0x03]
+        self.hours = hr & 0x1F
+        return
+
+    @property
+    def data(self):
+        rate_code = {v: k for k, v in midicodes.SMPTE_OFFSET_RATES.items()}[self.frame_rate]
+        return bytearray(((rate_code << 5) | self.hours, self.minutes, self.seconds, self.frames,
+                          self.fractional_frames))
+
+    @property
+    def microseconds(self):
+        """
+        The offset in whole microseconds, using integer arithmetic (fractional frames are 1/100 of a frame)
+        """
+        numerator, denominator = midicodes.SMPTE_FRAME_RATES[self.frame_rate]
+        whole_seconds = self.hours * 3600 + self.minutes * 60 + self.seconds
+        hundredths = self.frames * 100 + self.fractional_frames
+        return whole_seconds * 1000000 + (hundredths * 1000000 * denominator) // (100 * numerator)
+
+    @property
+    def meta_event(self):
+        # Returns all meta event bytes following (but not including) time delta
+        return b'\xff\x54\x05' + self.data
+
+    def __str__(self):
+        return f"{self.hours:02}:{self.minutes:02}:{self.seconds:02}:{self.frames:02}.{self.fractional_frames:02}" \
+               f" @{self.frame_rate}fps"
+
+
+class Payload:
+    """
+    Reference to sysex or meta event data left in the source file (file name, offset and length).  The data is
+    only read when the event bytes are used, and a FileWriter copies it straight from the source file.
+    """
+
+    def __init__(self, file_name: str, offset: int, length: int):
+        self.file_name = file_name
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self):
+        with open(self.file_name, "rb") as fh:
+            fh.seek(self.offset)
+            data = bytearray(self.length)
+            if fh.readinto(data) != self.length:
+                raise RuntimeError(f"Event data at offset 0x{self.offset:X} of '{self.file_name}' is truncated")
+        return data
+
+    def copy_to(self, file_handle, block_size=1024 * 1024):
+        """
+        Writes the data to an open binary file in blocks
+        """
+        with open(self.file_name, "rb") as fh:
+            fh.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                block = fh.read(min(remaining, block_size))
+                if len(block) == 0:
+                    raise RuntimeError(f"Event data at offset 0x{self.offset:X} of '{self.file_name}' is truncated")
+                file_handle.write(block)
+                remaining -= len(block)
+
+    def __repr__(self):
+        return f"Payload({self.file_name!r}, {self.offset}, {self.length})"
+
+
 class TrackEvent:
 
     # event types
@@ -49,22 +128,94 @@ class TrackEvent:
     CHANNEL_PITCH = "CHANNEL PITCH BEND"
     CHANNEL_POLY_PRESSURE = "POLYPHONIC KEY PRESSURE"
 
-    def __init__(self, midi_file=None):
+    def __init__(self, midi_file=None, source=None, running_status=None):
         self.event_offset = 0
         self.time_bytes = bytearray()
-        self.event_bytes = bytearray()
+        self._event_bytes = bytearray()
         self.subtype = ""
-        self.event_data = bytearray()
+        self._event_data = bytearray()
+        self.payload = None
+        # True when the status byte was left out in the file and taken from the previous event
+        self.running_status = False
 
         if midi_file is not None:
-            self.read_file(midi_file)
+            self.read_file(midi_file, source, running_status)
 
         return
 
-    def read_file(self, midi_file):
+    @property
+    def event_bytes(self):
+        if self.payload is not None:
+            self._load_payload()
+        return self._event_bytes
+
+    @event_bytes.setter
+    def event_bytes(self, value):
+        self.payload = None
+        self._event_bytes = value
+
+    @property
+    def event_data(self):
+        if self.payload is not None:
+            self._load_payload()
+        return self._event_data
+
+    @event_data.setter
+    def event_data(self, value):
+        self._event_data = value
+
+    def _load_payload(self):
+        self._event_data = self.payload.read()
+        self.payload = None
+        self._event_bytes = bytearray(self._event_bytes)
+        self._event_bytes.extend(self._event_data)
+
+    @property
+    def header_bytes(self):
+        """
+        The event bytes before the data: the status, plus the type and length for sysex and meta events.  Never
+        loads a lazy payload.
+        """
+        if self.payload is not None:
+            return self._event_bytes
+        return self._event_bytes[:len(self._event_bytes) - len(self._event_data)]
+
+    @property
+    def identity(self):
+        """
+        Value to compare events by without loading a lazy payload: the event bytes, or the header and location of
+        the payload.  Lazy events with the same data at different locations are therefore not equal.
+        """
+        if self.payload is not None:
+            return bytes(self._event_bytes), self.payload.file_name, self.payload.offset, self.payload.length
+        return self._event_bytes
+
+    @property
+    def size(self):
+        """
+        Bytes the event takes in a track, delta time included, without loading a lazy payload
+        """
+        size = len(self.time_bytes) + len(self._event_bytes)
+        if self.payload is not None:
+            size += len(self.payload)
+        return size
+
+    def startswith(self, prefix):
+        """
+        Same as event_bytes.startswith, without loading a lazy payload unless the prefix reaches into the data
+        """
+        if self.payload is not None and len(prefix) > len(self._event_bytes):
+            self._load_payload()
+        return self._event_bytes.startswith(prefix)
+
+    def read_file(self, midi_file, source=None, running_status=None):
         """
         Reads in a midi event (starting with time delta) from a file.  midi_file is an open file object
-        and the current pointer must be at the beginning of the event.
+        and the current pointer must be at the beginning of the event.  When source, the name of the file, is
+        given, sysex and meta data of LAZY_PAYLOAD_SIZE bytes or more is skipped and left as a Payload reference
+        that is only read when the event bytes or data are used.  running_status is the status of the previous
+        channel event (see next_running_status); a data byte where the status should be then repeats that status,
+        and the status is put back in event_bytes.
         """
 
         # When called save the position as the beginning of this event
@@ -75,28 +226,45 @@ class TrackEvent:
 
         # Read the first byte of the event data which contains the type
         type_byte = midi_file.read(1)
-        self.event_bytes.extend(type_byte)
+        if running_status is not None and type_byte and type_byte[0] < 0x80:
+            # Running status, the byte read is the first data byte
+            self.running_status = True
+            midi_file.seek(-1, 1)
+            type_byte = bytes((running_status,))
+        self._event_bytes.extend(type_byte)
 
         # Now that the first byte has been loaded into event_bytes, we can use the type property
         if self.type == self.TRACK_PROGRAM:
             # no further bytes are needed
             pass
         elif self.type == self.SYSEX or self.type == self.META:
-            # get the SYSEX/META id/subtype
-            subtype = midi_file.read(1)
-            self.event_bytes.extend(subtype)
-            subint = int.from_bytes(subtype, byteorder='big', signed=False)
-            if self.type == self.SYSEX:
-                self.subtype = f"ID=0x{subint:X}"
-            else:
-                self.subtype = midicodes.META_EVENT_TYPES[subint]
+            if self.type == self.META:
+                # get the META id/subtype, sysex has no type byte before the length
+                subtype = midi_file.read(1)
+                self._event_bytes.extend(subtype)
+                subint = int.from_bytes(subtype, byteorder='big', signed=False)
+                if subint in midicodes.META_EVENT_TYPES:
+                    self.subtype = midicodes.META_EVENT_TYPES[subint]
+                else:
+                    self.subtype = f"UNKNOWN META 0x{subint:X}"
             # get the length of the data
             length_bytes = util.read_var_len_quantity(midi_file)
-            self.event_bytes.extend(length_bytes)
+            self._event_bytes.extend(length_bytes)
             data_length = util.var_len_to_int(length_bytes)
-            # Get the event data
-            self.event_data = midi_file.read(data_length)
-            self.event_bytes.extend(self.event_data)
+            if source is not None and data_length >= LAZY_PAYLOAD_SIZE:
+                # Leave large data in the file until it is used
+                self.payload = Payload(source, midi_file.tell(), data_length)
+                if self.type == self.SYSEX:
+                    self.subtype = f"ID=0x{midi_file.read(1)[0]:X}"
+                    data_length -= 1
+                midi_file.seek(data_length, 1)
+            else:
+                # Get the event data
+                self.event_data = midi_file.read(data_length)
+                self.event_bytes.extend(self.event_data)
+                if self.type == self.SYSEX and data_length > 0:
+                    # The first data byte is the manufacturer ID
+                    self.subtype = f"ID=0x{self.event_data[0]:X}"
         elif self.type in (self.CHANNEL_NOTE,
                            self.CHANNEL_POLY_PRESSURE,
                            self.CHANNEL_CONTROLLER,
@@ -114,21 +282,110 @@ class TrackEvent:
 
         return
 
+    def refill(self, data, offset: int, base_offset=0, running_status=None):
+        """
+        Reads a midi event (starting with time delta) at offset in data, a bytes-like buffer of track events, into
+        this event in place and returns the offset of the next event.  The bytearrays of the event are cleared and
+        refilled rather than replaced, so a caller keeping the event must clone() it.  base_offset is the file
+        offset of data, used for event_offset, and running_status is as for read_file.
+        """
+        for name in ('time_bytes', '_event_bytes', '_event_data'):
+            if type(getattr(self, name)) is not bytearray:
+                setattr(self, name, bytearray())
+        self.payload = None
+        self.event_offset = base_offset + offset
+        self.time_bytes.clear()
+        self._event_bytes.clear()
+        self._event_data.clear()
+        self.subtype = ""
+        self.running_status = False
+
+        # Time delta, one byte at a time until bit 7 is clear
+        while True:
+            b = data[offset]
+            offset += 1
+            self.time_bytes.append(b)
+            if not b & 0x80:
+                break
+
+        if running_status is not None and data[offset] < 0x80:
+            self.running_status = True
+            self._event_bytes.append(running_status)
+        else:
+            self._event_bytes.append(data[offset])
+            offset += 1
+        event_type = self.type
+        if event_type == self.TRACK_PROGRAM:
+            # no further bytes are needed
+            pass
+        elif event_type == self.SYSEX or event_type == self.META:
+            if event_type == self.META:
+                subint = data[offset]
+                offset += 1
+                self._event_bytes.append(subint)
+                if subint in midicodes.META_EVENT_TYPES:
+                    self.subtype = midicodes.META_EVENT_TYPES[subint]
+                else:
+                    self.subtype = f"UNKNOWN META 0x{subint:X}"
+            # Length of the data
+            data_length = 0
+            while True:
+                b = data[offset]
+                offset += 1
+                self._event_bytes.append(b)
+                data_length = (data_length << 7) | (b & 0x7F)
+                if not b & 0x80:
+                    break
+            self._event_data.extend(data[offset:offset + data_length])
+            offset += data_length
+            if event_type == self.SYSEX and data_length > 0:
+                self.subtype = f"ID=0x{self._event_data[0]:X}"
+        elif event_type in (self.CHANNEL_NOTE,
+                            self.CHANNEL_POLY_PRESSURE,
+                            self.CHANNEL_CONTROLLER,
+                            self.CHANNEL_PITCH):
+            self._event_data.extend(data[offset:offset + 2])
+            offset += 2
+        elif event_type in (self.CHANNEL_PROGRAM, self.CHANNEL_PRESSURE):
+            self._event_data.extend(data[offset:offset + 1])
+            offset += 1
+        else:
+            raise RuntimeError("Unknown MIDI event 0x{:X}".format(self._event_bytes[0]))
+        self._event_bytes.extend(self._event_data)
+
+        return offset
+
+    @property
+    def next_running_status(self):
+        """
+        The running status after this event: its status for a channel event, None after sysex and meta events,
+        which cancel it
+        """
+        if self.is_channel_event:
+            return self._event_bytes[0]
+        return None
+
     def set_delta_ticks(self, delta: int):
         self.time_bytes = util.int_to_var_len(delta)
 
     @property
     def time_signature(self):
-        if self.type == self.META and self.event_bytes[1] == 0x58:
+        if self.type == self.META and self._event_bytes[1] == 0x58:
             return TimeSignature(self.event_data)
         return None
 
+    @property
+    def smpte_offset(self):
+        if self.type == self.META and self._event_bytes[1] == 0x54:
+            return SmpteOffset(self.event_data)
+        return None
+
     @property
     def tempo(self):
         """
         Tempo in microsonds per quarternote
         """
-        if self.type == self.META and self.event_bytes[1] == 0x51:
+        if self.type == self.META and self._event_bytes[1] == 0x51:
             return int.from_bytes(self.event_data, byteorder="big", signed=False)
         return False
 
@@ -138,7 +395,7 @@ class TrackEvent:
 
     @property
     def type(self):
-        event_type = self.event_bytes[0]
+        event_type = self._event_bytes[0]
         event_nibble = event_type & 0xF0
         if event_type < 0x80:
             return self.TRACK_PROGRAM
@@ -171,11 +428,11 @@ class TrackEvent:
     @property
     def description(self):
 
-        event_id = self.event_bytes[0]
+        event_id = self._event_bytes[0]
         if self.type == self.TRACK_PROGRAM:
             return "0x{:X} ({}) Track Program '{}'".format(event_id, event_id, midicodes.PROGRAMS[event_id])
         elif self.type == self.META:
-            meta_id = self.event_bytes[1]
+            meta_id = self._event_bytes[1]
             if meta_id in midicodes.META_EVENT_TYPES:
                 meta_name = midicodes.META_EVENT_TYPES[meta_id]
             else:
@@ -186,14 +443,20 @@ class TrackEvent:
                 info = f" {TimeSignature.string(self.event_bytes)}"
             elif meta_id == 0x51:
                 info = f" {self.tempo}us/q  ({util.microseconds_to_bpm(self.tempo)}bpm)"
+            elif meta_id == 0x54:
+                info = f" {self.smpte_offset}"
+            elif self.payload is not None:
+                info = f" *{len(self.payload)} bytes*"
             else:
                 metadata = self.metadata
                 if len(metadata) > 0:
                     info = f" '{self.metadata}'"
             return f"0x{event_id:X} Meta 0x{meta_id:X} ({meta_id}) {meta_name}{info}"
         elif self.type == self.SYSEX:
-            if len(self.event_bytes) > 2:
-                sysex_data = util.hex_dump(self.event_bytes[2:])
+            if self.payload is not None:
+                sysex_data = f"*{len(self.payload)} bytes*"
+            elif len(self.event_data) > 0:
+                sysex_data = util.hex_dump(self.event_data)
             else:
                 sysex_data = "*no data*"
             return "0x{:X} Sysex '{}'".format(event_id, sysex_data)
@@ -276,11 +539,29 @@ class TrackEvent:
         self.event_bytes[0] = channel_command
 
     def copy(self, delta_ticks=0):
+        """
+        Returns an independent copy of the event with delta_ticks as its delta time
+        """
         new_event = TrackEvent()
-        new_event.event_bytes = self.event_bytes
+        new_event.event_offset = self.event_offset
+        # A lazy payload is shared, it is never modified
+        new_event.event_bytes = bytearray(self._event_bytes)
+        new_event.event_data = bytearray(self._event_data)
+        new_event.payload = self.payload
+        new_event.subtype = self.subtype
+        new_event.running_status = self.running_status
         new_event.time_bytes = util.int_to_var_len(delta_ticks)
         return new_event
 
+    def clone(self):
+        """
+        Returns an independent copy of the event with the same delta time.  Events from get_events(reuse=True) are
+        refilled in place, so use this to keep one.
+        """
+        new_event = self.copy()
+        new_event.time_bytes = bytearray(self.time_bytes)
+        return new_event
+
     def __str__(self):
         return self.description
 
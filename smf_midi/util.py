@@ -1,5 +1,4 @@
 import logging
-import smf_midi
 
 root_logger = logging.getLogger()
 LOG_FORMAT = '%(levelname)-8s %(message)s'
@@ -285,6 +284,8 @@ def merge_track_events(tracks):
     :param tracks: list of list of TrackEvent objects
     :return: list of TrackEvent objects
     """
+    # Imported here as trackevent imports this module
+    from .trackevent import TrackEvent
 
     merged_track = []
     track_count = len(tracks)
@@ -304,7 +305,7 @@ def merge_track_events(tracks):
                 break
             if event.get_delta_ticks() != 0:
                 break
-            if event.type_desc in smf_midi.TrackEvent.NOTE_EVENTS:
+            if event.type_desc in TrackEvent.NOTE_EVENTS:
                 break
             merged_track.append(track.pop(0))
             pulled += 1
@@ -400,7 +401,7 @@ def merge_track_events(tracks):
                     track_times[idx] = None
 
     # Create a new end of track event at delta 0 and add it to the end of the track
-    eot_event = smf_midi.TrackEvent(bytearray(b'\x00') + smf_midi.TrackEvent.END_OF_TRACK_MARKER)
+    eot_event = TrackEvent(bytearray(b'\x00') + TrackEvent.END_OF_TRACK_MARKER)
     merged_track.append(eot_event)
 
     return merged_track
@@ -414,6 +415,7 @@ def filter_events(events):
     :param events: list of events
     :return: int - number of events dropped
     """
+    from .trackevent import TrackEvent
 
     if type(events) is not list:
         raise ValueError("events must be a list of TrackEvent objects")
@@ -441,7 +443,7 @@ def filter_events(events):
         event = events[idx]
 
         # Events to keep, increment the idx to skip over it
-        if event.type_desc in smf_midi.TrackEvent.NOTE_EVENTS or event.is_time_signature \
+        if event.type_desc in TrackEvent.NOTE_EVENTS or event.is_time_signature \
                 or event.is_tempo or event.is_end_of_track:
             event.set_delta_ticks(current_ticks - previous_ticks)
             previous_ticks = current_ticks
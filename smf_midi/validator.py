@@ -0,0 +1,222 @@
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+from .midicodes import HEADER_INDICATOR, TRACK_INDICATOR, SMPTE_FRAME_RATES
+
+logger = logging.getLogger("Validator")
+
+# Number of data bytes following each channel status (indexed by the high nibble)
+CHANNEL_DATA_LENGTHS = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+
+# Meta events with a fixed data length
+META_LENGTHS = {0x00: 2, 0x20: 1, 0x21: 1, 0x2F: 0, 0x51: 3, 0x54: 5, 0x58: 4, 0x59: 2}
+
+# Variable length quantities are at most 4 bytes in a midi file
+MAX_VAR_LEN_BYTES = 4
+
+
+class Problem:
+
+    def __init__(self, offset: int, message: str):
+        self.offset = offset
+        self.message = message
+
+    def __str__(self):
+        return f"0x{self.offset:X} ({self.offset}): {self.message}"
+
+    def __repr__(self):
+        return f"Problem({self.offset}, {self.message!r})"
+
+
+def _read_var_len(data, idx: int, end: int):
+    """
+    Returns (value, next index) for the variable length quantity at idx or (None, idx) if it is malformed
+    """
+    value = 0
+    for count in range(MAX_VAR_LEN_BYTES):
+        if idx >= end:
+            return None, idx
+        b = data[idx]
+        idx += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, idx
+    return None, idx
+
+
+def validate_track(data, start: int, end: int, problems: list):
+    """
+    Scans the events of a track chunk in data from start (first event) to end (end of chunk) appending any
+    problems found.  Only lengths and status bytes are checked; event data is skipped without decoding.
+    """
+    idx = start
+    running_status = None
+    end_of_track = None
+    while idx < end:
+        event_offset = idx
+        if end_of_track is not None:
+            problems.append(Problem(event_offset, f"{end - idx} bytes follow End of Track in chunk"))
+            return
+
+        delta, idx = _read_var_len(data, idx, end)
+        if delta is None:
+            problems.append(Problem(event_offset, "Malformed or truncated delta time"))
+            return
+        if idx >= end:
+            problems.append(Problem(event_offset, "Delta time without event at end of track"))
+            return
+
+        status = data[idx]
+        if status < 0x80:
+            # Running status--the previous channel status applies and this byte is data
+            if running_status is None:
+                problems.append(Problem(idx, f"Data byte 0x{status:02X} without running status"))
+                return
+            status = running_status
+        else:
+            idx += 1
+
+        if status == 0xFF:
+            running_status = None
+            if idx >= end:
+                problems.append(Problem(event_offset, "Truncated meta event"))
+                return
+            meta_id = data[idx]
+            if meta_id & 0x80:
+                problems.append(Problem(idx, f"Invalid meta event type 0x{meta_id:02X}"))
+            length, idx = _read_var_len(data, idx + 1, end)
+            if length is None:
+                problems.append(Problem(event_offset, "Malformed meta event length"))
+                return
+            if meta_id in META_LENGTHS and length != META_LENGTHS[meta_id]:
+                problems.append(Problem(event_offset, f"Meta event 0x{meta_id:02X} has length {length}, "
+                                                      f"expected {META_LENGTHS[meta_id]}"))
+            if meta_id == 0x2F:
+                end_of_track = event_offset
+        elif status == 0xF0 or status == 0xF7:
+            running_status = None
+            length, idx = _read_var_len(data, idx, end)
+            if length is None:
+                problems.append(Problem(event_offset, "Malformed sysex length"))
+                return
+        elif status >= 0xF0:
+            problems.append(Problem(idx - 1, f"System message 0x{status:02X} is not valid in a midi file"))
+            return
+        else:
+            running_status = status
+            length = CHANNEL_DATA_LENGTHS[status >> 4]
+            for data_idx in range(idx, min(idx + length, end)):
+                if data[data_idx] & 0x80:
+                    problems.append(Problem(data_idx, f"Status byte 0x{data[data_idx]:02X} found in data of "
+                                                      f"channel event 0x{status:02X}"))
+                    break
+
+        if idx + length > end:
+            problems.append(Problem(event_offset, f"Event data ({length} bytes) runs past end of track chunk"))
+            return
+        idx += length
+
+    if end_of_track is None:
+        problems.append(Problem(end, "Track does not end with End of Track"))
+
+
+def validate_bytes(data):
+    """
+    Validates the structure of an entire midi file held in data (bytes, bytearray, memoryview or mmap) and
+    returns a list of Problem objects (empty when the file is valid).
+    """
+    problems = []
+    size = len(data)
+
+    if size < 14 or data[0:4] != HEADER_INDICATOR:
+        problems.append(Problem(0, f"File should start with {HEADER_INDICATOR} and a 6 byte header"))
+        return problems
+
+    header_length = struct.unpack('>I', data[4:8])[0]
+    if header_length < 6:
+        problems.append(Problem(4, f"Header length {header_length} is less than 6"))
+        return problems
+    if 8 + header_length > size:
+        problems.append(Problem(4, f"Header length {header_length} exceeds file size {size}"))
+        return problems
+
+    midi_type, track_count, division = struct.unpack('>HHH', data[8:14])
+    if midi_type > 2:
+        problems.append(Problem(8, f"Invalid midi type {midi_type}"))
+    if midi_type == 0 and track_count != 1:
+        problems.append(Problem(10, f"Type 0 file has {track_count} tracks"))
+    if division & 0x8000:
+        if 256 - (division >> 8) not in SMPTE_FRAME_RATES or division & 0xFF == 0:
+            problems.append(Problem(12, f"Invalid SMPTE time division 0x{division:04X}"))
+    elif division == 0:
+        problems.append(Problem(12, "Time division is 0"))
+
+    offset = 8 + header_length
+    tracks_found = 0
+    while offset < size:
+        if offset + 8 > size:
+            problems.append(Problem(offset, f"{size - offset} trailing bytes after last chunk"))
+            break
+        chunk_type = bytes(data[offset:offset + 4])
+        chunk_length = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+        chunk_end = offset + 8 + chunk_length
+        if chunk_end > size:
+            problems.append(Problem(offset + 4, f"Chunk length {chunk_length} exceeds file size by "
+                                                f"{chunk_end - size} bytes"))
+            chunk_end = size
+        if chunk_type == TRACK_INDICATOR:
+            validate_track(data, offset + 8, chunk_end, problems)
+            tracks_found += 1
+        elif not all(0x20 <= c <= 0x7E for c in chunk_type):
+            # Unknown chunks with printable names may be skipped, anything else means the lengths are wrong
+            problems.append(Problem(offset, f"Invalid chunk type {chunk_type}"))
+            break
+        else:
+            logger.debug(f"Skipping unknown chunk {chunk_type} at 0x{offset:X}")
+        offset = chunk_end
+
+    if tracks_found != track_count:
+        problems.append(Problem(10, f"Header declares {track_count} tracks but {tracks_found} were found"))
+
+    return problems
+
+
+def validate_file(file_name: str):
+    """
+    Validates a midi file by mapping it into memory.  Returns a list of Problem objects.
+    """
+    with open(file_name, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return [Problem(0, "File is empty")]
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return validate_bytes(data)
+
+
+def _validate_file_worker(file_name: str):
+    try:
+        return file_name, validate_file(file_name)
+    except OSError as e:
+        return file_name, [Problem(0, f"{type(e).__name__}: {e}")]
+
+
+def validate_files(file_names, **kwargs):
+    """
+    Generator validating files with a pool of worker processes, yielding (file name, problems) in completion order
+    """
+    workers = None
+    for k, v in kwargs.items():
+        if k == 'workers':
+            workers = v
+        else:
+            raise ValueError(f"Keyword '{k}' invalid")
+
+    if workers == 1:
+        for file_name in file_names:
+            yield _validate_file_worker(file_name)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(_validate_file_worker, file_names, chunksize=16):
+            yield result
@@ -1,51 +1,221 @@
+import io
 import logging
+import os
+import shutil
 import struct
+import tempfile
 from .trackevent import TrackEvent
+from .track import Track
 from .midicodes import HEADER_INDICATOR, TRACK_INDICATOR
 from . import util
 
 
 logger = logging.getLogger("FileWriter")
 
+# Block size used when copying already encoded data into the file
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Encoded track data is kept in memory up to this many bytes before spilling to a temporary file
+DEFAULT_SPILL_SIZE = 4 * 1024 * 1024
+
+# Controllers never dropped as repeats when optimizing: data entry and increment/decrement and (N)RPN selection,
+# whose effect depends on the other (N)RPN controllers, and the channel mode messages, which are commands
+UNLATCHED_CONTROLLERS = frozenset((0x06, 0x26, 0x60, 0x61, 0x62, 0x63, 0x64, 0x65) + tuple(range(0x78, 0x80)))
+
+# Channel mode messages that stop every note on the channel (all sound off, all notes off, omni and mono/poly)
+ALL_NOTES_OFF_CONTROLLERS = frozenset((0x78, 0x7B, 0x7C, 0x7D, 0x7E, 0x7F))
+RESET_ALL_CONTROLLERS = 0x79
+
 
 class FileWriter:
+    """
+    Writes a midi file one track at a time.  The filename may also be an open binary file object.
+
+    By default the track lengths and track count are patched in the header by seeking back, so the output must be
+    seekable.  With stream=True each track is assembled in a buffer (in memory up to spill_size bytes, then a
+    temporary file) and written with its length once closed, so nothing is ever rewritten and the output can be a
+    pipe, socket or compressed stream.  The number of tracks must then be given up front with track_count.
 
-    def __init__(self, filename: str, midi_type: int, time_division: int):
+    With optimize=True, write_event leaves out the status byte of a channel event that repeats the status of the one
+    before (running status).  In type 0 and type 2 files, where a track is all that plays, it also drops events
+    that cannot change what is heard.  These are repeats of a controller, pitch bend, pressure or program (unless
+    the bank changed), and note offs with no note sounding.  Dropped delta times are added to the next event
+    written, so absolute times do not change.  Raw bytes (write_bytes, copy_range, add_tempo...) cannot take the
+    delta, so the last dropped event is written before them with it, as it is when the track closes.  bytes_saved
+    and events_dropped count the savings.  Type 1 tracks are only compacted because other tracks can change the same
+    channel in between.
+    """
+
+    def __init__(self, filename, midi_type: int, time_division: int, **kwargs):
         if midi_type not in [0, 1, 2]:
             raise ValueError(f"Invalid midi type '{midi_type}'")
         if time_division < 1:
             raise ValueError(f"Time division must be greater than 0")
+        self.stream = False
+        self.declared_track_count = None
+        self.spill_size = DEFAULT_SPILL_SIZE
+        self.optimize = False
+        for k, v in kwargs.items():
+            if k == 'stream':
+                self.stream = bool(v)
+            elif k == 'track_count':
+                self.declared_track_count = int(v)
+            elif k == 'spill_size':
+                self.spill_size = int(v)
+            elif k == 'optimize':
+                self.optimize = bool(v)
+            else:
+                raise ValueError(f"Keyword '{k}' invalid")
+        if self.stream and self.declared_track_count is None:
+            raise ValueError("Track count must be provided when streaming")
         self.filename = filename
         self.file_handle = None
+        self.output_handle = None
         self.type = midi_type
         self.time_division = time_division
         self.current_track_offset = None
         self.track_count = 0
         self.extra_bytes = bytearray()
+        self.bytes_saved = 0
+        self.events_dropped = 0
+        self._reset_optimizer()
+
+    def _reset_optimizer(self):
+        # State of the track being written, for optimize
+        self._running_status = None
+        self._pending_delta = 0
+        self._pending_event = None
+        self._values = {}
+        self._notes = {}
+        self._bank_changed = set()
 
     def __enter__(self):
         self.open()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+        if exc_type is None:
+            self.close()
+            return
+        # Do not hide the exception that stopped the writing behind a track count error
+        try:
+            self.close()
+        except RuntimeError as e:
+            logger.error(str(e))
         return
 
+    def _offset(self):
+        # Non-seekable outputs have no position to report
+        try:
+            return f"0x{self.file_handle.tell():X}"
+        except (OSError, io.UnsupportedOperation):
+            return "?"
+
     def write_bytes(self, data, desc=""):
-        logger.debug(f"Write {desc} at 0x{self.file_handle.tell():X}: {util.hex_dump(data)}")
+        self._write_pending()
+        self._write(data, desc)
+
+    def _write(self, data, desc=""):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Write {desc} at {self._offset()}: {util.hex_dump(data)}")
+        # Raw bytes can be anything, so the next event needs its status byte
+        self._running_status = None
         self.file_handle.write(data)
 
+    def copy_bytes(self, source, desc=""):
+        """
+        Copy the rest of a file-like source into the file in blocks, e.g. already encoded track events
+        """
+        self._write_pending()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Copy {desc} at {self._offset()}")
+        shutil.copyfileobj(source, self.file_handle, COPY_BLOCK_SIZE)
+
+    def copy_range(self, source, offset: int, length: int, desc=""):
+        """
+        Copy length bytes from offset of an open binary source file, in the kernel when the output is a plain file
+        (copy_file_range, then sendfile) and through Python blocks otherwise
+        """
+        self._write_pending()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Copy {desc} ({length} bytes from offset 0x{offset:X}) at {self._offset()}")
+        self._running_status = None
+        out_fd = None
+        if not self.stream:
+            # Stream mode tracks are assembled in a spooled buffer, which must not be rolled over by fileno
+            try:
+                out_fd = self.file_handle.fileno()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                out_fd = None
+        if out_fd is not None:
+            self.file_handle.flush()
+            out_offset = self.file_handle.seek(0, 2)
+            os.lseek(out_fd, out_offset, os.SEEK_SET)
+            copied = 0
+            for copy_function in ('copy_file_range', 'sendfile'):
+                if not hasattr(os, copy_function):
+                    continue
+                try:
+                    while copied < length:
+                        if copy_function == 'copy_file_range':
+                            count = os.copy_file_range(source.fileno(), out_fd, length - copied, offset + copied)
+                        else:
+                            count = os.sendfile(out_fd, source.fileno(), offset + copied, length - copied)
+                        if count == 0:
+                            raise RuntimeError(f"Source ended {length - copied} bytes before end of chunk")
+                        copied += count
+                except OSError:
+                    # Not supported for this pair of files, carry on from where it stopped
+                    continue
+                break
+            # The file object caches its position, so re-sync it with the descriptor
+            self.file_handle.seek(out_offset + copied)
+            offset += copied
+            length -= copied
+        source.seek(offset)
+        while length > 0:
+            block = source.read(min(length, COPY_BLOCK_SIZE))
+            if len(block) == 0:
+                raise RuntimeError(f"Source ended {length} bytes before end of chunk")
+            self.file_handle.write(block)
+            length -= len(block)
+
+    def copy_track(self, track: Track):
+        """
+        Copy a track chunk byte for byte from its source file without decoding the events, e.g. the tracks that
+        are not changed by an edit.  The chunk (header included) is copied in the kernel where possible.
+        """
+        if self.track_count >= 1 and self.type == 0:
+            raise RuntimeError("Type 0 files cannot have more than one track")
+        if self.file_handle is None:
+            raise RuntimeError("File not opened")
+        if self.current_track_offset is not None:
+            raise RuntimeError("Close existing track before copying a track")
+        if self.stream and self.track_count >= self.declared_track_count:
+            raise RuntimeError(f"Header declares {self.declared_track_count} tracks")
+        self.track_count += 1
+        with track.open() as source:
+            self.copy_range(source, track.chunk_offset, track.chunk_length,
+                            f"track {self.track_count - 1} from '{track.filename}'")
+
     def write_int(self, number: int, length: int, desc=""):
         data = number.to_bytes(length, 'big')
-        self.write_bytes(data, desc)
+        self._write(data, desc)
 
     def open(self):
-        self.file_handle = open(self.filename, "wb")
+        if hasattr(self.filename, 'write'):
+            self.output_handle = self.filename
+        else:
+            self.output_handle = open(self.filename, "wb")
+        self.file_handle = self.output_handle
         self.write_bytes(HEADER_INDICATOR, "File header")
         header_length = struct.pack('>I', (6 + len(self.extra_bytes)))
         self.write_bytes(header_length, "hdr_len")
         self.write_int(self.type, 2, "type")
-        self.write_int(1, 2, "track_count")
+        if self.stream:
+            self.write_int(self.declared_track_count, 2, "track_count")
+        else:
+            self.write_int(1, 2, "track_count")
         self.write_int(self.time_division, 2, "division")
         if len(self.extra_bytes) > 0:
             self.write_bytes(self.extra_bytes)
@@ -53,34 +223,62 @@ class FileWriter:
     def close(self):
         if self.current_track_offset is not None:
             self.close_track()
-        self.file_handle.seek(10)
-        self.write_int(self.track_count, 2, "track_count_rewrite")
-        self.file_handle.seek(0, 2)
-        self.file_handle.close()
+        error = None
+        if self.stream:
+            # The header has already been sent, so the output is not a valid file
+            if self.track_count != self.declared_track_count:
+                error = f"Header declares {self.declared_track_count} tracks but {self.track_count} were written"
+        else:
+            self.file_handle.seek(10)
+            self.write_int(self.track_count, 2, "track_count_rewrite")
+            self.file_handle.seek(0, 2)
+        # Only close the output if it was opened here
+        if self.output_handle is self.filename:
+            self.output_handle.flush()
+        else:
+            self.output_handle.close()
         self.file_handle = None
+        self.output_handle = None
+        if error is not None:
+            raise RuntimeError(error)
 
     def close_track(self):
         if self.current_track_offset is None:
             logger.warning("close_track called but no track open")
             return
+        # Dropped events after the last event written still take time, keep the last one so the track length holds
+        self._write_pending()
         track_event_length = self.file_handle.tell() - self.current_track_offset - 8
         self.file_handle.seek(self.current_track_offset + 4)
         self.write_int(track_event_length, 4, "event_len_rewrite")
         self.current_track_offset = None
         self.file_handle.seek(0, 2)
+        if self.stream:
+            # The track buffer now has its length, copy it to the output
+            track_buffer = self.file_handle
+            track_buffer.seek(0)
+            self.file_handle = self.output_handle
+            self.copy_bytes(track_buffer, f"track {self.track_count - 1}")
+            track_buffer.close()
 
     def new_track(self):
-        if self.track_count > 1 and self.type == 0:
+        if self.track_count >= 1 and self.type == 0:
             raise RuntimeError("Type 0 files cannot have more than one track")
         if self.file_handle is None:
             raise RuntimeError("File not opened")
         if self.current_track_offset is not None:
             raise RuntimeError("Close existing track before creating a new one")
+        if self.stream:
+            if self.track_count >= self.declared_track_count:
+                raise RuntimeError(f"Header declares {self.declared_track_count} tracks")
+            # Assemble the track in a buffer so its length is known before it is written
+            self.file_handle = tempfile.SpooledTemporaryFile(max_size=self.spill_size)
         self.file_handle.seek(0, 2)
         self.current_track_offset = self.file_handle.tell()
         self.track_count += 1
+        self._reset_optimizer()
         logger.debug(f"Starting new track {self.track_count - 1} at offset 0x{self.current_track_offset:X}")
-        self.write_bytes(TRACK_INDICATOR)
+        self._write(TRACK_INDICATOR)
         self.write_int(0, 4, "event_len")
 
     def write_event(self, event: TrackEvent, delta_time=None):
@@ -88,7 +286,114 @@ class FileWriter:
             delta_time_bytes = event.time_bytes
         else:
             delta_time_bytes = util.int_to_var_len(delta_time)
-        self.write_bytes(delta_time_bytes + event.event_bytes, "event")
+        if self.optimize:
+            self._write_optimized(event, delta_time_bytes)
+            return
+        self._write_full(event, delta_time_bytes)
+
+    def _write_full(self, event: TrackEvent, delta_time_bytes):
+        if event.payload is not None:
+            # Data left in the source file is copied from there without loading it
+            self._write(delta_time_bytes + event.header_bytes, "event")
+            with open(event.payload.file_name, "rb") as source:
+                self.copy_range(source, event.payload.offset, len(event.payload), "event data")
+            return
+        self._write(delta_time_bytes + event.event_bytes, "event")
+
+    def _write_optimized(self, event: TrackEvent, delta_time_bytes):
+        size = len(delta_time_bytes) + event.size - len(event.time_bytes)
+        delta = self._pending_delta + util.var_len_to_int(delta_time_bytes)
+        if self.type != 1 and self._is_redundant(event):
+            self._pending_delta = delta
+            self._pending_event = bytes(event.event_bytes)
+            self.events_dropped += 1
+            self.bytes_saved += size
+            return
+        self._pending_delta = 0
+        self._pending_event = None
+        delta_time_bytes = util.int_to_var_len(delta)
+        if not event.is_channel_event:
+            self._write_full(event, delta_time_bytes)
+            self.bytes_saved += size - (len(delta_time_bytes) + event.size - len(event.time_bytes))
+            return
+        status = event.event_bytes[0]
+        if status == self._running_status:
+            data = delta_time_bytes + event.event_bytes[1:]
+        else:
+            data = delta_time_bytes + event.event_bytes
+        self._write(data, "event")
+        self._running_status = status
+        self.bytes_saved += size - len(data)
+
+    def _write_pending(self):
+        # Writes the last dropped event with the delta times of the events dropped since the last one written
+        if self._pending_event is None:
+            return
+        data = util.int_to_var_len(self._pending_delta) + self._pending_event
+        self._pending_delta = 0
+        self._pending_event = None
+        self._write(data, "dropped event kept for its delta time")
+        self._running_status = None
+        self.events_dropped -= 1
+        self.bytes_saved -= len(data)
+
+    def _is_redundant(self, event: TrackEvent):
+        """
+        Updates the state of the track with an event and returns True if the event cannot change what is heard
+        """
+        if event.type == event.SYSEX:
+            # A sysex message may reset the device, so nothing before it is known any more
+            self._values.clear()
+            self._notes.clear()
+            self._bank_changed.clear()
+            return False
+        if not event.is_channel_event:
+            return False
+        event_bytes = event.event_bytes
+        channel = event_bytes[0] & 0x0F
+        command = event_bytes[0] & 0xF0
+        if command == 0x90 and event_bytes[2] > 0:
+            key = (channel, event_bytes[1])
+            self._notes[key] = self._notes.get(key, 0) + 1
+            return False
+        if command in (0x80, 0x90):
+            key = (channel, event_bytes[1])
+            if self._notes.get(key, 0) < 1:
+                return True
+            self._notes[key] -= 1
+            return False
+        if command == 0xB0:
+            controller = event_bytes[1]
+            if controller == RESET_ALL_CONTROLLERS:
+                # Programs survive a reset, the controller values on the channel are no longer known
+                for key in [key for key in self._values if key[0] == channel and key[1] != 0xC0]:
+                    del self._values[key]
+            elif controller in ALL_NOTES_OFF_CONTROLLERS:
+                for key in [key for key in self._notes if key[0] == channel]:
+                    del self._notes[key]
+            if controller in UNLATCHED_CONTROLLERS:
+                return False
+            if self._is_repeat((channel, command, controller), event_bytes[2]):
+                return True
+            if controller in (0x00, 0x20):
+                # A program change after a new bank selects a new sound even if the program number is the same
+                self._bank_changed.add(channel)
+            return False
+        if command == 0xC0:
+            if channel in self._bank_changed:
+                self._bank_changed.discard(channel)
+                self._values[(channel, command)] = event_bytes[1]
+                return False
+            return self._is_repeat((channel, command), event_bytes[1])
+        if command in (0xD0, 0xE0):
+            return self._is_repeat((channel, command), bytes(event_bytes[1:]))
+        return False
+
+    def _is_repeat(self, key, value):
+        if self._values.get(key) == value:
+            return True
+        self._values[key] = value
+        return False
 
     def add_time_signature(self, numerator: int, denominator: int, **kwargs):
         metronome = 18
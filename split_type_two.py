@@ -0,0 +1,60 @@
+import argparse
+import smf_midi
+import logging
+
+
+opt = None
+logger = logging.getLogger("split_type_two")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Split a Type 2 MIDI file into one file per pattern')
+
+    # Positional required arguments
+    parser.add_argument('file_in',
+                        help="Name of the input MIDI file")
+    parser.add_argument('file_out',
+                        help="Output file name format, e.g. 'song_{}.midi' ({} is replaced by the pattern number)")
+
+    # Optional keyword arguments
+    parser.add_argument('--type', required=False, type=int, default=0, choices=[0, 1],
+                        help="MIDI type of the output files (default 0)")
+    parser.add_argument('--pattern', required=False, type=int, action='append',
+                        help="Pattern number to extract (may be repeated, default is all patterns)")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    midi_reader = smf_midi.FileReader(opt.file_in)
+    if midi_reader.type != 2:
+        raise RuntimeError(f"Midi file '{opt.file_in}' is type {midi_reader.type}, not a type 2 file")
+
+    kwargs = {}
+    if opt.pattern:
+        kwargs['include'] = opt.pattern
+
+    # Each pattern is streamed straight into its own output file, so only one pattern is ever being read
+    for track in midi_reader.get_patterns(**kwargs):
+        pattern_no = midi_reader.tracks.index(track)
+        file_out = opt.file_out.format(pattern_no)
+        logger.info(f"Writing pattern {pattern_no} to '{file_out}'")
+        with smf_midi.FileWriter(file_out, opt.type, midi_reader.time) as midi_writer:
+            midi_writer.new_track()
+            for event in track.get_events():
+                midi_writer.write_event(event)
+
+
+if __name__ == '__main__':
+    main()
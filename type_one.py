@@ -0,0 +1,44 @@
+import argparse
+import logging
+import smf_midi
+from smf_midi.split import split_channels
+
+opt = None
+logger = logging.getLogger("type_one")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Convert Type 0 MIDI to Type 1 with one track per channel')
+
+    # Positional required arguments
+    parser.add_argument('file_in',
+                        help="Name of the input MIDI file")
+    parser.add_argument('file_out',
+                        help="Name of the output MIDI file")
+
+    # Optional keyword arguments
+    parser.add_argument('--spill-size', required=False, type=int, dest='spill_size',
+                        default=smf_midi.split.DEFAULT_SPILL_SIZE,
+                        help="Bytes buffered in memory per track before using a temporary file")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
+
+    channels = split_channels(opt.file_in, opt.file_out, spill_size=opt.spill_size)
+    logger.info(f"Wrote conductor track and {len(channels)} channel tracks: {channels}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,15 @@
 import argparse
+import gzip
+import sys
 import smf_midi
 import logging
 
 
 opt = None
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("run_convert")
 
 
-def get_options():
+def get_options(args=None):
     """
     Parses the command line options
     """
@@ -21,7 +22,7 @@ def get_options():
     parser.add_argument('file_in',
                         help="Name of the input MIDI file")
     parser.add_argument('file_out',
-                        help="Name of the output MIDI file")
+                        help="Name of the output MIDI file ('-' for stdout, '.gz' to compress)")
 
     # Optional keyword arguments
     parser.add_argument('--name', required=False,
@@ -30,26 +31,55 @@ def get_options():
                         help="Text for track--replace existing text")
     parser.add_argument('--squash', required=False, type=int,
                         help="Channel number to squash all notes into")
+    parser.add_argument('--pattern', required=False, type=int,
+                        help="Pattern (track) number to convert from a type 2 file")
+    parser.add_argument('--thin', required=False, type=float, metavar='TOLERANCE',
+                        help="Thin controller, pitch bend and pressure curves to within TOLERANCE (7 bit steps)")
+    parser.add_argument('--optimize', action="store_true", required=False,
+                        help="Use running status and drop redundant events")
     parser.add_argument('--debug', action="store_true", dest='debug', required=False,
                         help="Additional features for debugging")
-    opt = parser.parse_args()
+    opt = parser.parse_args(args)
 
 
-def main():
+def main(args=None):
 
     exclusions = []
 
-    get_options()
+    get_options(args)
+    smf_midi.util.set_logging(debug=opt.debug)
     if opt.squash and opt.squash not in range(1,16):
         raise ValueError("Squash value must be a channel number 1-15")
 
     midi_reader = smf_midi.FileReader(opt.file_in)
     if midi_reader.type == 0:
         raise RuntimeError(f"Midi file '{opt.file_in}' is already a type 0 file")
-    if midi_reader.type != 1:
+    if midi_reader.type == 2:
+        # Type 2 patterns are independent songs, so only one of them can become the type 0 track
+        if opt.pattern is None:
+            raise RuntimeError(f"Midi file '{opt.file_in}' is type 2--select a pattern with --pattern")
+        if opt.pattern not in range(midi_reader.track_count):
+            raise ValueError(f"Pattern must be between 0 and {midi_reader.track_count - 1}")
+        include = [opt.pattern]
+    elif midi_reader.type == 1:
+        include = list(range(midi_reader.track_count))
+    else:
         raise RuntimeError(f"Midi file type {midi_reader.type} not supported")
 
-    with smf_midi.FileWriter(opt.file_out, 0, midi_reader.time) as midi_writer:
+    # Non-seekable outputs are written in streaming mode (each track is buffered until its length is known)
+    writer_kwargs = {}
+    if opt.file_out == '-':
+        file_out = sys.stdout.buffer
+        writer_kwargs = {'stream': True, 'track_count': 1}
+    elif opt.file_out.endswith('.gz'):
+        file_out = gzip.open(opt.file_out, "wb")
+        writer_kwargs = {'stream': True, 'track_count': 1}
+    else:
+        file_out = opt.file_out
+    if opt.optimize:
+        writer_kwargs['optimize'] = True
+
+    with smf_midi.FileWriter(file_out, 0, midi_reader.time, **writer_kwargs) as midi_writer:
 
         midi_writer.new_track()
         if opt.name:
@@ -61,9 +91,23 @@ def main():
                 text_meta = smf_midi.TrackEvent.new_text(option_text)
                 midi_writer.write_event(text_meta)
             exclusions.append(text_meta.event_bytes[:2])
-        for event in midi_reader.get_events_from_tracks(omit_events=exclusions, squash=opt.squash):
+        events = midi_reader.get_events_from_tracks(include=include, omit_events=exclusions, squash=opt.squash or 0)
+        thinner = None
+        if opt.thin is not None:
+            thinner = smf_midi.thin.CurveThinner(tolerance=opt.thin)
+            events = thinner.thin(events)
+        for event in events:
             midi_writer.write_event(event)
 
+    if opt.optimize:
+        logger.info(f"Optimizing dropped {midi_writer.events_dropped} events and saved {midi_writer.bytes_saved} bytes")
+    if thinner is not None:
+        logger.info(f"Thinning removed {thinner.events_removed} of {thinner.events_in} events "
+                    f"({thinner.bytes_removed} of {thinner.bytes_in} bytes)")
+
+    if opt.file_out.endswith('.gz'):
+        file_out.close()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,57 @@
+import argparse
+import logging
+import sys
+from smf_midi import util
+from smf_midi.stats import find_midi_files
+from smf_midi.validator import validate_files
+
+opt = None
+logger = logging.getLogger("validate_midi")
+
+
+def get_options(args=None):
+    """
+    Parses the command line options
+    """
+    global opt
+
+    # Create a parser object
+    parser = argparse.ArgumentParser(description='Check the structure of MIDI files without decoding events')
+
+    # Positional required arguments
+    parser.add_argument('paths', nargs='+',
+                        help="MIDI files and/or directories to validate")
+
+    # Optional keyword arguments
+    parser.add_argument('--workers', required=False, type=int,
+                        help="Number of worker processes (default is the number of CPUs)")
+    parser.add_argument('--quiet', action="store_true", required=False,
+                        help="Only list the names of invalid files")
+    parser.add_argument('--debug', action="store_true", dest='debug', required=False,
+                        help="Additional features for debugging")
+    opt = parser.parse_args(args)
+
+
+def main(args=None):
+
+    get_options(args)
+    util.set_logging(debug=opt.debug)
+
+    file_names = find_midi_files(opt.paths)
+    invalid = 0
+    for file_name, problems in validate_files(file_names, workers=opt.workers):
+        if len(problems) < 1:
+            continue
+        invalid += 1
+        print(file_name)
+        if not opt.quiet:
+            for problem in problems:
+                print(f"    {problem}")
+
+    logger.info(f"{invalid} of {len(file_names)} files are invalid")
+    if invalid > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()